@@ -1,29 +1,258 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, Body
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import Binary
 import os
 import logging
 import hashlib
 import json
+import math
+import zlib
+import random
+import re
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter, ValidationError
+from typing import List, Optional, Literal
+from collections import deque
+from contextlib import contextmanager
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import secrets
 import asyncio
+import contextvars
+import time
+import html
+import socket
+from string import Template
+import threading
+import bisect
+import anyio
 import httpx
 import resend
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ==================== METRICS ====================
+# Minimal in-process Prometheus-style registry. Recording is a dict lookup and an
+# increment under a lock (Mongo command events arrive on driver threads).
+
+METRICS_REGISTRY = []
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(label_names, label_values, extra: dict = None) -> str:
+    pairs = list(zip(label_names, label_values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS_REGISTRY.append(self)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+    
+    def inc(self, *labels, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+    
+    def inc(self, *labels, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # Per-bucket (non-cumulative) counts incl. +Inf, then sum
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS_REGISTRY for line in metric.render()) + "\n"
+
+HTTP_REQUEST_DURATION = Histogram("veriqo_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = Gauge("veriqo_http_requests_in_flight", "HTTP requests currently being served", ("method",))
+AI_CACHE_LOOKUPS = Counter("veriqo_ai_cache_lookups_total", "ai_cache lookups by result", ("result",))
+SCRAPE_REQUESTS = Counter("veriqo_scrape_requests_total", "Amazon scrape attempts by outcome", ("outcome",))
+SCRAPE_DURATION = Histogram("veriqo_scrape_duration_seconds", "Amazon scrape latency by outcome", ("outcome",))
+LLM_REQUEST_DURATION = Histogram("veriqo_llm_request_duration_seconds", "LLM request latency", ("model",))
+TELEMETRY_EVENTS = Counter("veriqo_telemetry_events_total", "Buffered telemetry writes by collection and outcome", ("collection", "outcome"))
+MONGO_COMMAND_DURATION = Histogram("veriqo_mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+
+# Mongo commands issued on behalf of the current request ({command name: count}); None outside requests
+request_db_commands = contextvars.ContextVar("request_db_commands", default=None)
+
+# Per-endpoint budgets of Mongo commands issued before the response starts (cursor batches not
+# included). Exceeding one is logged and counted, and fails the budget tests in tests/.
+DB_COMMAND_BUDGETS = {
+    "GET /api/auth/me": 1,
+    "GET /api/history": 3,
+    "GET /api/history/export": 3,
+    "POST /api/analyze": 10,
+    "POST /api/compare": 8,
+    "POST /api/price-alerts/check": 5,
+    "GET /api/admin/stats": 3,
+    "GET /api/wishlist": 2,
+    "GET /api/price-alerts": 2,
+    "GET /api/products/{product_id}/price-history": 2,
+    "GET /api/insights": 2,
+    "GET /api/insights/{product_id}": 2,
+}
+DB_COMMANDS_EXEMPT_FROM_BUDGET = {"getMore", "killCursors", "endSessions"}
+DEBUG_DB_COMMANDS = os.environ.get("DEBUG_DB_COMMANDS", "").lower() in ("1", "true", "yes")
+
+PRICE_ALERT_EMAILS = Counter("veriqo_price_alert_emails_total", "Price drop digest emails by outcome", ("outcome",))
+DB_COMMAND_BUDGET_EXCEEDED = Counter("veriqo_db_command_budget_exceeded_total", "Requests over their Mongo command budget", ("route",))
+
+def detached_context() -> contextvars.Context:
+    """Context for background tasks started by a request, so their commands aren't counted against it"""
+    context = contextvars.copy_context()
+    context.run(request_db_commands.set, None)
+    return context
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records MongoDB command timings, and per-request command counts, from driver command-monitoring events"""
+    
+    def started(self, event):
+        # Motor runs commands on executor threads with a copy of the caller's context
+        counts = request_db_commands.get()
+        if counts is not None:
+            counts[event.command_name] = counts.get(event.command_name, 0) + 1
+    
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, "ok")
+    
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, "error")
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status = {"code": 500}
+        
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        HTTP_REQUESTS_IN_FLIGHT.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(method)
+            # Route template (e.g. /api/wishlist/{item_id}) keeps label cardinality bounded
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started, method, getattr(route, "path", "unmatched"), str(status["code"])
+            )
+
+class DbCommandBudgetMiddleware:
+    """
+    ASGI middleware counting the Mongo commands each request issues before its response starts,
+    checked against DB_COMMAND_BUDGETS. With DEBUG_DB_COMMANDS set, the counts are returned in
+    X-DB-Commands (budgeted total), X-DB-Command-Budget and X-DB-Command-Breakdown headers.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        counts = {}
+        
+        async def send_with_counts(message):
+            if message["type"] == "http.response.start":
+                total = sum(n for command, n in counts.items() if command not in DB_COMMANDS_EXEMPT_FROM_BUDGET)
+                route = f"{scope['method']} {getattr(scope.get('route'), 'path', '')}"
+                budget = DB_COMMAND_BUDGETS.get(route)
+                if budget is not None and total > budget:
+                    DB_COMMAND_BUDGET_EXCEEDED.inc(route)
+                    logging.warning(f"{route} issued {total} Mongo commands (budget {budget}): {counts}")
+                if DEBUG_DB_COMMANDS:
+                    headers = MutableHeaders(scope=message)
+                    headers["X-DB-Commands"] = str(total)
+                    headers["X-DB-Command-Breakdown"] = ",".join(f"{command}={n}" for command, n in sorted(counts.items()))
+                    if budget is not None:
+                        headers["X-DB-Command-Budget"] = str(budget)
+            await send(message)
+        
+        token = request_db_commands.set(counts)
+        try:
+            await self.app(scope, receive, send_with_counts)
+        finally:
+            request_db_commands.reset(token)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
@@ -36,11 +265,21 @@ AI_CONFIG = {
     "enabled": True,  # Emergency disable switch
     "max_tokens_per_request": 1000,  # Token limit per request
     "max_requests_per_user_per_day": 50,  # Rate limit
-    "cache_ttl_hours": 24,  # Cache duration
+    "cache_ttl_hours": 24,  # Cache duration (soft TTL: refreshed in the background after this)
+    "cache_stale_ttl_hours": 72,  # Hard TTL: stale results are served until this age
+    "cache_early_refresh_beta": 1.0,  # Probabilistic early expiration strength (0 disables)
+    "llm_field_retries": 1,  # Follow-up requests asking only for missing/invalid fields
+    "model": "gpt-4o-mini",  # Use smaller model for cost control
     "neutral_language_enforced": True,
     "disclaimers_required": True,
 }
 
+# USD per 1M tokens, used to cost each analysis from its reported token usage
+LLM_PRICING_PER_1M_TOKENS = {
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60},
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00},
+}
+
 # Predefined, controlled AI prompt - neutral language only (Safe Core)
 AI_SYSTEM_PROMPT = """You are Veriqo, a product insight assistant. Your role is to provide NEUTRAL, INFORMATIONAL summaries of aggregated customer feedback to help users understand product expectations.
 
@@ -77,6 +316,20 @@ FORBIDDEN PHRASES (never use):
 - "you should/must buy" or "you should/must avoid"
 - Any accusatory or inflammatory language"""
 
+# Canned analysis used when the LLM response is unusable, and per field when a field stays invalid after retries
+FALLBACK_ANALYSIS = {
+    "verdict": "good_match",
+    "confidence_score": 65,
+    "things_to_know": [
+        {"title": "Mixed Feedback Patterns", "description": "Some customers reported quality variations in their experience", "frequency": "~15% of feedback"},
+        {"title": "Delivery Experience", "description": "Occasional shipping timeline variations noted", "frequency": "~8% of feedback"},
+        {"title": "Size/Fit Variations", "description": "Some feedback mentions sizing may differ from expectations", "frequency": "~5% of feedback"}
+    ],
+    "best_suited_for": ["Budget-conscious shoppers", "Users with flexible expectations", "First-time buyers in this category"],
+    "summary": "This product shows mixed feedback patterns. Some customers report satisfaction while others note areas where expectations differed from experience.",
+    "positive_highlights": ["Reasonable value for price point", "Generally meets basic expectations"],
+}
+
 # Disclaimers that MUST be included (Safe Core)
 REQUIRED_DISCLAIMERS = {
     "analysis": "This summary is based on aggregated public customer feedback and is for informational purposes only. Individual experiences may vary.",
@@ -85,6 +338,21 @@ REQUIRED_DISCLAIMERS = {
     "neutrality": "Veriqo provides independent informational summaries and is not affiliated with Amazon or any brand."
 }
 
+# Phrases removed from AI output (Safe Core), matched case-insensitively on word boundaries
+FORBIDDEN_PHRASES = [
+    "fake review", "fraudulent", "scam", "dishonest", "lying",
+    "definitely", "certainly", "you must", "you should definitely",
+    "avoid", "don't buy", "do not buy"
+]
+FORBIDDEN_PHRASE_REGEX = r"\b(?:" + "|".join(re.escape(p) for p in sorted(FORBIDDEN_PHRASES, key=len, reverse=True)) + r")s?\b"
+FORBIDDEN_PHRASE_PATTERN = re.compile(FORBIDDEN_PHRASE_REGEX, re.IGNORECASE)
+# Case-sensitive twin for scanning lowercased text: much faster than IGNORECASE on the common no-match path
+FORBIDDEN_PHRASE_SCAN = re.compile(FORBIDDEN_PHRASE_REGEX)
+REPEATED_SPACES_PATTERN = re.compile(r" {2,}")
+
+# Bumped whenever the safety filter changes, so stored results sanitized by an older filter are redone
+SAFETY_FILTER_VERSION = 2
+
 # Amazon Associates Config
 AMAZON_AFFILIATE_TAG = os.environ.get('AMAZON_AFFILIATE_TAG', 'framouka-20')
 
@@ -107,6 +375,91 @@ SUBSCRIPTION_PLANS = {
     "business_pro": {"price": 99.00, "name": "Business Pro", "checks_per_month": 500, "team_size": -1, "type": "business"},
 }
 FREE_CHECKS_PER_MONTH = 3
+QUOTA_WINDOW_DAYS = 30  # Monthly checks reset this long after the last reset
+
+# Bulk analysis limits (Business plans)
+BATCH_CONFIG = {
+    "max_urls": 500,  # Unique products per batch request
+    "max_concurrency": 4,  # Concurrent scrape + LLM analyses per batch
+}
+
+PRICE_HISTORY_CONFIG = {
+    "raw_retention_days": 30,  # Individual observations (time-series collection TTL)
+    "hourly_retention_days": 180,
+    "daily_retention_days": 5 * 365,
+    "hourly_max_days": 14,  # Ranges up to this many days are served from hourly buckets, longer ones from daily
+}
+
+WISHLIST_CONFIG = {
+    "max_items": 100,
+    "refresh_stale": True,  # Default for refreshing stale insights/prices in the background on listing
+    # The joined insights and prices change without wishlist writes; ETags also roll over this often
+    "etag_window_seconds": 300,
+}
+
+# Popularity-driven ai_cache pre-warming
+WARMER_CONFIG = {
+    "enabled": True,
+    "interval_minutes": 10,  # How often the warmer ranks products and refreshes entries
+    "lookback_hours": 24,  # Request window used to rank products by popularity
+    "top_products": 200,  # Only the most requested products are kept warm
+    "refresh_ahead_minutes": 60,  # Refresh entries this long before their soft TTL expires
+    "llm_budget_per_hour": 60,  # Max LLM analyses the warmer may spend per hour
+}
+
+# Background price alert checks, spread over the replicas holding the "price_alerts" partitions
+ALERT_SWEEP_CONFIG = {
+    "enabled": True,
+    "interval_minutes": 15,
+    "check_every_hours": 6,  # Alerts checked longer ago than this are due
+    "max_alerts_per_run": 500,
+}
+
+# Process-level micro-cache and HTTP caching of the public (SEO) insight pages
+PUBLIC_INSIGHTS_CACHE_CONFIG = {
+    "ttl_seconds": 30,  # How long a worker serves the latest public insight without querying Mongo
+    "cache_control": "public, max-age=60, stale-while-revalidate=300",
+}
+
+# Per-user reads polled by the SPA: browsers keep the body and revalidate it on every use
+USER_DATA_CACHE_CONTROL = "private, no-cache"
+
+PRICE_ALERT_NOTIFY_CONFIG = {
+    # After a drop was notified, only a further drop of this much below the notified price mails again
+    "renotify_drop_percent": 5.0,
+    "max_items_per_digest": 20,
+}
+
+# Leased partitions of background work (cache warmer, alert sweep) shared by all replicas
+COORDINATION_CONFIG = {
+    "partitions": 32,  # Per job; bounds how many replicas a job can spread over
+    "lease_seconds": 30,  # A partition whose holder stopped heartbeating is taken over after this
+    "heartbeat_seconds": 10,
+}
+
+# Outbound Amazon scraping: negative caching and per-host circuit breaker
+SCRAPE_CONFIG = {
+    "failure_ttl_seconds": 600,  # How long a failed scrape is remembered per product
+    "max_concurrency": 8,  # Upper bound of the adaptive per-host concurrency limit
+    "failure_threshold": 3,  # Consecutive throttles/errors that open the circuit
+    "open_seconds": 30,  # Initial open period, doubled on every failed recovery probe
+    "max_open_seconds": 1800,
+    "details_ttl_seconds": 6 * 3600,  # scrape_cache freshness for name, image, rating and reviews
+    "price_ttl_seconds": 15 * 60,  # scrape_cache freshness for the price
+}
+
+EVENT_WRITER_CONFIG = {
+    "max_batch": 500,  # Flush as soon as this many events are buffered
+    "flush_interval_seconds": 1.0,  # ...or at least this often
+    "max_buffered": 20000,  # Events (and rollup keys) held in memory before new ones are dropped
+}
+
+CONFIG_SYNC = {
+    "poll_interval_seconds": 5,  # Version check interval where change streams are unavailable
+}
+
+# Amazon product URL patterns that carry the ASIN
+ASIN_PATTERN = re.compile(r'/(?:dp|gp/product|gp/aw/d|product-reviews|exec/obidos/ASIN)/([A-Z0-9]{10})(?:[/?#]|$)', re.IGNORECASE)
 
 # Create the main app
 app = FastAPI(title="Veriqo API", version="1.0.0")
@@ -162,6 +515,19 @@ class ThingToKnow(BaseModel):
     description: str
     frequency: str
 
+class LlmAnalysisOutput(BaseModel):
+    """Schema the LLM's JSON analysis must satisfy before it is sanitized and cached"""
+    product_name: str
+    verdict: Literal["great_match", "good_match", "consider_options"]
+    confidence_score: int = Field(ge=0, le=100)
+    summary: str
+    things_to_know: List[ThingToKnow]
+    best_suited_for: List[str]
+    positive_highlights: List[str]
+    disclaimer: Optional[str] = None
+
+LLM_ANALYSIS_ADAPTER = TypeAdapter(LlmAnalysisOutput)
+
 class ProductAnalysisResponse(BaseModel):
     id: str
     product_name: str
@@ -183,6 +549,24 @@ class ProductAnalysisResponse(BaseModel):
     authenticity_score: Optional[int] = None
     alternatives: Optional[List[dict]] = None
 
+class PriceHistoryPoint(BaseModel):
+    at: str  # Bucket start
+    open: float
+    high: float
+    low: float
+    close: float
+    avg: float
+    count: int
+
+class PriceHistoryResponse(BaseModel):
+    product_id: str
+    resolution: str
+    days: int
+    current_price: Optional[float] = None
+    lowest_price: Optional[float] = None
+    highest_price: Optional[float] = None
+    points: List[PriceHistoryPoint]
+
 class WishlistItem(BaseModel):
     id: str
     user_id: str
@@ -191,10 +575,21 @@ class WishlistItem(BaseModel):
     product_image: Optional[str] = None
     added_at: str
     notes: Optional[str] = None
+    # Latest cached insights and price for the product, when any
+    product_id: Optional[str] = None
+    verdict: Optional[str] = None
+    confidence_score: Optional[int] = None
+    insights_updated_at: Optional[str] = None
+    current_price: Optional[float] = None
+    price_updated_at: Optional[str] = None
+    is_stale: bool = False
 
 class ComparisonRequest(BaseModel):
     product_urls: List[str]  # 2-3 product URLs to compare
 
+class BatchAnalysisRequest(BaseModel):
+    product_urls: List[str]  # Up to BATCH_CONFIG["max_urls"] unique products
+
 class CheckoutRequest(BaseModel):
     plan_id: str
     origin_url: str
@@ -261,10 +656,178 @@ async def get_current_user(authorization: str = Header(None), request: Request =
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def get_product_id(amazon_url: str) -> str:
+    """Canonical product id: the ASIN when the URL carries one, otherwise a hash of the URL"""
+    match = ASIN_PATTERN.search(amazon_url)
+    if match:
+        return match.group(1).upper()
+    return hashlib.md5(amazon_url.strip().encode()).hexdigest()
+
+# ==================== ANALYSIS STORAGE CODEC ====================
+
+ANALYSIS_CODEC_VERSION = 1
+
+# Fields every sanitized analysis carries with the same value; dropped on write, re-attached on read
+CONSTANT_ANALYSIS_FIELDS = {"disclaimers": REQUIRED_DISCLAIMERS}
+
+# Fields of a per-user product_analyses history entry; the full analysis lives in canonical_analyses
+HISTORY_ENTRY_FIELDS = [
+    "id", "user_id", "analysis_ref", "amazon_url", "product_url", "product_name", "product_image", "verdict",
+    "confidence_score", "affiliate_url", "analyzed_at", "source", "is_public"
+]
+
+# Per-request fields excluded from the canonical analysis version hash
+ANALYSIS_VOLATILE_FIELDS = {"analysis_ref", "amazon_url", "affiliate_url", "disclaimers"}
+# Storage bookkeeping that never goes out in API responses
+INTERNAL_ANALYSIS_FIELDS = {"_id", "sanitized_version"}
+
+# Process-level codec counters, reported in /admin/ai-config
+CODEC_STATS = {"encoded": 0, "raw_bytes": 0, "stored_bytes": 0, "decoded": 0, "decode_seconds": 0.0}
+
+def pack_analysis(analysis: dict, keep: List[str] = ()) -> dict:
+    """Store an analysis as zlib-compressed JSON, keeping `keep` fields as plain document fields"""
+    packed = {k: analysis[k] for k in keep if k in analysis}
+    body = {
+        k: v for k, v in analysis.items()
+        if k not in packed and k != "_id" and CONSTANT_ANALYSIS_FIELDS.get(k, ...) != v
+    }
+    raw = json.dumps(body, separators=(",", ":"), default=str).encode()
+    packed["payload"] = Binary(zlib.compress(raw, 6))
+    packed["codec"] = ANALYSIS_CODEC_VERSION
+    
+    CODEC_STATS["encoded"] += 1
+    CODEC_STATS["raw_bytes"] += len(json.dumps(analysis, default=str))
+    CODEC_STATS["stored_bytes"] += len(packed["payload"]) + len(json.dumps({k: v for k, v in packed.items() if k != "payload"}, default=str))
+    return packed
+
+def unpack_analysis(stored: dict) -> dict:
+    """Inverse of pack_analysis; documents written before the codec are returned unchanged"""
+    if "payload" not in stored:
+        return stored
+    started = time.perf_counter()
+    analysis = {k: v for k, v in stored.items() if k not in ("payload", "codec")}
+    analysis.update(json.loads(zlib.decompress(stored["payload"])))
+    for field, value in CONSTANT_ANALYSIS_FIELDS.items():
+        analysis.setdefault(field, dict(value))
+    
+    CODEC_STATS["decoded"] += 1
+    CODEC_STATS["decode_seconds"] += time.perf_counter() - started
+    return analysis
+
+def get_codec_stats() -> dict:
+    return {
+        **CODEC_STATS,
+        "compression_ratio": round(CODEC_STATS["raw_bytes"] / CODEC_STATS["stored_bytes"], 2) if CODEC_STATS["stored_bytes"] else None,
+        "avg_decode_us": round(CODEC_STATS["decode_seconds"] / CODEC_STATS["decoded"] * 1e6, 1) if CODEC_STATS["decoded"] else None
+    }
+
+# ==================== ANALYSIS HISTORY STORAGE ====================
+
+PERSISTENCE_ATTEMPTS = 3
+
+async def persist_with_retry(description: str, write) -> bool:
+    """Run `write()` until it succeeds, backing off between attempts. Failures are logged, not raised."""
+    for attempt in range(PERSISTENCE_ATTEMPTS):
+        try:
+            await write()
+            return True
+        except Exception as e:
+            if attempt == PERSISTENCE_ATTEMPTS - 1:
+                logging.error(f"{description} failed after {PERSISTENCE_ATTEMPTS} attempts: {e}")
+                return False
+            await asyncio.sleep(0.2 * 2 ** attempt)
+
+def canonical_analysis_ref(product_id: str, analysis: dict) -> str:
+    """Id of the canonical copy of an analysis: the product id and a hash of its content"""
+    body = {k: v for k, v in analysis.items() if k not in ANALYSIS_VOLATILE_FIELDS}
+    version = hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{product_id}:{version}"
+
+def canonical_analysis_upsert(product_id: str, analysis: dict) -> tuple:
+    """The analysis_ref and an idempotent upsert of the canonical copy (a no-op when it already exists)"""
+    analysis_ref = canonical_analysis_ref(product_id, analysis)
+    return analysis_ref, UpdateOne(
+        {"id": analysis_ref},
+        {"$setOnInsert": {
+            "id": analysis_ref,
+            "product_id": product_id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **pack_analysis({k: v for k, v in analysis.items() if k != "analysis_ref"})
+        }},
+        upsert=True
+    )
+
+async def store_canonical_analysis(product_id: str, analysis: dict) -> str:
+    """Store one canonical copy of an analysis per product version. Returns its id (the analysis_ref)."""
+    analysis_ref, write = canonical_analysis_upsert(product_id, analysis)
+    await db.canonical_analyses.bulk_write([write])
+    return analysis_ref
+
+async def save_user_analyses(user_id: str, analyses: List[dict], source: str = None) -> List[dict]:
+    """
+    Record analyses in a user's history as small entries referencing canonical analyses, before
+    the response, so the user's next read sees them on any worker. The canonical copy is only
+    written here when it may not exist yet (analyses without a ref, or whose own analysis is
+    still storing it); cache hits reference a copy stored before the cache entry.
+    Returns the full analysis documents as the history endpoints resolve them.
+    """
+    docs = []
+    entries = []
+    canonical_writes = {}
+    for analysis in analyses:
+        product_id = get_product_id(analysis.get("amazon_url", ""))
+        analysis_ref = analysis.get("analysis_ref")
+        if not analysis_ref or product_id in analysis_inflight:
+            analysis_ref, canonical_writes[analysis_ref] = canonical_analysis_upsert(product_id, analysis)
+        
+        doc = {
+            **analysis,
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "analysis_ref": analysis_ref,
+            "analyzed_at": datetime.now(timezone.utc).isoformat()
+        }
+        if source:
+            doc["source"] = source
+        entries.append({k: doc[k] for k in HISTORY_ENTRY_FIELDS if k in doc})
+        for field in INTERNAL_ANALYSIS_FIELDS:
+            doc.pop(field, None)
+        docs.append(doc)
+    
+    if canonical_writes:
+        await persist_with_retry(
+            f"Storing {len(canonical_writes)} canonical analyses",
+            lambda: db.canonical_analyses.bulk_write(list(canonical_writes.values()), ordered=False)
+        )
+    if entries and await persist_with_retry(
+        f"Saving {len(entries)} history entries for {user_id}",
+        lambda: db.product_analyses.insert_many([dict(entry) for entry in entries], ordered=False)
+    ):
+        await persist_with_retry(f"Bumping history version of {user_id}", lambda: bump_user_data_version(user_id, "history"))
+    return docs
+
+async def save_user_analysis(user_id: str, analysis: dict, source: str = None) -> dict:
+    """Record one analysis in a user's history (see save_user_analyses)"""
+    return (await save_user_analyses(user_id, [analysis], source))[0]
+
+async def resolve_analyses(entries: List[dict]) -> List[dict]:
+    """Resolve history entries to full analyses with one batched canonical_analyses fetch"""
+    refs = list({e["analysis_ref"] for e in entries if e.get("analysis_ref")})
+    canonical = {}
+    if refs:
+        async for doc in db.canonical_analyses.find({"id": {"$in": refs}}, {"_id": 0, "id": 1, "payload": 1, "codec": 1}):
+            canonical[doc.pop("id")] = unpack_analysis(doc)
+    
+    resolved = []
+    for entry in entries:
+        base = canonical.get(entry.get("analysis_ref"))
+        # Entries written before canonical storage carry the whole analysis themselves
+        analysis = {**base, **entry} if base else unpack_analysis(entry)
+        resolved.append({k: v for k, v in analysis.items() if k not in INTERNAL_ANALYSIS_FIELDS})
+    return resolved
+
 def get_user_response(user: dict) -> UserResponse:
-    checks_remaining = FREE_CHECKS_PER_MONTH - user.get("checks_used_this_month", 0)
-    if user.get("subscription_type") == "premium":
-        checks_remaining = -1
+    checks_remaining = get_checks_remaining(user)
     
     return UserResponse(
         id=user["id"],
@@ -281,6 +844,202 @@ def get_user_response(user: dict) -> UserResponse:
         created_at=user.get("created_at", "")
     )
 
+# ==================== EVENT WRITER ====================
+
+class BufferedEventWriter:
+    """
+    Collects append-only telemetry (usage logs, admin logs) and counter increments in memory
+    and writes them in bulk, so request handlers never wait on these writes. Events are
+    flushed when `max_batch` are buffered or every `flush_interval_seconds`. The buffer is
+    bounded: once it holds `max_buffered` entries, new events are dropped and counted instead
+    of growing memory while Mongo is slow or down.
+    """
+    
+    def __init__(self, max_batch: int, flush_interval_seconds: float, max_buffered: int):
+        self.max_batch = max_batch
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_buffered = max_buffered
+        self.events = {}  # collection -> [document]
+        self.updates = {}  # (collection, key items) -> {operator: {field: value}}
+        self.buffered = 0
+        self.stats = {"written": 0, "dropped": 0, "flushes": 0, "failed_flushes": 0}
+        self.flush_requested = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+    
+    def has_room(self, collection: str) -> bool:
+        if self.buffered < self.max_buffered:
+            return True
+        self.stats["dropped"] += 1
+        TELEMETRY_EVENTS.inc(collection, "dropped")
+        return False
+    
+    def note_buffered(self, count: int = 1):
+        self.buffered += count
+        if self.buffered >= self.max_batch:
+            self.flush_requested.set()
+    
+    def insert(self, collection: str, document: dict):
+        """Queue a document for insertion into `collection`"""
+        if self.has_room(collection):
+            self.events.setdefault(collection, []).append(document)
+            self.note_buffered()
+    
+    def increment(self, collection: str, key: dict, increments: dict):
+        """Queue an upserted `$inc` of `increments` on the document matching `key`; merged with pending increments"""
+        self.update(collection, key, {"$inc": increments})
+    
+    def update(self, collection: str, key: dict, operations: dict):
+        """
+        Queue an upsert of `operations` on the document matching `key`, merged with pending
+        updates to the same document: `$inc` amounts add up, `$min`/`$max` keep the extreme,
+        `$set` keeps the latest value and `$setOnInsert` the first.
+        """
+        buffer_key = (collection, tuple(sorted(key.items())))
+        pending = self.updates.get(buffer_key)
+        if pending is None:
+            if not self.has_room(collection):
+                return
+            pending = self.updates[buffer_key] = {}
+            self.note_buffered()
+        for operator, fields in operations.items():
+            merged = pending.setdefault(operator, {})
+            for field, value in fields.items():
+                if field not in merged:
+                    merged[field] = value
+                elif operator == "$inc":
+                    merged[field] += value
+                elif operator == "$min":
+                    merged[field] = min(merged[field], value)
+                elif operator == "$max":
+                    merged[field] = max(merged[field], value)
+                elif operator == "$set":
+                    merged[field] = value
+    
+    async def flush(self):
+        """Write everything buffered so far; events that failed to write are re-queued while there is room"""
+        async with self.flush_lock:
+            events, self.events = self.events, {}
+            updates, self.updates = self.updates, {}
+            self.buffered = 0
+            self.flush_requested.clear()
+            if not events and not updates:
+                return
+            self.stats["flushes"] += 1
+            
+            for collection, documents in events.items():
+                for start in range(0, len(documents), self.max_batch):
+                    chunk = documents[start:start + self.max_batch]
+                    try:
+                        await db[collection].insert_many(chunk, ordered=False)
+                        self.record_written(collection, len(chunk))
+                    except BulkWriteError as e:
+                        # Unordered: everything but the reported documents was written
+                        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                        self.record_written(collection, len(chunk) - len(failed))
+                        self.record_failure(collection, e, len(failed))
+                    except Exception as e:
+                        self.record_failure(collection, e, len(chunk))
+                        for document in chunk:
+                            document.pop("_id", None)
+                            self.insert(collection, document)
+            
+            by_collection = {}
+            for (collection, key), operations in updates.items():
+                by_collection.setdefault(collection, []).append((dict(key), operations))
+            for collection, collection_updates in by_collection.items():
+                try:
+                    await db[collection].bulk_write([
+                        UpdateOne(key, operations, upsert=True) for key, operations in collection_updates
+                    ], ordered=False)
+                    self.record_written(collection, len(collection_updates))
+                except Exception as e:
+                    # Partially applied bulk increments can't be told apart; retrying could double count
+                    self.record_failure(collection, e, len(collection_updates))
+                    if not isinstance(e, BulkWriteError):
+                        for key, operations in collection_updates:
+                            # Re-apply updates queued meanwhile on top, so `$set` keeps the latest value
+                            newer = self.updates.pop((collection, tuple(sorted(key.items()))), None)
+                            if newer is not None:
+                                self.buffered -= 1
+                            self.update(collection, key, operations)
+                            if newer is not None:
+                                self.update(collection, key, newer)
+    
+    def record_written(self, collection: str, count: int):
+        self.stats["written"] += count
+        TELEMETRY_EVENTS.inc(collection, "written", amount=count)
+    
+    def record_failure(self, collection: str, error: Exception, count: int):
+        self.stats["failed_flushes"] += 1
+        logging.warning(f"Event writer flush to {collection} failed for {count} events: {error}")
+    
+    async def run(self):
+        """Flush loop: on size threshold or interval, until cancelled"""
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            failed_flushes = self.stats["failed_flushes"]
+            try:
+                # Shielded so shutdown's cancel doesn't lose a batch that is being written
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logging.error(f"Event writer flush error: {e}")
+            if self.stats["failed_flushes"] != failed_flushes:
+                # Re-queued events must not turn a Mongo outage into a busy retry loop
+                await asyncio.sleep(self.flush_interval_seconds)
+    
+    def snapshot(self) -> dict:
+        return {**self.stats, "buffered": self.buffered}
+
+event_writer = BufferedEventWriter(**EVENT_WRITER_CONFIG)
+
+# ==================== HTTP CACHING ====================
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for it): any listed tag or *"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def cached_json_response(request: Request, body: bytes, etag: str, cache_control: str) -> Response:
+    """Pre-serialized JSON with validators; 304 without a body when the client already has this version"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def not_modified_response(request: Request, response: Response, etag: str, cache_control: str = USER_DATA_CACHE_CONTROL) -> Optional[Response]:
+    """
+    Put validators on the handler's `response`, and return a bodiless 304 when the client
+    already has this version, so the handler can skip its queries and serialization.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+# Per-user collections whose version (users.data_versions.<name>) is bumped on every write
+USER_DATA_COLLECTIONS = ("history", "wishlist", "price_alerts")
+
+def user_data_etag(user: dict, collection: str, *variant) -> str:
+    """ETag of a user's collection listing: the user, the collection's write version and any query variant"""
+    version = (user.get("data_versions") or {}).get(collection, 0)
+    return strong_etag(":".join(str(part) for part in (user["id"], collection, version, *variant)).encode())
+
+async def bump_user_data_version(user_ids, collection: str):
+    """Invalidate the ETags of these users' `collection` listings; call after the write has landed"""
+    user_ids = [user_ids] if isinstance(user_ids, str) else list(user_ids)
+    if user_ids:
+        await db.users.update_many({"id": {"$in": user_ids}}, {"$inc": {f"data_versions.{collection}": 1}})
+
 # ==================== AUTH ROUTES ====================
 
 # Email/Password Registration
@@ -581,8 +1340,11 @@ async def reset_password(data: ResetPasswordRequest):
 
 # Get Current User
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_me(user: dict = Depends(get_current_user)):
-    return get_user_response(user)
+async def get_me(request: Request, response: Response, user: dict = Depends(get_current_user)):
+    # The user document is already loaded; the validator is the body's own hash
+    body = get_user_response(user)
+    not_modified = not_modified_response(request, response, strong_etag(body.model_dump_json().encode()))
+    return not_modified or body
 
 # Complete Onboarding
 @api_router.put("/auth/complete-onboarding")
@@ -596,66 +1358,127 @@ async def logout(response: Response):
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
+# ==================== QUOTA SERVICE ====================
+
+def get_checks_per_month(user: dict) -> int:
+    """Monthly analysis checks included in the user's plan; -1 means unlimited"""
+    if user.get("subscription_type") != "premium":
+        return FREE_CHECKS_PER_MONTH
+    plan = SUBSCRIPTION_PLANS.get(user.get("subscription_plan", ""))
+    return plan["checks_per_month"] if plan else -1
+
+def month_rollover_due(user: dict, now: datetime = None) -> bool:
+    now = now or datetime.now(timezone.utc)
+    return (user.get("month_reset_date") or "") < (now - timedelta(days=QUOTA_WINDOW_DAYS)).isoformat()
+
+def get_checks_remaining(user: dict) -> int:
+    """Checks left in the current window (-1: unlimited), counting a rollover that is due as done"""
+    checks_per_month = get_checks_per_month(user)
+    if checks_per_month < 0:
+        return -1
+    used = 0 if month_rollover_due(user) else user.get("checks_used_this_month", 0)
+    return max(checks_per_month - used, 0)
+
+async def reserve_checks(user: dict, count: int = 1, checks_per_month: int = None) -> Optional[dict]:
+    """
+    Reserve `count` checks in one atomic find_one_and_update that also rolls the monthly window
+    over when it is due and enforces the plan limit, so concurrent requests can't overspend.
+    Returns the updated user, or None when the remaining quota doesn't cover `count`.
+    Unlimited plans still track usage. Refund with refund_checks when the work fails.
+    """
+    if checks_per_month is None:
+        checks_per_month = get_checks_per_month(user)
+    now = datetime.now(timezone.utc)
+    
+    rollover = {"$lt": [{"$ifNull": ["$month_reset_date", ""]}, (now - timedelta(days=QUOTA_WINDOW_DAYS)).isoformat()]}
+    used = {"$cond": [rollover, 0, {"$ifNull": ["$checks_used_this_month", 0]}]}
+    query = {"id": user["id"]}
+    if checks_per_month >= 0:
+        query["$expr"] = {"$lte": [{"$add": [used, count]}, checks_per_month]}
+    
+    return await db.users.find_one_and_update(
+        query,
+        [{"$set": {
+            "checks_used_this_month": {"$add": [used, count]},
+            "month_reset_date": {"$cond": [rollover, now.isoformat(), "$month_reset_date"]}
+        }}],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def refund_checks(user_id: str, count: int = 1):
+    """Give back reserved checks for work that failed (never below zero, e.g. across a rollover)"""
+    if count <= 0:
+        return
+    await db.users.update_one(
+        {"id": user_id},
+        [{"$set": {"checks_used_this_month": {
+            "$max": [{"$subtract": [{"$ifNull": ["$checks_used_this_month", 0]}, count]}, 0]
+        }}}]
+    )
+
+async def reserve_daily_limit(scope: str, subject: str, limit: int) -> bool:
+    """
+    Count one request against a per-day limit (e.g. AI analyses per user) in one atomic
+    upsert that only matches while the day's count is below `limit`, so back-to-back requests
+    can't overspend it. Returns False when the limit is reached. Undo with release_daily_limit.
+    """
+    now = datetime.now(timezone.utc)
+    query = {"_id": f"{scope}:{subject}:{now.strftime('%Y-%m-%d')}", "count": {"$lt": limit}}
+    update = {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": now + timedelta(days=2)}}
+    try:
+        await db.daily_limits.update_one(query, update, upsert=True)
+        return True
+    except DuplicateKeyError:
+        # Either the day's counter is at the limit, or a concurrent request just created it
+        result = await db.daily_limits.update_one(query, {"$inc": {"count": 1}})
+        return result.modified_count == 1
+
+async def release_daily_limit(scope: str, subject: str):
+    """Give back a request counted by reserve_daily_limit whose work failed"""
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    await db.daily_limits.update_one({"_id": f"{scope}:{subject}:{day}", "count": {"$gt": 0}}, {"$inc": {"count": -1}})
+
+def quota_exhausted_error(user: dict, needed: int = 1) -> HTTPException:
+    if user.get("subscription_type") != "premium":
+        return HTTPException(status_code=403, detail="Free checks exhausted. Upgrade to premium for unlimited checks.")
+    return HTTPException(
+        status_code=403,
+        detail=f"Not enough checks left this month. Need {needed}, have {get_checks_remaining(user)}"
+    )
+
 # ==================== PRODUCT ANALYSIS ROUTES ====================
 
 @api_router.post("/analyze", response_model=ProductAnalysisResponse)
 async def analyze_product(data: ProductAnalysisRequest, user: dict = Depends(get_current_user)):
-    # Check usage limits
-    if user.get("subscription_type") != "premium":
-        month_reset = user.get("month_reset_date", "")
-        if month_reset:
-            try:
-                reset_date = datetime.fromisoformat(month_reset.replace('Z', '+00:00'))
-                if reset_date.tzinfo is None:
-                    reset_date = reset_date.replace(tzinfo=timezone.utc)
-                if datetime.now(timezone.utc) - reset_date > timedelta(days=30):
-                    await db.users.update_one(
-                        {"id": user["id"]},
-                        {"$set": {"checks_used_this_month": 0, "month_reset_date": datetime.now(timezone.utc).isoformat()}}
-                    )
-                    user["checks_used_this_month"] = 0
-            except:
-                pass
-        
-        if user.get("checks_used_this_month", 0) >= FREE_CHECKS_PER_MONTH:
-            raise HTTPException(status_code=403, detail="Free checks exhausted. Upgrade to premium for unlimited checks.")
-    
     if "amazon.com" not in data.amazon_url and "amzn.to" not in data.amazon_url:
         raise HTTPException(status_code=400, detail="Please provide a valid Amazon product URL")
     
+    # Reserve the check up front; it is refunded if the analysis fails
+    if not await reserve_checks(user, 1):
+        raise quota_exhausted_error(user)
+    
     try:
         # Pass user_id for rate limiting and usage tracking
         analysis = await perform_ai_analysis(data.amazon_url, user_id=user["id"])
-    except HTTPException:
-        raise
     except Exception as e:
+        await refund_checks(user["id"], 1)
+        if isinstance(e, HTTPException):
+            raise
         logging.error(f"AI Analysis error: {e}")
         raise HTTPException(status_code=500, detail="Failed to analyze product. Please try again.")
     
-    await db.users.update_one(
-        {"id": user["id"]},
-        {"$inc": {"checks_used_this_month": 1}}
-    )
-    
-    analysis_id = str(uuid.uuid4())
-    analysis_doc = {
-        "id": analysis_id,
-        "user_id": user["id"],
-        **analysis,
-        "analyzed_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.product_analyses.insert_one(analysis_doc)
+    # The history entry is written before responding, so the next history read sees it on any worker
+    analysis_doc = await save_user_analysis(user["id"], analysis)
     
-    return ProductAnalysisResponse(
-        id=analysis_id,
-        **analysis,
-        analyzed_at=analysis_doc["analyzed_at"]
-    )
+    return ProductAnalysisResponse(**analysis_doc)
 
 # ==================== AI SAFETY FUNCTIONS ====================
 
 # ==================== CHROME EXTENSION API ====================
 
+EXTENSION_DAILY_LIMIT = 3  # Free analyses per IP per day
+
 class ExtensionAnalysisRequest(BaseModel):
     amazon_url: str
     extension_id: Optional[str] = None
@@ -669,62 +1492,42 @@ async def extension_analyze_product(data: ExtensionAnalysisRequest, request: Req
     # Get client IP for rate limiting
     client_ip = request.client.host if request.client else "unknown"
     
-    # Check daily limit for this IP (3 free checks per day)
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_count = await db.extension_usage.count_documents({
-        "ip": client_ip,
-        "timestamp": {"$gte": today.isoformat()}
-    })
+    if "amazon.com" not in data.amazon_url and "amzn.to" not in data.amazon_url:
+        raise HTTPException(status_code=400, detail="Please provide a valid Amazon product URL")
     
-    if today_count >= 3:
+    # Daily limit for this IP (3 free checks per day), counted atomically before the analysis
+    if not await reserve_daily_limit("extension", client_ip, EXTENSION_DAILY_LIMIT):
         raise HTTPException(
             status_code=403, 
             detail="Daily free limit reached. Sign up at veriqo.com for unlimited access!"
         )
     
-    if "amazon.com" not in data.amazon_url and "amzn.to" not in data.amazon_url:
-        raise HTTPException(status_code=400, detail="Please provide a valid Amazon product URL")
-    
     try:
         analysis = await perform_ai_analysis(data.amazon_url, user_id=f"ext_{client_ip}")
-    except HTTPException:
-        raise
     except Exception as e:
+        await release_daily_limit("extension", client_ip)
+        if isinstance(e, HTTPException):
+            raise
         logging.error(f"Extension AI Analysis error: {e}")
         raise HTTPException(status_code=500, detail="Failed to analyze product. Please try again.")
     
-    # Log extension usage
-    await db.extension_usage.insert_one({
+    # Log extension usage (reporting only; the limit is enforced by daily_limits)
+    event_writer.insert("extension_usage", {
         "id": str(uuid.uuid4()),
         "ip": client_ip,
         "amazon_url": data.amazon_url,
         "timestamp": datetime.now(timezone.utc).isoformat()
     })
     
-    # Generate analysis ID and save
-    analysis_id = str(uuid.uuid4())
-    analysis_doc = {
-        "id": analysis_id,
-        "user_id": f"extension_{client_ip}",
-        "product_url": data.amazon_url,
-        "product_name": analysis.get("product_name"),
-        "product_image": analysis.get("product_image"),
-        "amazon_url": data.amazon_url,
-        "verdict": analysis.get("verdict"),
-        "confidence_score": analysis.get("confidence_score"),
-        "things_to_know": analysis.get("things_to_know"),
-        "best_suited_for": analysis.get("best_suited_for"),
-        "summary": analysis.get("summary"),
-        "positive_highlights": analysis.get("positive_highlights"),
-        "affiliate_url": analysis.get("affiliate_url"),
-        "analyzed_at": datetime.now(timezone.utc).isoformat(),
-        "source": "chrome_extension"
-    }
-    
-    await db.product_analyses.insert_one(analysis_doc)
+    # Save a history entry referencing the canonical analysis
+    analysis_doc = await save_user_analysis(
+        f"extension_{client_ip}",
+        {**analysis, "product_url": data.amazon_url, "amazon_url": data.amazon_url},
+        source="chrome_extension"
+    )
     
     return ProductAnalysisResponse(
-        id=analysis_id,
+        id=analysis_doc["id"],
         product_name=analysis.get("product_name", "Amazon Product"),
         product_image=analysis.get("product_image"),
         amazon_url=data.amazon_url,
@@ -747,63 +1550,237 @@ async def check_ai_enabled():
         raise HTTPException(status_code=503, detail="AI analysis temporarily disabled for maintenance")
     return True
 
-async def check_user_ai_rate_limit(user_id: str) -> bool:
-    """Check if user has exceeded daily AI request limit"""
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    count = await db.ai_usage.count_documents({
-        "user_id": user_id,
-        "timestamp": {"$gte": today.isoformat()}
-    })
-    return count < AI_CONFIG["max_requests_per_user_per_day"]
+class StageTimer:
+    """Exclusive wall time per analysis stage (monotonic clock); a nested stage pauses the enclosing one"""
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.stack = []
+    
+    @contextmanager
+    def stage(self, name: str):
+        now = time.monotonic()
+        if self.stack:
+            parent = self.stack[-1]
+            self.stages[parent[0]] = self.stages.get(parent[0], 0.0) + now - parent[1]
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            _, stage_started = self.stack.pop()
+            self.stages[name] = self.stages.get(name, 0.0) + now - stage_started
+            if self.stack:
+                self.stack[-1][1] = now
+    
+    def breakdown_ms(self) -> dict:
+        return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+    
+    def total_ms(self) -> float:
+        return round((time.monotonic() - self.started) * 1000, 2)
+
+# user_id of the rollup document that aggregates every user for a day
+GLOBAL_USAGE_ROLLUP = "_global"
 
-async def log_ai_usage(user_id: str, tokens_used: int, cache_hit: bool):
-    """Log AI usage for monitoring and billing"""
-    await db.ai_usage.insert_one({
+def llm_cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost of a request from its token counts (0 for models without a price)"""
+    pricing = LLM_PRICING_PER_1M_TOKENS.get(model)
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing["prompt"] + completion_tokens * pricing["completion"]) / 1_000_000
+
+def log_ai_usage(user_id: str, cache_hit: bool, timer: StageTimer = None, llm_usage: dict = None):
+    """
+    Log AI usage for monitoring and billing, with the per-stage latency breakdown when timed.
+    Written in bulk by the event writer, so this returns without waiting on Mongo.
+    `llm_usage` holds the token counts of the LLM calls this request paid for; cache hits and
+    requests that joined another request's analysis pass none and spend no tokens.
+    """
+    llm_usage = llm_usage or {}
+    now = datetime.now(timezone.utc)
+    prompt_tokens = llm_usage.get("prompt_tokens", 0)
+    completion_tokens = llm_usage.get("completion_tokens", 0)
+    cost_usd = llm_cost_usd(llm_usage.get("model"), prompt_tokens, completion_tokens)
+    usage = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
-        "tokens_used": tokens_used,
+        "model": llm_usage.get("model"),
+        "llm_calls": llm_usage.get("llm_calls", 0),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "tokens_used": prompt_tokens + completion_tokens,
+        "tokens_estimated": llm_usage.get("estimated", False),
+        "cost_usd": cost_usd,
         "cache_hit": cache_hit,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+        "timestamp": now.isoformat()
+    }
+    if timer:
+        usage["stages_ms"] = timer.breakdown_ms()
+        usage["total_ms"] = timer.total_ms()
+    event_writer.insert("ai_usage", usage)
+    
+    # Daily rollups, per user and across all users (merged in memory until the next flush)
+    increments = {
+        "requests": 1,
+        "cache_hits": 1 if cache_hit else 0,
+        "llm_requests": 1 if usage["llm_calls"] else 0,
+        "llm_calls": usage["llm_calls"],
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": cost_usd,
+        "estimated_requests": 1 if usage["tokens_estimated"] else 0
+    }
+    if usage["model"]:
+        increments[f"cost_by_model.{usage['model']}"] = cost_usd
+    date = now.strftime("%Y-%m-%d")
+    for rollup_user in (user_id, GLOBAL_USAGE_ROLLUP):
+        event_writer.increment("ai_usage_daily", {"date": date, "user_id": rollup_user}, increments)
+
+async def get_ai_usage_rollups(days: int = 7, top_users: int = 10) -> dict:
+    """Global daily token/cost rollups for the last `days` days and today's top users by cost"""
+    today = datetime.now(timezone.utc).date()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    daily = await db.ai_usage_daily.find(
+        {"user_id": GLOBAL_USAGE_ROLLUP, "date": {"$gte": since}}, {"_id": 0, "user_id": 0}
+    ).sort("date", -1).to_list(days)
+    top = await db.ai_usage_daily.find(
+        {"date": today.isoformat(), "user_id": {"$ne": GLOBAL_USAGE_ROLLUP}}, {"_id": 0, "date": 0}
+    ).sort("cost_usd", -1).to_list(top_users)
+    
+    for rollup in daily + top:
+        rollup["cost_usd"] = round(rollup.get("cost_usd", 0), 6)
+        llm_requests = rollup.get("llm_requests", 0)
+        rollup["avg_tokens_per_llm_request"] = round(
+            (rollup.get("prompt_tokens", 0) + rollup.get("completion_tokens", 0)) / llm_requests, 1
+        ) if llm_requests > 0 else 0
+    return {"daily": daily, "top_users_today": top}
+
+# In-flight analyses per product, shared by concurrent misses and background refreshes
+analysis_inflight = {}
+
+def cache_hard_ttl() -> timedelta:
+    """Age past which a cache entry is no longer served, not even stale"""
+    return timedelta(hours=max(AI_CONFIG["cache_stale_ttl_hours"], AI_CONFIG["cache_ttl_hours"]))
 
-async def get_cached_analysis(url_hash: str) -> Optional[dict]:
-    """Get cached AI analysis if available and not expired"""
-    cache = await db.ai_cache.find_one({"url_hash": url_hash})
+def get_cache_state(cache: dict, now: datetime = None) -> str:
+    """
+    Classify a cache entry as "fresh", "stale" (serve it and refresh in the background)
+    or "expired" (past the hard TTL). Entries approaching the soft TTL are treated as stale
+    early with a probability that grows with age and with how long the analysis took to
+    compute, which spreads refreshes of popular products out instead of stampeding at expiry.
+    """
+    now = now or datetime.now(timezone.utc)
+    age = (now - datetime.fromisoformat(cache["cached_at"])).total_seconds()
+    soft_ttl = AI_CONFIG["cache_ttl_hours"] * 3600
+    hard_ttl = cache_hard_ttl().total_seconds()
+    
+    if age >= hard_ttl:
+        return "expired"
+    if age >= soft_ttl:
+        return "stale"
+    compute_seconds = cache.get("compute_seconds") or 10.0
+    if age - compute_seconds * AI_CONFIG["cache_early_refresh_beta"] * math.log(1.0 - random.random()) >= soft_ttl:
+        return "stale"
+    return "fresh"
+
+async def get_cached_analysis(product_id: str) -> Optional[dict]:
+    """Get cached AI analysis if available and not expired, refreshing stale entries in the background"""
+    cache = await db.ai_cache.find_one({"product_id": product_id})
     if cache:
-        cache_time = datetime.fromisoformat(cache["cached_at"])
-        if datetime.now(timezone.utc) - cache_time < timedelta(hours=AI_CONFIG["cache_ttl_hours"]):
-            return cache["result"]
+        state = get_cache_state(cache)
+        AI_CACHE_LOOKUPS.inc(state)
+        if state == "stale":
+            schedule_cache_refresh(product_id, cache.get("amazon_url"))
+        if state != "expired":
+            if cache.get("warm_credit_after"):
+                await credit_prevented_miss(cache)
+            return unpack_analysis(cache["result"])
+    else:
+        AI_CACHE_LOOKUPS.inc("miss")
     return None
 
-async def cache_analysis(url_hash: str, result: dict):
-    """Cache AI analysis result"""
+async def get_cached_analyses(product_ids: List[str]) -> dict:
+    """Get all servable cached AI analyses for a set of products in one query, keyed by product id"""
+    now = datetime.now(timezone.utc)
+    cached = {}
+    found = 0
+    async for cache in db.ai_cache.find({"product_id": {"$in": product_ids}}, {"_id": 0}):
+        found += 1
+        state = get_cache_state(cache, now)
+        AI_CACHE_LOOKUPS.inc(state)
+        if state == "stale":
+            schedule_cache_refresh(cache["product_id"], cache.get("amazon_url"))
+        if state != "expired":
+            cached[cache["product_id"]] = unpack_analysis(cache["result"])
+    AI_CACHE_LOOKUPS.inc("miss", amount=len(set(product_ids)) - found)
+    return cached
+
+# Analysis fields kept outside the compressed ai_cache payload, so aggregations can read them
+CACHE_SUMMARY_FIELDS = ["verdict", "confidence_score"]
+
+async def cache_analysis(product_id: str, result: dict, compute_seconds: float = None):
+    """Cache AI analysis result (the warmer marks its own refreshes for credit afterwards)"""
     await db.ai_cache.update_one(
-        {"url_hash": url_hash},
-        {"$set": {
-            "url_hash": url_hash,
-            "result": result,
-            "cached_at": datetime.now(timezone.utc).isoformat()
-        }},
+        {"product_id": product_id},
+        {
+            "$set": {
+                "product_id": product_id,
+                "amazon_url": result.get("amazon_url"),
+                "result": pack_analysis(result, keep=CACHE_SUMMARY_FIELDS),
+                "cached_at": datetime.now(timezone.utc).isoformat(),
+                "compute_seconds": compute_seconds
+            },
+            # A refresh not done by the warmer must not be credited to it
+            "$unset": {"refresh_lease_until": "", "warm_credit_after": ""}
+        },
         upsert=True
     )
 
+def schedule_cache_refresh(product_id: str, amazon_url: Optional[str]):
+    """Start a single background refresh for a stale cache entry, unless one is already running"""
+    if not amazon_url or product_id in analysis_inflight or not AI_CONFIG["enabled"]:
+        return
+    start_inflight_task(analysis_inflight, product_id, refresh_cached_analysis(product_id, amazon_url))
+
+async def refresh_cached_analysis(product_id: str, amazon_url: str) -> Optional[dict]:
+    """Recompute a cached analysis; a lease on the cache entry keeps other workers from refreshing it too"""
+    # Background work, even when a request's cache lookup triggered it
+    request_db_commands.set(None)
+    try:
+        now = datetime.now(timezone.utc)
+        lease = await db.ai_cache.update_one(
+            {
+                "product_id": product_id,
+                "$or": [
+                    {"refresh_lease_until": {"$exists": False}},
+                    {"refresh_lease_until": {"$lt": now.isoformat()}}
+                ]
+            },
+            {"$set": {"refresh_lease_until": (now + timedelta(minutes=2)).isoformat()}}
+        )
+        if lease.modified_count == 0:
+            return None
+        llm_usage = {}
+        result = await run_ai_analysis(amazon_url, product_id, llm_usage=llm_usage)
+        log_ai_usage("system:cache_refresh", cache_hit=False, llm_usage=llm_usage)
+        return result
+    except Exception as e:
+        logging.error(f"Background cache refresh failed for {product_id}: {e}")
+        return None
+
+def remove_forbidden_phrases(text: str) -> str:
+    """Remove forbidden phrases (any case, whole words only) in a single pass"""
+    if not FORBIDDEN_PHRASE_SCAN.search(text.lower()):
+        return text
+    return REPEATED_SPACES_PATTERN.sub(" ", FORBIDDEN_PHRASE_PATTERN.sub("", text)).strip()
+
 def sanitize_ai_output(result: dict) -> dict:
     """Sanitize AI output to ensure neutral language and add required disclaimers (Safe Core)"""
-    # Forbidden phrases to remove
-    forbidden_phrases = [
-        "fake review", "fraudulent", "scam", "dishonest", "lying",
-        "definitely", "certainly", "you must", "you should definitely",
-        "avoid", "don't buy", "do not buy"
-    ]
-    
-    # Sanitize text fields
-    for field in ["summary", "product_name"]:
-        if field in result and isinstance(result[field], str):
-            text = result[field]
-            for phrase in forbidden_phrases:
-                text = text.replace(phrase, "")
-                text = text.replace(phrase.title(), "")
-            result[field] = text
+    # Already sanitized by the current filter (e.g. a cache hit): only the disclaimers may be missing
+    if result.get("sanitized_version") == SAFETY_FILTER_VERSION:
+        result.setdefault("disclaimers", REQUIRED_DISCLAIMERS)
+        return result
     
     # Map old verdict format to new Safe Core verdicts
     verdict_mapping = {
@@ -821,15 +1798,6 @@ def sanitize_ai_output(result: dict) -> dict:
     if "top_complaints" in result and "things_to_know" not in result:
         result["things_to_know"] = result.pop("top_complaints")
     
-    # Sanitize things_to_know (formerly complaints)
-    if "things_to_know" in result:
-        for item in result["things_to_know"]:
-            if "description" in item:
-                text = item["description"]
-                for phrase in forbidden_phrases:
-                    text = text.replace(phrase, "")
-                item["description"] = text
-    
     # Transform who_should_not_buy to best_suited_for (positive framing)
     if "who_should_not_buy" in result and "best_suited_for" not in result:
         # Convert negative framing to positive
@@ -857,41 +1825,119 @@ def sanitize_ai_output(result: dict) -> dict:
     if "alternatives" in result:
         del result["alternatives"]
     
+    # Sanitize every text field once
+    for field in ["summary", "product_name"]:
+        if isinstance(result.get(field), str):
+            result[field] = remove_forbidden_phrases(result[field])
+    for field in ["positive_highlights", "best_suited_for"]:
+        if isinstance(result.get(field), list):
+            result[field] = [remove_forbidden_phrases(text) if isinstance(text, str) else text for text in result[field]]
+    for item in result.get("things_to_know") or []:
+        for key in ["title", "description"]:
+            if isinstance(item.get(key), str):
+                item[key] = remove_forbidden_phrases(item[key])
+    
     # Add required disclaimers
     result["disclaimers"] = REQUIRED_DISCLAIMERS
+    result["sanitized_version"] = SAFETY_FILTER_VERSION
     
     return result
 
-async def perform_ai_analysis(amazon_url: str, user_id: str = None) -> dict:
+async def perform_ai_analysis(amazon_url: str, user_id: str = None, enforce_rate_limit: bool = True) -> dict:
     """Perform AI analysis with safety controls"""
-    from emergentintegrations.llm.chat import LlmChat, UserMessage
-    from bs4 import BeautifulSoup
-    import re
+    timer = StageTimer()
     
     # Check if AI is enabled
     await check_ai_enabled()
     
-    # Check rate limit for user
-    if user_id and not await check_user_ai_rate_limit(user_id):
+    # Count the request against the user's daily limit (batch analyses are bounded by the plan quota instead)
+    rate_limited = bool(user_id and enforce_rate_limit)
+    with timer.stage("rate_limit"):
+        within_limit = not rate_limited or await reserve_daily_limit("ai", user_id, AI_CONFIG["max_requests_per_user_per_day"])
+    if not within_limit:
         raise HTTPException(status_code=429, detail="Daily AI analysis limit reached. Please try again tomorrow.")
     
-    # Generate URL hash for caching
-    url_hash = hashlib.md5(amazon_url.encode()).hexdigest()
+    try:
+        return await analyze_with_cache(amazon_url, user_id, timer)
+    except Exception:
+        # Failed analyses don't count against the limit
+        if rate_limited:
+            await release_daily_limit("ai", user_id)
+        raise
+
+async def analyze_with_cache(amazon_url: str, user_id: Optional[str], timer: StageTimer) -> dict:
+    """The analysis from the cache, a running analysis of the same product, or a new one"""
+    # Canonical product id for caching
+    product_id = get_product_id(amazon_url)
     
     # Check cache first
-    cached = await get_cached_analysis(url_hash)
+    with timer.stage("cache_lookup"):
+        cached = await get_cached_analysis(product_id)
     if cached:
+        with timer.stage("sanitize"):
+            cached = sanitize_ai_output(cached)
         if user_id:
-            await log_ai_usage(user_id, 0, cache_hit=True)
-        return sanitize_ai_output(cached)
+            log_ai_usage(user_id, cache_hit=True, timer=timer)
+        # The cached links are those of whoever analyzed the product first
+        return with_request_urls(cached, amazon_url)
+    
+    # Join an analysis already running for this product (its tokens are accounted to whoever started it)
+    result = None
+    llm_usage = {}
+    task = analysis_inflight.get(product_id)
+    if task is not None:
+        with timer.stage("inflight_wait"):
+            result = await asyncio.shield(task.result_ready or task)
+    if result is None:
+        result_ready = asyncio.get_running_loop().create_future()
+        start_inflight_task(
+            analysis_inflight, product_id,
+            run_ai_analysis(amazon_url, product_id, timer, llm_usage, result_ready),
+            result_ready=result_ready
+        )
+        result = await asyncio.shield(result_ready)
+    # A joined analysis carries the links of the request that started it
+    result = with_request_urls(dict(result), amazon_url)
     
-    api_key = os.environ.get('EMERGENT_LLM_KEY')
-    if not api_key:
-        raise Exception("EMERGENT_LLM_KEY not configured")
+    # Log AI usage
+    if user_id:
+        log_ai_usage(user_id, cache_hit=False, timer=timer, llm_usage=llm_usage)
     
-    # Try to scrape real Amazon product data
-    scraped_data = await scrape_amazon_product(amazon_url)
+    return result
+
+def with_request_urls(analysis: dict, amazon_url: str) -> dict:
+    """Set the per-request link fields of an analysis from the URL the user submitted"""
+    analysis["amazon_url"] = amazon_url
+    analysis["affiliate_url"] = f"{amazon_url}?tag={AMAZON_AFFILIATE_TAG}" if "?" not in amazon_url else f"{amazon_url}&tag={AMAZON_AFFILIATE_TAG}"
+    return analysis
+
+def start_inflight_task(inflight: dict, key: str, coro, result_ready: asyncio.Future = None,
+                        context: contextvars.Context = None) -> asyncio.Task:
+    """
+    Run `coro` as the single in-flight computation for `key`, removed from `inflight` when done.
+    `result_ready` is a future the coroutine may resolve before it finishes; joiners wait on it
+    instead of the task. It is settled from the task's outcome if the coroutine doesn't set it.
+    """
+    task = asyncio.create_task(coro, context=context)
+    task.result_ready = result_ready
+    inflight[key] = task
+    
+    def release(done_task: asyncio.Task):
+        if inflight.get(key) is done_task:
+            del inflight[key]
+        if result_ready is not None and not result_ready.done():
+            if done_task.cancelled():
+                result_ready.cancel()
+            elif done_task.exception() is not None:
+                result_ready.set_exception(done_task.exception())
+            else:
+                result_ready.set_result(done_task.result())
     
+    task.add_done_callback(release)
+    return task
+
+def build_analysis_prompt(amazon_url: str, scraped_data: dict) -> str:
+    """Build the analysis user prompt, with scraped product data when available"""
     # Build AI prompt with scraped data if available
     if scraped_data and scraped_data.get("product_name"):
         product_context = f"""
@@ -911,62 +1957,242 @@ URL: {amazon_url}
 Provide a NEUTRAL summary of feedback patterns with a verdict. Remember to use hedging language and avoid accusations."""
     else:
         prompt = f"Summarize aggregated customer feedback patterns for this Amazon product: {amazon_url}\n\nProvide a neutral analysis based on typical feedback patterns for similar products."
+    return prompt
+
+# LLM provider for analyses: "emergent" (default, through LlmChat) or "openai" (direct, needs OPENAI_API_KEY)
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "emergent").strip().lower()
+# Shared OpenAI client, created on first use with LLM_PROVIDER=openai
+openai_client = None
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for providers that don't report usage"""
+    return math.ceil(len(text) / 4)
+
+class AnalysisLlmSession:
+    """
+    One analysis conversation with the LLM, counting the tokens it spends.
+    Through the Emergent proxy (the default), which only returns the reply text, the counts are
+    estimated from the conversation length and flagged as estimated. With LLM_PROVIDER=openai,
+    requests go directly to the OpenAI API and the counts come from each response's usage block.
+    """
     
-    # Use controlled, predefined system prompt
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"veriqo-analysis-{uuid.uuid4()}",
-        system_message=AI_SYSTEM_PROMPT
-    ).with_model("openai", "gpt-4o-mini")  # Use smaller model for cost control
-    
-    user_message = UserMessage(text=prompt)
-    response = await chat.send_message(user_message)
-    
-    try:
-        json_match = re.search(r'\{[\s\S]*\}', response)
-        if json_match:
-            result = json.loads(json_match.group())
+    def __init__(self, model: str):
+        global openai_client
+        self.model = model
+        self.messages = [{"role": "system", "content": AI_SYSTEM_PROMPT}]
+        self.usage = {"model": model, "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated": False}
+        self.chat = None
+        
+        if LLM_PROVIDER == "openai":
+            if openai_client is None:
+                api_key = os.environ.get('OPENAI_API_KEY')
+                if not api_key:
+                    raise Exception("OPENAI_API_KEY not configured (LLM_PROVIDER=openai)")
+                from openai import AsyncOpenAI
+                openai_client = AsyncOpenAI(api_key=api_key)
+            return
+        
+        from emergentintegrations.llm.chat import LlmChat
+        api_key = os.environ.get('EMERGENT_LLM_KEY')
+        if not api_key:
+            raise Exception("EMERGENT_LLM_KEY not configured")
+        # Use controlled, predefined system prompt
+        self.chat = LlmChat(
+            api_key=api_key,
+            session_id=f"veriqo-analysis-{uuid.uuid4()}",
+            system_message=AI_SYSTEM_PROMPT
+        ).with_model("openai", model)
+    
+    async def send(self, text: str) -> str:
+        """Send the next user message and return the reply text"""
+        self.messages.append({"role": "user", "content": text})
+        usage = None
+        if self.chat is None:
+            response = await openai_client.chat.completions.create(
+                model=self.model,
+                messages=self.messages,
+                max_tokens=AI_CONFIG["max_tokens_per_request"],
+                response_format={"type": "json_object"}
+            )
+            reply = response.choices[0].message.content or ""
+            usage = response.usage
         else:
-            raise ValueError("No JSON found")
+            from emergentintegrations.llm.chat import UserMessage
+            reply = await self.chat.send_message(UserMessage(text=text))
         
+        self.usage["llm_calls"] += 1
+        if usage is not None:
+            self.usage["prompt_tokens"] += usage.prompt_tokens
+            self.usage["completion_tokens"] += usage.completion_tokens
+        else:
+            # The whole conversation so far is billed as prompt on every turn
+            self.usage["prompt_tokens"] += sum(estimate_tokens(m["content"]) for m in self.messages)
+            self.usage["completion_tokens"] += estimate_tokens(reply)
+            self.usage["estimated"] = True
+        self.messages.append({"role": "assistant", "content": reply})
+        return reply
+
+async def run_ai_analysis(amazon_url: str, product_id: str, timer: StageTimer = None, llm_usage: dict = None,
+                          result_ready: asyncio.Future = None) -> dict:
+    """
+    Scrape, run the LLM, sanitize and cache a fresh analysis (no cache lookup or usage logging).
+    The token usage of the LLM calls is written into `llm_usage` when given, and the analysis is
+    set on `result_ready` as soon as it exists, before it is stored and cached.
+    """
+    timer = timer or StageTimer()
+    started = time.monotonic()
+    model = AI_CONFIG["model"]
+    session = AnalysisLlmSession(model)
+    
+    # Real Amazon product data, shared with price alerts through scrape_cache
+    with timer.stage("scrape"):
+        scraped_data = await get_product_info(amazon_url)
+    
+    with timer.stage("prompt_build"):
+        prompt = build_analysis_prompt(amazon_url, scraped_data)
+    
+    async def ask(text: str) -> str:
+        llm_started = time.perf_counter()
+        try:
+            with timer.stage("llm"):
+                return await session.send(text)
+        finally:
+            LLM_REQUEST_DURATION.observe(time.perf_counter() - llm_started, model)
+            if llm_usage is not None:
+                llm_usage.update(session.usage)
+    
+    response = await ask(prompt + "\n\nRespond with the JSON object only, no prose or code fences.")
+    # Field-level retries inside are timed as "llm"
+    with timer.stage("json_extraction"):
+        result = await parse_llm_analysis(response, ask)
+    
+    if result is not None:
         # Use scraped product name if AI didn't provide one
         if scraped_data and scraped_data.get("product_name") and result.get("product_name") == "Product Name Here":
             result["product_name"] = scraped_data["product_name"]
         if scraped_data and scraped_data.get("product_image"):
             result["product_image"] = scraped_data["product_image"]
-            
-    except:
+    else:
         result = {
             "product_name": scraped_data.get("product_name", "Amazon Product") if scraped_data else "Amazon Product",
             "product_image": scraped_data.get("product_image") if scraped_data else None,
-            "verdict": "good_match",
-            "confidence_score": 65,
-            "things_to_know": [
-                {"title": "Mixed Feedback Patterns", "description": "Some customers reported quality variations in their experience", "frequency": "~15% of feedback"},
-                {"title": "Delivery Experience", "description": "Occasional shipping timeline variations noted", "frequency": "~8% of feedback"},
-                {"title": "Size/Fit Variations", "description": "Some feedback mentions sizing may differ from expectations", "frequency": "~5% of feedback"}
-            ],
-            "best_suited_for": ["Budget-conscious shoppers", "Users with flexible expectations", "First-time buyers in this category"],
-            "summary": "This product shows mixed feedback patterns. Some customers report satisfaction while others note areas where expectations differed from experience.",
-            "positive_highlights": ["Reasonable value for price point", "Generally meets basic expectations"],
+            **FALLBACK_ANALYSIS,
             "disclaimer": REQUIRED_DISCLAIMERS["analysis"]
         }
     
     # Sanitize output and add disclaimers
-    result = sanitize_ai_output(result)
+    with timer.stage("sanitize"):
+        result = sanitize_ai_output(result)
     
     # Add affiliate URL
-    affiliate_url = f"{amazon_url}?tag={AMAZON_AFFILIATE_TAG}" if "?" not in amazon_url else f"{amazon_url}&tag={AMAZON_AFFILIATE_TAG}"
-    result["amazon_url"] = amazon_url
-    result["affiliate_url"] = affiliate_url
+    result = with_request_urls(result, amazon_url)
     
-    # Cache the result
-    await cache_analysis(url_hash, result)
+    # One canonical copy per product version; cache hits and history entries reference it
+    result["analysis_ref"] = canonical_analysis_ref(product_id, result)
+    compute_seconds = time.monotonic() - started
     
-    # Log AI usage
-    if user_id:
-        await log_ai_usage(user_id, AI_CONFIG["max_tokens_per_request"], cache_hit=False)
+    # Hand the result to waiting requests now; persisting it happens after their responses.
+    # This task (and with it the in-flight entry that concurrent misses join) lasts until it is cached.
+    if result_ready is not None and not result_ready.done():
+        result_ready.set_result(result)
+    # What follows is no longer part of the originating request's work
+    request_db_commands.set(None)
+    await persist_with_retry(f"Storing canonical analysis {result['analysis_ref']}", lambda: store_canonical_analysis(product_id, result))
+    await persist_with_retry(f"Caching analysis for {product_id}", lambda: cache_analysis(product_id, result, compute_seconds))
+    
+    return result
+
+def extract_json_object(text: str) -> Optional[dict]:
+    """Decode the first JSON object in an LLM response, repairing it if the response was truncated"""
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value if isinstance(value, dict) else None
+    except ValueError:
+        return repair_truncated_json(text[start:])
+
+def repair_truncated_json(fragment: str) -> Optional[dict]:
+    """
+    Close a truncated JSON object after its last complete member. Scans once, tracking string
+    state and open brackets, and remembers the last point where a value had just ended.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_safe = None  # (cut index, open brackets at that point)
+    
+    for i, ch in enumerate(fragment):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                break
+            last_safe = (i + 1, list(stack))
+        elif ch == ",":
+            last_safe = (i, list(stack))
+    
+    if last_safe is None:
+        return None
+    cut, open_brackets = last_safe
+    closers = "".join("}" if b == "{" else "]" for b in reversed(open_brackets))
+    try:
+        value = json.loads(fragment[:cut] + closers)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def validate_llm_analysis(data: dict):
+    """Validate against LlmAnalysisOutput. Returns (analysis or None, names of missing/invalid fields)."""
+    try:
+        return LLM_ANALYSIS_ADAPTER.validate_python(data).model_dump(), set()
+    except ValidationError as e:
+        return None, {str(err["loc"][0]) for err in e.errors() if err["loc"]}
+
+async def parse_llm_analysis(response: str, ask) -> Optional[dict]:
+    """
+    Parse and validate the LLM's analysis. Missing or invalid fields are re-requested on their own
+    (`ask` continues the same chat) instead of re-running the whole analysis; fields still invalid
+    after AI_CONFIG["llm_field_retries"] follow-ups fall back to the canned values.
+    Returns None if the response holds no usable JSON at all.
+    """
+    data = extract_json_object(response)
+    if not data:
+        return None
     
+    result, invalid_fields = validate_llm_analysis(data)
+    for _ in range(AI_CONFIG["llm_field_retries"]):
+        if not invalid_fields:
+            break
+        fields = ", ".join(sorted(invalid_fields))
+        logging.info(f"Re-requesting invalid LLM analysis fields: {fields}")
+        follow_up = await ask(
+            f"Your previous JSON was missing or had invalid values for: {fields}. "
+            f"Reply with a JSON object containing only these fields, following the required output format."
+        )
+        patch = extract_json_object(follow_up) or {}
+        data.update({k: v for k, v in patch.items() if k in invalid_fields})
+        result, invalid_fields = validate_llm_analysis(data)
+    
+    if result is None:
+        if "product_name" in invalid_fields:
+            return None
+        data.update({k: FALLBACK_ANALYSIS[k] for k in invalid_fields if k in FALLBACK_ANALYSIS})
+        result, invalid_fields = validate_llm_analysis(data)
     return result
 
 async def perform_ai_analysis_legacy(amazon_url: str) -> dict:
@@ -976,7 +2202,10 @@ async def perform_ai_analysis_legacy(amazon_url: str) -> dict:
 async def analyze_amazon_product(amazon_url: str) -> dict:
     """Wrapper for backward compatibility with comparison feature"""
     result = await perform_ai_analysis(amazon_url, user_id=None)
-    
+    return add_comparison_links(result, amazon_url)
+
+def add_comparison_links(result: dict, amazon_url: str) -> dict:
+    """Product and affiliate links as the comparison feature shows them"""
     affiliate_tag = "veriqo-20"
     affiliate_url = f"{amazon_url}?tag={affiliate_tag}" if "?" not in amazon_url else f"{amazon_url}&tag={affiliate_tag}"
     
@@ -985,10 +2214,152 @@ async def analyze_amazon_product(amazon_url: str) -> dict:
     
     return result
 
+# ==================== SCRAPE RESILIENCE ====================
+
+class HostCircuitBreaker:
+    """
+    Circuit breaker with an adaptive (AIMD) concurrency limit for one outbound host.
+    Throttling responses halve the limit and, past a threshold, open the circuit; after the
+    open period a single probe request decides between closing it and backing off further.
+    """
+    
+    def __init__(self, host: str):
+        self.host = host
+        self.state = "closed"
+        self.limit = SCRAPE_CONFIG["max_concurrency"]
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_seconds = SCRAPE_CONFIG["open_seconds"]
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.slot_released = asyncio.Event()
+        self.stats = {
+            state: {"requests": 0, "successes": 0, "failures": 0, "rejected": 0, "latency_seconds": 0.0}
+            for state in ("closed", "open", "half_open")
+        }
+    
+    async def acquire(self) -> Optional[str]:
+        """Wait for a request slot. Returns the state the request runs in, or None if it must not be sent."""
+        while True:
+            if self.state == "open":
+                if time.monotonic() < self.open_until:
+                    self.stats["open"]["rejected"] += 1
+                    return None
+                self.state = "half_open"
+            
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.stats["half_open"]["rejected"] += 1
+                    return None
+                self.probe_in_flight = True
+                self.in_flight += 1
+                return "half_open"
+            
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return "closed"
+            self.slot_released.clear()
+            await self.slot_released.wait()
+    
+    def release(self, state: str, outcome: str, latency: float):
+        """Record the outcome of a request sent in `state` and adapt the limit and circuit state"""
+        self.in_flight -= 1
+        stats = self.stats[state]
+        stats["requests"] += 1
+        stats["latency_seconds"] += latency
+        
+        if outcome in ("throttled", "error"):
+            stats["failures"] += 1
+            self.consecutive_failures += 1
+            if outcome == "throttled":
+                self.limit = max(1, self.limit // 2)
+            if state == "half_open":
+                self.open_seconds = min(self.open_seconds * 2, SCRAPE_CONFIG["max_open_seconds"])
+                self.trip()
+            elif self.state == "closed" and self.consecutive_failures >= SCRAPE_CONFIG["failure_threshold"]:
+                self.trip()
+        else:
+            stats["successes"] += 1
+            self.consecutive_failures = 0
+            self.limit = min(self.limit + 1, SCRAPE_CONFIG["max_concurrency"])
+            if state == "half_open":
+                self.state = "closed"
+                self.open_seconds = SCRAPE_CONFIG["open_seconds"]
+        
+        if state == "half_open":
+            self.probe_in_flight = False
+        self.slot_released.set()
+    
+    def trip(self):
+        self.state = "open"
+        self.open_until = time.monotonic() + self.open_seconds
+        logging.warning(f"Circuit opened for {self.host} for {self.open_seconds}s")
+    
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "concurrency_limit": self.limit,
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.consecutive_failures,
+            "open_seconds": self.open_seconds,
+            "stats": {
+                state: {
+                    **stats,
+                    "avg_latency_ms": round(stats["latency_seconds"] / stats["requests"] * 1000, 1) if stats["requests"] else None
+                }
+                for state, stats in self.stats.items()
+            }
+        }
+
+host_breakers = {}
+
+# Shared outbound client so scrapes reuse pooled connections (and their TLS sessions)
+scrape_http_client = httpx.AsyncClient(
+    follow_redirects=True,
+    timeout=15.0,
+    limits=httpx.Limits(max_connections=SCRAPE_CONFIG["max_concurrency"] * 2, max_keepalive_connections=SCRAPE_CONFIG["max_concurrency"])
+)
+
+def get_host_breaker(host: str) -> HostCircuitBreaker:
+    if host not in host_breakers:
+        host_breakers[host] = HostCircuitBreaker(host)
+    return host_breakers[host]
+
+def classify_scrape_response(response: httpx.Response) -> str:
+    """Classify an Amazon response as "ok", "throttled" (503/429/captcha), "not_found" or "error" """
+    if response.status_code in (429, 503):
+        return "throttled"
+    if response.status_code == 200:
+        if "validateCaptcha" in response.text or "Robot Check" in response.text:
+            return "throttled"
+        return "ok"
+    if response.status_code in (404, 410):
+        return "not_found"
+    return "error"
+
+async def get_scrape_failure(product_id: str) -> Optional[dict]:
+    """Get a remembered scrape failure for a product, if it has not expired"""
+    return await db.scrape_failures.find_one(
+        {"product_id": product_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0}
+    )
+
+async def record_scrape_failure(product_id: str, reason: str):
+    """Remember a failed scrape so the product is not fetched again for a short while"""
+    await db.scrape_failures.update_one(
+        {"product_id": product_id},
+        {"$set": {
+            "product_id": product_id,
+            "reason": reason,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=SCRAPE_CONFIG["failure_ttl_seconds"])
+        }},
+        upsert=True
+    )
+
 async def scrape_amazon_product(url: str) -> dict:
     """Scrape basic product info from Amazon"""
     from bs4 import BeautifulSoup
-    import re
+    from urllib.parse import urlparse
     
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -998,81 +2369,212 @@ async def scrape_amazon_product(url: str) -> dict:
         "Connection": "keep-alive",
     }
     
+    # Skip products that failed recently
+    product_id = get_product_id(url)
+    if await get_scrape_failure(product_id):
+        SCRAPE_REQUESTS.inc("negative_cached")
+        return {}
+    
+    # Skip the request entirely while the host is throttling us
+    breaker = get_host_breaker(urlparse(url).netloc)
+    state = await breaker.acquire()
+    if state is None:
+        SCRAPE_REQUESTS.inc("circuit_open")
+        return {}
+    
+    started = time.monotonic()
+    outcome = "error"
     try:
-        async with httpx.AsyncClient(follow_redirects=True, timeout=15.0) as client:
-            response = await client.get(url, headers=headers)
-            
-            if response.status_code != 200:
-                logging.warning(f"Amazon returned status {response.status_code}")
-                return {}
-            
-            soup = BeautifulSoup(response.text, 'lxml')
-            
-            # Extract product name
-            product_name = None
-            name_selectors = ['#productTitle', '#title', 'h1.a-size-large']
-            for selector in name_selectors:
-                elem = soup.select_one(selector)
-                if elem:
-                    product_name = elem.get_text(strip=True)
-                    break
-            
-            # Extract price
-            price = None
-            price_selectors = ['.a-price .a-offscreen', '#priceblock_ourprice', '#priceblock_dealprice', '.a-price-whole']
-            for selector in price_selectors:
-                elem = soup.select_one(selector)
-                if elem:
-                    price = elem.get_text(strip=True)
-                    break
-            
-            # Extract rating
-            rating = None
-            rating_elem = soup.select_one('.a-icon-star span.a-icon-alt, #acrPopover span.a-icon-alt')
-            if rating_elem:
-                rating = rating_elem.get_text(strip=True)
-            
-            # Extract review count
-            review_count = None
-            review_elem = soup.select_one('#acrCustomerReviewText')
-            if review_elem:
-                review_count = review_elem.get_text(strip=True)
-            
-            # Extract product image
-            product_image = None
-            img_elem = soup.select_one('#landingImage, #imgBlkFront')
-            if img_elem:
-                product_image = img_elem.get('src') or img_elem.get('data-old-hires')
-            
-            # Extract sample reviews from the product page
-            sample_reviews = []
-            review_elems = soup.select('.review-text-content span, .a-expander-content.reviewText')[:5]
-            for rev in review_elems:
-                text = rev.get_text(strip=True)
-                if text and len(text) > 20:
-                    sample_reviews.append(text[:300])
-            
-            return {
-                "product_name": product_name,
-                "price": price,
-                "rating": rating,
-                "review_count": review_count,
-                "product_image": product_image,
-                "sample_reviews": "\n".join(sample_reviews) if sample_reviews else ""
-            }
-            
+        response = await scrape_http_client.get(url, headers=headers)
+        outcome = classify_scrape_response(response)
+        
+        if outcome != "ok":
+            logging.warning(f"Amazon returned status {response.status_code} ({outcome})")
+            if outcome != "not_found":
+                await record_scrape_failure(product_id, outcome)
+            return {}
+        
+        soup = BeautifulSoup(response.text, 'lxml')
+        
+        # Extract product name
+        product_name = None
+        name_selectors = ['#productTitle', '#title', 'h1.a-size-large']
+        for selector in name_selectors:
+            elem = soup.select_one(selector)
+            if elem:
+                product_name = elem.get_text(strip=True)
+                break
+        
+        # Extract price
+        price = None
+        price_selectors = ['.a-price .a-offscreen', '#priceblock_ourprice', '#priceblock_dealprice', '.a-price-whole']
+        for selector in price_selectors:
+            elem = soup.select_one(selector)
+            if elem:
+                price = elem.get_text(strip=True)
+                break
+        
+        # Extract rating
+        rating = None
+        rating_elem = soup.select_one('.a-icon-star span.a-icon-alt, #acrPopover span.a-icon-alt')
+        if rating_elem:
+            rating = rating_elem.get_text(strip=True)
+        
+        # Extract review count
+        review_count = None
+        review_elem = soup.select_one('#acrCustomerReviewText')
+        if review_elem:
+            review_count = review_elem.get_text(strip=True)
+        
+        # Extract product image
+        product_image = None
+        img_elem = soup.select_one('#landingImage, #imgBlkFront')
+        if img_elem:
+            product_image = img_elem.get('src') or img_elem.get('data-old-hires')
+        
+        # Extract sample reviews from the product page
+        sample_reviews = []
+        review_elems = soup.select('.review-text-content span, .a-expander-content.reviewText')[:5]
+        for rev in review_elems:
+            text = rev.get_text(strip=True)
+            if text and len(text) > 20:
+                sample_reviews.append(text[:300])
+        
+        return {
+            "product_name": product_name,
+            "price": price,
+            "rating": rating,
+            "review_count": review_count,
+            "product_image": product_image,
+            "sample_reviews": "\n".join(sample_reviews) if sample_reviews else ""
+        }
+        
     except Exception as e:
         logging.error(f"Amazon scrape error: {e}")
+        await record_scrape_failure(product_id, "error")
         return {}
+    finally:
+        latency = time.monotonic() - started
+        breaker.release(state, outcome, latency)
+        SCRAPE_REQUESTS.inc(outcome)
+        SCRAPE_DURATION.observe(latency, outcome)
+
+# ==================== SCRAPE CACHE ====================
+
+SCRAPED_DETAIL_FIELDS = ["product_name", "rating", "review_count", "product_image", "sample_reviews"]
+
+# In-flight scrapes per product, so concurrent callers share one fetch
+scrape_inflight = {}
+
+def parse_price(price: Optional[str]) -> Optional[float]:
+    """Parse a scraped price string like "$1,299.99" into a float"""
+    if not price:
+        return None
+    try:
+        return float(price.replace("$", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+def is_product_info_fresh(info: dict, fresh_price: bool, now: datetime) -> bool:
+    """Descriptive fields and the price have separate TTLs; the price is only checked when required"""
+    details_at = info.get("details_fetched_at")
+    if not details_at or now - details_at > timedelta(seconds=SCRAPE_CONFIG["details_ttl_seconds"]):
+        return False
+    if fresh_price:
+        price_at = info.get("price_fetched_at")
+        if not price_at or now - price_at > timedelta(seconds=SCRAPE_CONFIG["price_ttl_seconds"]):
+            return False
+    return True
+
+async def get_cached_product_info(product_id: str) -> Optional[dict]:
+    """Get whatever scrape_cache holds for a product, without fetching"""
+    return await db.scrape_cache.find_one({"product_id": product_id}, {"_id": 0})
+
+async def get_product_info(url: str, fresh_price: bool = False) -> dict:
+    """
+    Scraped product info through the shared scrape_cache, keyed by canonical product id.
+    Each product page is fetched at most once per freshness window across analysis,
+    price alerts and wishlist. Pass fresh_price=True when the caller acts on the price.
+    """
+    product_id = get_product_id(url)
+    cached = await get_cached_product_info(product_id)
+    if cached and is_product_info_fresh(cached, fresh_price, datetime.now(timezone.utc)):
+        return cached
+    
+    task = scrape_inflight.get(product_id)
+    if task is None:
+        task = start_inflight_task(scrape_inflight, product_id, refresh_product_info(url, product_id))
+    info = await asyncio.shield(task)
+    if info:
+        return info
+    # Stale descriptive data beats none, but a stale price must not be acted on
+    return cached if cached and not fresh_price else {}
+
+async def get_products_info(urls: List[str], fresh_price: bool = False) -> dict:
+    """get_product_info for many products: one scrape_cache query, then concurrent fetches of the stale ones. Keyed by URL."""
+    product_ids = {url: get_product_id(url) for url in urls}
+    cached = {}
+    async for info in db.scrape_cache.find({"product_id": {"$in": list(set(product_ids.values()))}}, {"_id": 0}):
+        cached[info["product_id"]] = info
+    
+    now = datetime.now(timezone.utc)
+    infos = {}
+    stale = {}
+    for url, product_id in product_ids.items():
+        info = cached.get(product_id)
+        if info and is_product_info_fresh(info, fresh_price, now):
+            infos[url] = info
+        else:
+            stale.setdefault(product_id, url)
+    
+    async def fetch(product_id: str, url: str):
+        task = scrape_inflight.get(product_id)
+        if task is None:
+            task = start_inflight_task(scrape_inflight, product_id, refresh_product_info(url, product_id))
+        return product_id, await asyncio.shield(task)
+    
+    fetched = dict(await asyncio.gather(*(fetch(pid, url) for pid, url in stale.items())))
+    for url, product_id in product_ids.items():
+        if url in infos:
+            continue
+        info = fetched.get(product_id)
+        if not info:
+            # Stale descriptive data beats none, but a stale price must not be acted on
+            info = cached.get(product_id) if not fresh_price else None
+        infos[url] = info or {}
+    return infos
+
+async def refresh_product_info(url: str, product_id: str) -> Optional[dict]:
+    """Scrape a product page and store the result in scrape_cache"""
+    scraped = await scrape_amazon_product(url)
+    if not scraped.get("product_name") and not scraped.get("price"):
+        return None
+    
+    now = datetime.now(timezone.utc)
+    info = {
+        **scraped,
+        "product_id": product_id,
+        "amazon_url": url,
+        "details_fetched_at": now,
+        "price_fetched_at": now
+    }
+    await db.scrape_cache.update_one({"product_id": product_id}, {"$set": info}, upsert=True)
+    price = parse_price(scraped.get("price"))
+    if price is not None:
+        record_price_observation(product_id, price, now)
+    return info
 
 @api_router.get("/history", response_model=List[ProductAnalysisResponse])
-async def get_history(user: dict = Depends(get_current_user), limit: int = 100):
+async def get_history(request: Request, response: Response, user: dict = Depends(get_current_user), limit: int = 100):
+    not_modified = not_modified_response(request, response, user_data_etag(user, "history", limit))
+    if not_modified:
+        return not_modified
     analyses = await db.product_analyses.find(
         {"user_id": user["id"]},
         {"_id": 0}
     ).sort("analyzed_at", -1).limit(limit).to_list(limit)
     
-    return analyses
+    return await resolve_analyses(analyses)
 
 @api_router.get("/history/export")
 async def export_history(user: dict = Depends(get_current_user)):
@@ -1090,6 +2592,7 @@ async def export_history(user: dict = Depends(get_current_user)):
         {"user_id": user["id"]},
         {"_id": 0}
     ).sort("analyzed_at", -1).to_list(1000)
+    analyses = await resolve_analyses(analyses)
     
     # Create CSV
     output = io.StringIO()
@@ -1143,15 +2646,186 @@ async def export_history(user: dict = Depends(get_current_user)):
         headers={"Content-Disposition": f"attachment; filename=veriqo-history-{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.csv"}
     )
 
+# ==================== PRICE HISTORY ====================
+
+# Downsampled price buckets per resolution, maintained as observations are recorded
+PRICE_BUCKET_COLLECTIONS = {"hourly": "price_history_hourly", "daily": "price_history_daily"}
+
+def price_bucket_start(observed_at: datetime, resolution: str) -> datetime:
+    if resolution == "hourly":
+        return observed_at.replace(minute=0, second=0, microsecond=0)
+    return observed_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def record_price_observation(product_id: str, price: float, observed_at: datetime):
+    """
+    Buffer a scraped price into the raw price_observations time series and roll it into its
+    hourly and daily buckets (open/high/low/close, sum and count), so history reads never
+    scan raw observations.
+    """
+    event_writer.insert("price_observations", {"product_id": product_id, "price": price, "observed_at": observed_at})
+    for resolution, collection in PRICE_BUCKET_COLLECTIONS.items():
+        event_writer.update(
+            collection,
+            {"product_id": product_id, "bucket": price_bucket_start(observed_at, resolution)},
+            {
+                "$setOnInsert": {"open": price},
+                "$set": {"close": price},
+                "$min": {"low": price},
+                "$max": {"high": price, "last_observed_at": observed_at},
+                "$inc": {"sum": price, "count": 1}
+            }
+        )
+
+async def ensure_price_observations_collection():
+    """Create the raw observations time-series collection with its retention, if it doesn't exist yet"""
+    try:
+        await db.create_collection(
+            "price_observations",
+            timeseries={"timeField": "observed_at", "metaField": "product_id", "granularity": "hours"},
+            expireAfterSeconds=PRICE_HISTORY_CONFIG["raw_retention_days"] * 86400
+        )
+    except CollectionInvalid:
+        pass
+
+@api_router.get("/products/{product_id}/price-history", response_model=PriceHistoryResponse)
+async def get_price_history(
+    product_id: str,
+    days: int = 90,
+    resolution: str = "auto",
+    user: dict = Depends(get_current_user)
+):
+    """
+    Price history of a product from the downsampled buckets: hourly for short ranges,
+    daily for long ones (resolution=auto), or as requested.
+    """
+    if not 1 <= days <= PRICE_HISTORY_CONFIG["daily_retention_days"]:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {PRICE_HISTORY_CONFIG['daily_retention_days']}")
+    if resolution == "auto":
+        resolution = "hourly" if days <= PRICE_HISTORY_CONFIG["hourly_max_days"] else "daily"
+    if resolution not in PRICE_BUCKET_COLLECTIONS:
+        raise HTTPException(status_code=400, detail="resolution must be auto, hourly or daily")
+    # ASINs are stored upper-case; other product ids are URL hashes
+    if re.fullmatch(r"[A-Za-z0-9]{10}", product_id):
+        product_id = product_id.upper()
+    
+    since = price_bucket_start(datetime.now(timezone.utc) - timedelta(days=days), resolution)
+    buckets = await db[PRICE_BUCKET_COLLECTIONS[resolution]].find(
+        {"product_id": product_id, "bucket": {"$gte": since}},
+        {"_id": 0, "bucket": 1, "open": 1, "high": 1, "low": 1, "close": 1, "sum": 1, "count": 1}
+    ).sort("bucket", 1).to_list(None)
+    
+    points = [{
+        "at": bucket["bucket"].isoformat(),
+        "open": bucket["open"],
+        "high": bucket["high"],
+        "low": bucket["low"],
+        "close": bucket["close"],
+        "avg": round(bucket["sum"] / bucket["count"], 2),
+        "count": bucket["count"]
+    } for bucket in buckets]
+    
+    return {
+        "product_id": product_id,
+        "resolution": resolution,
+        "days": days,
+        "current_price": points[-1]["close"] if points else None,
+        "lowest_price": min((p["low"] for p in points), default=None),
+        "highest_price": max((p["high"] for p in points), default=None),
+        "points": points
+    }
+
 # ==================== WISHLIST ROUTES ====================
 
+def wishlist_pipeline(user_id: str, limit: int) -> list:
+    """Wishlist items joined with the cached insights and scraped price of each product"""
+    # Items saved before product ids were stored get the ASIN from their URL
+    asin = {"$let": {
+        "vars": {"match": {"$regexFind": {"input": "$product_url", "regex": ASIN_PATTERN.pattern, "options": "i"}}},
+        "in": {"$toUpper": {"$arrayElemAt": ["$$match.captures", 0]}}
+    }}
+    
+    def lookup(collection: str, fields: dict, into: str) -> dict:
+        return {"$lookup": {
+            "from": collection,
+            "let": {"product_id": "$product_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$product_id", "$$product_id"]}}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, **fields}}
+            ],
+            "as": into
+        }}
+    
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"added_at": -1}},
+        {"$limit": limit},
+        {"$addFields": {"product_id": {"$ifNull": ["$product_id", asin]}}},
+        lookup("ai_cache", {
+            "amazon_url": 1, "cached_at": 1, "compute_seconds": 1,
+            "verdict": "$result.verdict", "confidence_score": "$result.confidence_score"
+        }, "insights"),
+        lookup("scrape_cache", {
+            "price": 1, "price_fetched_at": 1, "details_fetched_at": 1, "product_name": 1, "product_image": 1
+        }, "product_info"),
+        {"$project": {"_id": 0}}
+    ]
+
 @api_router.get("/wishlist", response_model=List[WishlistItem])
-async def get_wishlist(user: dict = Depends(get_current_user)):
-    """Get user's saved products/wishlist"""
-    items = await db.wishlist.find(
-        {"user_id": user["id"]},
-        {"_id": 0}
-    ).sort("added_at", -1).to_list(100)
+async def get_wishlist(
+    request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user),
+    refresh_stale: bool = None
+):
+    """
+    Get user's saved products/wishlist with the latest cached verdict, score and price of each,
+    in one aggregation. Stale insights and prices are refreshed in the background unless
+    refresh_stale is false.
+    """
+    window = int(time.time() // WISHLIST_CONFIG["etag_window_seconds"])
+    not_modified = not_modified_response(request, response, user_data_etag(user, "wishlist", window))
+    if not_modified:
+        return not_modified
+    if refresh_stale is None:
+        refresh_stale = WISHLIST_CONFIG["refresh_stale"]
+    items = await db.wishlist.aggregate(wishlist_pipeline(user["id"], WISHLIST_CONFIG["max_items"])).to_list(None)
+    
+    now = datetime.now(timezone.utc)
+    for item in items:
+        insights = item.pop("insights", None)
+        product_info = item.pop("product_info", None)
+        stale = False
+        
+        if insights and insights[0].get("cached_at"):
+            insights = insights[0]
+            state = get_cache_state(insights, now)
+            if state != "expired":
+                item["verdict"] = insights.get("verdict")
+                item["confidence_score"] = insights.get("confidence_score")
+                item["insights_updated_at"] = insights["cached_at"]
+            if state != "fresh":
+                stale = True
+                if refresh_stale:
+                    schedule_cache_refresh(item["product_id"], insights.get("amazon_url"))
+        
+        if product_info:
+            product_info = product_info[0]
+            item["current_price"] = parse_price(product_info.get("price"))
+            if product_info.get("price_fetched_at"):
+                item["price_updated_at"] = product_info["price_fetched_at"].isoformat()
+            if not item.get("product_image"):
+                item["product_image"] = product_info.get("product_image")
+        if not product_info or not is_product_info_fresh(product_info, True, now):
+            stale = True
+            if refresh_stale and item["product_id"] and item["product_id"] not in scrape_inflight:
+                start_inflight_task(
+                    scrape_inflight, item["product_id"],
+                    refresh_product_info(item["product_url"], item["product_id"]),
+                    context=detached_context()
+                )
+        
+        item["is_stale"] = stale
     return items
 
 @api_router.post("/wishlist", response_model=WishlistItem)
@@ -1168,10 +2842,18 @@ async def add_to_wishlist(
     if existing:
         raise HTTPException(status_code=400, detail="Product already in wishlist")
     
+    product_id = get_product_id(product_url)
+    # Fill in missing details from products someone already scraped (never fetches)
+    if not product_name or not product_image:
+        cached_info = await get_cached_product_info(product_id) or {}
+        product_name = product_name or cached_info.get("product_name")
+        product_image = product_image or cached_info.get("product_image")
+    
     item = {
         "id": str(uuid.uuid4()),
         "user_id": user["id"],
         "product_url": product_url,
+        "product_id": product_id,
         "product_name": product_name or "Saved Product",
         "product_image": product_image,
         "notes": notes,
@@ -1179,6 +2861,7 @@ async def add_to_wishlist(
     }
     
     await db.wishlist.insert_one(item)
+    await bump_user_data_version(user["id"], "wishlist")
     if "_id" in item:
         del item["_id"]
     return item
@@ -1189,6 +2872,7 @@ async def remove_from_wishlist(item_id: str, user: dict = Depends(get_current_us
     result = await db.wishlist.delete_one({"id": item_id, "user_id": user["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
+    await bump_user_data_version(user["id"], "wishlist")
     return {"message": "Removed from wishlist"}
 
 # ==================== COMPARISON ROUTES ====================
@@ -1199,46 +2883,41 @@ async def compare_products(data: ComparisonRequest, user: dict = Depends(get_cur
     if len(data.product_urls) < 2 or len(data.product_urls) > 3:
         raise HTTPException(status_code=400, detail="Please provide 2-3 product URLs")
     
-    # Check user's remaining checks
-    checks_needed = len(data.product_urls)
-    if user.get("subscription_type") == "free" and user.get("checks_remaining", 0) < checks_needed:
-        raise HTTPException(
-            status_code=403, 
-            detail=f"Not enough checks. Need {checks_needed}, have {user.get('checks_remaining', 0)}"
-        )
+    # Products the user already analyzed: latest entry per URL, in one query
+    entries = await db.product_analyses.find(
+        {"amazon_url": {"$in": data.product_urls}, "user_id": user["id"]},
+        {"_id": 0}
+    ).sort("analyzed_at", -1).to_list(None)
+    latest = {}
+    for entry in entries:
+        latest.setdefault(entry["amazon_url"], entry)
+    existing = dict(zip(latest, await resolve_analyses(list(latest.values()))))
     
-    # Analyze each product
-    comparisons = []
-    for url in data.product_urls:
-        # Check if already analyzed
-        existing = await db.product_analyses.find_one(
-            {"amazon_url": url, "user_id": user["id"]},
-            {"_id": 0}
-        )
-        
-        if existing:
-            comparisons.append(existing)
-        else:
-            # Analyze new product
-            try:
-                result = await analyze_amazon_product(url)
-                result["id"] = str(uuid.uuid4())
-                result["user_id"] = user["id"]
-                result["analyzed_at"] = datetime.now(timezone.utc).isoformat()
-                
-                await db.product_analyses.insert_one({**result, "_id": result["id"]})
-                
-                # Deduct check
-                if user.get("subscription_type") == "free":
-                    await db.users.update_one(
-                        {"id": user["id"]},
-                        {"$inc": {"checks_remaining": -1, "checks_used_this_month": 1}}
-                    )
-                
-                comparisons.append(result)
-            except Exception as e:
-                logging.error(f"Failed to analyze {url}: {e}")
-                comparisons.append({"error": str(e), "url": url})
+    # The rest cost a check each, reserved up front and refunded for products that fail
+    new_urls = list(dict.fromkeys(url for url in data.product_urls if url not in existing))
+    if new_urls and not await reserve_checks(user, len(new_urls)):
+        raise quota_exhausted_error(user, len(new_urls))
+    
+    # Cached analyses in one query, then fresh analyses concurrently
+    cached = await get_cached_analyses([get_product_id(url) for url in new_urls]) if new_urls else {}
+    
+    async def analyze_new(url: str) -> dict:
+        try:
+            hit = cached.get(get_product_id(url))
+            if hit:
+                return add_comparison_links(sanitize_ai_output(dict(hit)), url)
+            return await analyze_amazon_product(url)
+        except Exception as e:
+            logging.error(f"Failed to analyze {url}: {e}")
+            return {"error": str(e), "url": url}
+    
+    analyzed = dict(zip(new_urls, await asyncio.gather(*(analyze_new(url) for url in new_urls))))
+    # New analyses go into the user's history in one write
+    succeeded = [url for url in new_urls if "error" not in analyzed[url]]
+    analyzed.update(zip(succeeded, await save_user_analyses(user["id"], [analyzed[url] for url in succeeded])))
+    comparisons = [existing.get(url) or analyzed[url] for url in data.product_urls]
+    
+    await refund_checks(user["id"], sum(1 for url in new_urls if "error" in analyzed[url]))
     
     # Generate comparison summary
     comparison_summary = generate_comparison_summary(comparisons)
@@ -1279,6 +2958,107 @@ def get_comparison_winner(products: List[dict]) -> dict:
         "reason": f"Highest confidence score of {winner.get('confidence_score')}%"
     }
 
+# ==================== BATCH ANALYSIS ROUTES ====================
+
+@api_router.post("/analyze/batch")
+async def analyze_products_batch(data: BatchAnalysisRequest, user: dict = Depends(get_current_user)):
+    """
+    Bulk analysis for Business plans. Streams NDJSON lines: a "started" line, one
+    "result" or "error" line per unique product (cache hits first), then a "summary" line.
+    """
+    from fastapi.responses import StreamingResponse
+    
+    plan = SUBSCRIPTION_PLANS.get(user.get("subscription_plan", ""))
+    if plan and plan.get("type") == "business":
+        checks_per_month = plan["checks_per_month"]
+    elif user.get("is_admin"):
+        checks_per_month = -1
+    else:
+        raise HTTPException(status_code=403, detail="Bulk analysis is available for Business plans")
+    
+    await check_ai_enabled()
+    
+    # Dedupe by canonical product id, keeping the first URL seen for each product
+    products = {}
+    invalid_urls = []
+    for url in data.product_urls:
+        url = url.strip()
+        if "amazon.com" not in url and "amzn.to" not in url:
+            invalid_urls.append(url)
+            continue
+        products.setdefault(get_product_id(url), url)
+    
+    if not products:
+        raise HTTPException(status_code=400, detail="Please provide at least one valid Amazon product URL")
+    if len(products) > BATCH_CONFIG["max_urls"]:
+        raise HTTPException(status_code=400, detail=f"Please provide at most {BATCH_CONFIG['max_urls']} unique products per batch")
+    
+    # Reserve quota for every unique product in one atomic update
+    if not await reserve_checks(user, len(products), checks_per_month):
+        raise quota_exhausted_error(user, len(products))
+    
+    def ndjson(line: dict) -> str:
+        return json.dumps(line, default=str) + "\n"
+    
+    async def stream_results():
+        total = len(products)
+        completed = 0
+        failed = 0
+        tasks = []
+        
+        try:
+            cached = await get_cached_analyses(list(products))
+            yield ndjson({"type": "started", "total": total, "cached": len(cached), "invalid_urls": invalid_urls})
+            
+            # Misses are scheduled first, with bounded concurrency, so no LLM call waits on the hits' writes
+            semaphore = asyncio.Semaphore(BATCH_CONFIG["max_concurrency"])
+            
+            async def analyze(product_id: str):
+                async with semaphore:
+                    try:
+                        result = await perform_ai_analysis(products[product_id], user_id=user["id"], enforce_rate_limit=False)
+                        return product_id, result, None
+                    except Exception as e:
+                        return product_id, None, e
+            
+            tasks = [asyncio.create_task(analyze(product_id)) for product_id in products if product_id not in cached]
+            
+            # Cache hits are answered immediately, recorded in the user's history in one write
+            hits = list(cached)
+            for product_id in hits:
+                log_ai_usage(user["id"], cache_hit=True)
+            saved = await save_user_analyses(user["id"], [
+                with_request_urls(sanitize_ai_output(cached[product_id]), products[product_id]) for product_id in hits
+            ], source="batch")
+            for product_id, analysis in zip(hits, saved):
+                completed += 1
+                yield ndjson({"type": "result", "product_id": product_id, "completed": completed, "total": total,
+                              "analysis": analysis})
+            
+            for next_done in asyncio.as_completed(tasks):
+                product_id, result, error = await next_done
+                completed += 1
+                if error is not None:
+                    failed += 1
+                    logging.error(f"Batch analysis failed for {products[product_id]}: {error}")
+                    yield ndjson({"type": "error", "product_id": product_id, "url": products[product_id],
+                                  "completed": completed, "total": total,
+                                  "detail": error.detail if isinstance(error, HTTPException) else "Failed to analyze product"})
+                    continue
+                yield ndjson({"type": "result", "product_id": product_id, "completed": completed, "total": total,
+                              "analysis": await save_user_analysis(user["id"], result, source="batch")})
+            
+            yield ndjson({"type": "summary", "total": total, "succeeded": completed - failed, "failed": failed})
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Refund checks for failed products and for any left unprocessed by a disconnected client.
+            # Shielded: on disconnect the response's cancel scope would cancel it at its first await.
+            with anyio.CancelScope(shield=True):
+                await refund_checks(user["id"], failed + (total - completed))
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 # ==================== ADMIN ROUTES ====================
 
 async def get_admin_user(user: dict = Depends(get_current_user)):
@@ -1294,19 +3074,35 @@ async def get_admin_stats(admin: dict = Depends(get_admin_user)):
     
     today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     
-    # User stats
-    total_users = await db.users.count_documents({})
-    new_users_today = await db.users.count_documents({"created_at": {"$gte": today.isoformat()}})
-    premium_users = await db.users.count_documents({"subscription_type": "premium"})
-    
-    # Analysis stats
-    total_analyses = await db.product_analyses.count_documents({})
-    analyses_today = await db.product_analyses.count_documents({"analyzed_at": {"$gte": today.isoformat()}})
-    
-    # Verdict distribution (Safe Core naming)
-    verdict_great = await db.product_analyses.count_documents({"verdict": {"$in": ["great_match", "BUY", "buy"]}})
-    verdict_good = await db.product_analyses.count_documents({"verdict": {"$in": ["good_match", "THINK", "think"]}})
-    verdict_consider = await db.product_analyses.count_documents({"verdict": {"$in": ["consider_options", "AVOID", "avoid"]}})
+    def count(match: dict) -> list:
+        return [{"$match": match}, {"$count": "n"}]
+    
+    def counts(facets: list) -> dict:
+        return {name: values[0]["n"] if values else 0 for name, values in facets[0].items()}
+    
+    # User stats (one aggregation)
+    user_counts = counts(await db.users.aggregate([{"$facet": {
+        "total": count({}),
+        "today": count({"created_at": {"$gte": today.isoformat()}}),
+        "premium": count({"subscription_type": "premium"})
+    }}]).to_list(1))
+    total_users = user_counts["total"]
+    new_users_today = user_counts["today"]
+    premium_users = user_counts["premium"]
+    
+    # Analysis stats and verdict distribution, Safe Core naming (one aggregation)
+    analysis_counts = counts(await db.product_analyses.aggregate([{"$facet": {
+        "total": count({}),
+        "today": count({"analyzed_at": {"$gte": today.isoformat()}}),
+        "great": count({"verdict": {"$in": ["great_match", "BUY", "buy"]}}),
+        "good": count({"verdict": {"$in": ["good_match", "THINK", "think"]}}),
+        "consider": count({"verdict": {"$in": ["consider_options", "AVOID", "avoid"]}})
+    }}]).to_list(1))
+    total_analyses = analysis_counts["total"]
+    analyses_today = analysis_counts["today"]
+    verdict_great = analysis_counts["great"]
+    verdict_good = analysis_counts["good"]
+    verdict_consider = analysis_counts["consider"]
     
     return {
         "total_users": total_users,
@@ -1332,7 +3128,7 @@ async def get_admin_users(admin: dict = Depends(get_admin_user), limit: int = 10
 async def get_admin_analyses(admin: dict = Depends(get_admin_user), limit: int = 100):
     """Get all analyses for admin"""
     analyses = await db.product_analyses.find({}, {"_id": 0}).sort("analyzed_at", -1).limit(limit).to_list(limit)
-    return analyses
+    return await resolve_analyses(analyses)
 
 @api_router.patch("/admin/users/{user_id}")
 async def update_user_admin(user_id: str, is_admin: bool = Body(..., embed=True), admin: dict = Depends(get_admin_user)):
@@ -1350,12 +3146,98 @@ async def reset_user_checks(user_id: str, admin: dict = Depends(get_admin_user))
     """Reset user's monthly checks"""
     result = await db.users.update_one(
         {"id": user_id},
-        {"$set": {"checks_remaining": 3, "checks_used_this_month": 0}}
+        {"$set": {"checks_used_this_month": 0, "month_reset_date": datetime.now(timezone.utc).isoformat()}}
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "Checks reset"}
 
+# ==================== RUNTIME CONFIG SYNC ====================
+
+# AI_CONFIG keys changed at runtime by admins; stored in runtime_config and applied on every worker
+RUNTIME_AI_CONFIG_KEYS = {"enabled", "max_tokens_per_request", "max_requests_per_user_per_day", "cache_ttl_hours", "model"}
+AI_CONFIG_DOC_ID = "ai_config"
+# Version of the runtime_config document applied to this worker's AI_CONFIG (0: code defaults)
+AI_CONFIG_STATE = {"version": 0, "source": "defaults", "synced_at": None}
+
+def apply_ai_config_doc(doc: Optional[dict]) -> bool:
+    """Apply a stored AI config document to AI_CONFIG, unless this worker already has that version"""
+    if not doc or doc.get("version", 0) <= AI_CONFIG_STATE["version"]:
+        return False
+    AI_CONFIG.update({k: v for k, v in doc.get("settings", {}).items() if k in RUNTIME_AI_CONFIG_KEYS})
+    AI_CONFIG_STATE["version"] = doc["version"]
+    logging.info(f"Applied AI config version {doc['version']}")
+    return True
+
+async def load_ai_config() -> str:
+    doc = await db.runtime_config.find_one({"_id": AI_CONFIG_DOC_ID})
+    apply_ai_config_doc(doc)
+    AI_CONFIG_STATE["synced_at"] = datetime.now(timezone.utc).isoformat()
+    return f"version {AI_CONFIG_STATE['version']}"
+
+async def update_runtime_ai_config(changes: dict, admin_id: str) -> dict:
+    """Persist AI config changes under a new version and apply them locally; other workers pick them up on sync"""
+    doc = await db.runtime_config.find_one_and_update(
+        {"_id": AI_CONFIG_DOC_ID},
+        {
+            "$set": {
+                **{f"settings.{key}": value for key, value in changes.items()},
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "updated_by": admin_id
+            },
+            "$inc": {"version": 1}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    apply_ai_config_doc(doc)
+    return doc
+
+async def watch_ai_config():
+    """Apply AI config changes as they are written, through a change stream (replica sets only)"""
+    async with db.runtime_config.watch(
+        [{"$match": {"documentKey._id": AI_CONFIG_DOC_ID}}], full_document="updateLookup"
+    ) as stream:
+        AI_CONFIG_STATE["source"] = "change_stream"
+        # Catch up on changes written before the stream was opened
+        await load_ai_config()
+        async for change in stream:
+            apply_ai_config_doc(change.get("fullDocument"))
+            AI_CONFIG_STATE["synced_at"] = datetime.now(timezone.utc).isoformat()
+
+async def poll_ai_config():
+    """Compare the stored version with ours and load the document only when it changed"""
+    AI_CONFIG_STATE["source"] = "polling"
+    doc = await db.runtime_config.find_one({"_id": AI_CONFIG_DOC_ID}, {"version": 1})
+    if doc and doc.get("version", 0) > AI_CONFIG_STATE["version"]:
+        await load_ai_config()
+    AI_CONFIG_STATE["synced_at"] = datetime.now(timezone.utc).isoformat()
+
+async def ai_config_sync_loop():
+    """
+    Keep AI_CONFIG in line with runtime_config so admin changes (including the emergency switch)
+    reach every worker. Uses a change stream, falling back to cheap version polling on servers
+    without change stream support; reads on the request path stay plain dict lookups.
+    """
+    use_change_stream = True
+    while True:
+        try:
+            if use_change_stream:
+                await watch_ai_config()
+            else:
+                await poll_ai_config()
+                await asyncio.sleep(CONFIG_SYNC["poll_interval_seconds"])
+        except OperationFailure as e:
+            if use_change_stream:
+                logging.warning(f"AI config change stream unavailable, polling instead: {e}")
+                use_change_stream = False
+            else:
+                logging.warning(f"AI config poll failed: {e}")
+                await asyncio.sleep(CONFIG_SYNC["poll_interval_seconds"])
+        except Exception as e:
+            logging.warning(f"AI config sync error: {e}")
+            await asyncio.sleep(CONFIG_SYNC["poll_interval_seconds"])
+
 # ==================== AI CONTROL ADMIN ROUTES ====================
 
 @api_router.get("/admin/ai-config")
@@ -1369,23 +3251,120 @@ async def get_ai_config(admin: dict = Depends(get_admin_user)):
     
     return {
         "config": AI_CONFIG,
+        "config_sync": AI_CONFIG_STATE,
         "usage": {
             "total_requests": total_requests,
             "requests_today": requests_today,
             "cache_hits_today": cache_hits_today,
             "cache_hit_rate": round((cache_hits_today / requests_today * 100) if requests_today > 0 else 0, 1)
         },
+        "token_usage": await get_ai_usage_rollups(),
+        "pricing_per_1m_tokens": LLM_PRICING_PER_1M_TOKENS,
+        "storage_codec": get_codec_stats(),
+        "event_writer": event_writer.snapshot(),
         "disclaimers": REQUIRED_DISCLAIMERS
     }
 
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+# Most recent stage timings summarized per /admin/ai-latency call
+AI_LATENCY_MAX_SAMPLES = 10000
+# Without $percentile (MongoDB < 7.0) percentiles are computed here from at most this many
+AI_LATENCY_FALLBACK_SAMPLES = 2000
+LATENCY_PERCENTILES = (50, 95, 99)
+
+def stage_samples_pipeline(since: str, limit: int) -> list:
+    """ai_usage stage timings in the window, one document per (cache_hit, stage, ms) sample"""
+    return [
+        {"$match": {"timestamp": {"$gte": since}, "stages_ms": {"$exists": True}}},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "cache_hit": {"$toBool": {"$ifNull": ["$cache_hit", False]}},
+            "stages": {"$concatArrays": [
+                {"$objectToArray": "$stages_ms"},
+                [{"k": "total", "v": {"$ifNull": ["$total_ms", 0]}}]
+            ]}
+        }},
+        {"$unwind": "$stages"}
+    ]
+
+async def aggregate_stage_percentiles(since: str, limit: int) -> list:
+    """Per (cache_hit, stage): count and percentiles, computed by Mongo ($percentile, MongoDB 7.0+)"""
+    pipeline = stage_samples_pipeline(since, limit) + [
+        {"$group": {
+            "_id": {"cache_hit": "$cache_hit", "stage": "$stages.k"},
+            "count": {"$sum": 1},
+            "percentiles": {"$percentile": {
+                "input": "$stages.v", "p": [q / 100 for q in LATENCY_PERCENTILES], "method": "approximate"
+            }}
+        }}
+    ]
+    rows = []
+    async for row in db.ai_usage.aggregate(pipeline):
+        rows.append({**row["_id"], "count": row["count"], "percentiles": row["percentiles"]})
+    return rows
+
+async def sample_stage_percentiles(since: str, limit: int) -> list:
+    """The same summary computed here from a smaller sample, for servers without $percentile"""
+    samples = {}
+    async for row in db.ai_usage.aggregate(stage_samples_pipeline(since, limit)):
+        samples.setdefault((row["cache_hit"], row["stages"]["k"]), []).append(row["stages"]["v"])
+    rows = []
+    for (cache_hit, stage), values in samples.items():
+        values.sort()
+        rows.append({
+            "cache_hit": cache_hit, "stage": stage, "count": len(values),
+            "percentiles": [percentile(values, q) for q in LATENCY_PERCENTILES]
+        })
+    return rows
+
+@api_router.get("/admin/ai-latency")
+async def get_ai_latency(admin: dict = Depends(get_admin_user), hours: int = 24, limit: int = AI_LATENCY_MAX_SAMPLES):
+    """p50/p95/p99 per analysis stage over the last `hours` (latest `limit` analyses), split into cache hits and misses"""
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    limit = max(1, min(limit, AI_LATENCY_MAX_SAMPLES))
+    try:
+        rows = await aggregate_stage_percentiles(since, limit)
+        method = "mongo"
+    except OperationFailure:
+        limit = min(limit, AI_LATENCY_FALLBACK_SAMPLES)
+        rows = await sample_stage_percentiles(since, limit)
+        method = "sampled"
+    
+    summary = {True: {}, False: {}}
+    for row in rows:
+        summary[row["cache_hit"]][row["stage"]] = {
+            "count": row["count"],
+            **{
+                f"p{q}_ms": round(value, 1) if value is not None else None
+                for q, value in zip(LATENCY_PERCENTILES, row["percentiles"])
+            }
+        }
+    
+    return {
+        "window_hours": hours,
+        # Every analysis contributes one "total" sample
+        "samples": sum(stages.get("total", {}).get("count", 0) for stages in summary.values()),
+        "sample_limit": limit,
+        "method": method,
+        "cache_miss": summary[False],
+        "cache_hit": summary[True]
+    }
+
 @api_router.post("/admin/ai-config/toggle")
 async def toggle_ai(enabled: bool = Body(..., embed=True), admin: dict = Depends(get_admin_user)):
-    """Emergency disable/enable switch for AI"""
-    global AI_CONFIG
-    AI_CONFIG["enabled"] = enabled
+    """Emergency disable/enable switch for AI, applied on every worker"""
+    await update_runtime_ai_config({"enabled": enabled}, admin["id"])
     
     # Log the action
-    await db.admin_logs.insert_one({
+    event_writer.insert("admin_logs", {
         "id": str(uuid.uuid4()),
         "admin_id": admin["id"],
         "action": "ai_toggle",
@@ -1400,19 +3379,26 @@ async def update_ai_config(
     max_tokens: int = Body(None),
     max_requests_per_day: int = Body(None),
     cache_ttl_hours: int = Body(None),
+    model: str = Body(None),
     admin: dict = Depends(get_admin_user)
 ):
-    """Update AI configuration parameters"""
-    global AI_CONFIG
+    """Update AI configuration parameters on every worker"""
+    if model is not None and model not in LLM_PRICING_PER_1M_TOKENS:
+        raise HTTPException(status_code=400, detail=f"Unknown model. Choose from: {', '.join(LLM_PRICING_PER_1M_TOKENS)}")
     
+    changes = {}
     if max_tokens is not None:
-        AI_CONFIG["max_tokens_per_request"] = max_tokens
+        changes["max_tokens_per_request"] = max_tokens
     if max_requests_per_day is not None:
-        AI_CONFIG["max_requests_per_user_per_day"] = max_requests_per_day
+        changes["max_requests_per_user_per_day"] = max_requests_per_day
     if cache_ttl_hours is not None:
-        AI_CONFIG["cache_ttl_hours"] = cache_ttl_hours
+        changes["cache_ttl_hours"] = cache_ttl_hours
+    if model is not None:
+        changes["model"] = model
+    if changes:
+        await update_runtime_ai_config(changes, admin["id"])
     
-    return {"message": "AI config updated", "config": AI_CONFIG}
+    return {"message": "AI config updated", "config": AI_CONFIG, "config_version": AI_CONFIG_STATE["version"]}
 
 @api_router.delete("/admin/ai-cache")
 async def clear_ai_cache(admin: dict = Depends(get_admin_user)):
@@ -1420,36 +3406,373 @@ async def clear_ai_cache(admin: dict = Depends(get_admin_user)):
     result = await db.ai_cache.delete_many({})
     return {"message": f"Cleared {result.deleted_count} cached responses"}
 
+@api_router.get("/admin/scrape-health")
+async def get_scrape_health(admin: dict = Depends(get_admin_user)):
+    """Circuit breaker state, adaptive concurrency and per-state throughput/latency for scraped hosts"""
+    return {
+        "hosts": {host: breaker.snapshot() for host, breaker in host_breakers.items()},
+        "negative_cache_entries": await db.scrape_failures.count_documents({"expires_at": {"$gt": datetime.now(timezone.utc)}})
+    }
+
+# ==================== WORK COORDINATION ====================
+
+# Identifies this process in work_members and work_leases by default
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def work_partition(key: str) -> int:
+    """Stable partition of a key (product id, user id), the same on every replica"""
+    return zlib.crc32(key.encode()) % COORDINATION_CONFIG["partitions"]
+
+class PartitionLeases:
+    """
+    This replica's share of one job's partitions. Each partition is a work_leases document
+    held by one owner until its `expires_at`; the holder renews it on every heartbeat, and
+    partitions whose holder stopped renewing are claimed by the others. Work for a key is
+    only done while the lease on its partition is held with a heartbeat to spare.
+    """
+    
+    def __init__(self, job: str, owner_id: str):
+        self.job = job
+        self.owner_id = owner_id
+        self.owned = set()
+        self.valid_until = None
+    
+    def holds_partition(self, partition: int) -> bool:
+        if partition not in self.owned or self.valid_until is None:
+            return False
+        margin = timedelta(seconds=COORDINATION_CONFIG["heartbeat_seconds"])
+        return datetime.now(timezone.utc) < self.valid_until - margin
+    
+    def holds(self, key: str) -> bool:
+        return self.holds_partition(work_partition(key))
+    
+    def held_partitions(self) -> List[int]:
+        return sorted(p for p in self.owned if self.holds_partition(p))
+    
+    async def rebalance(self, members: int):
+        """Renew our leases, then release or claim partitions until we hold a fair share"""
+        partitions = COORDINATION_CONFIG["partitions"]
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=COORDINATION_CONFIG["lease_seconds"])
+        
+        if self.owned:
+            await db.work_leases.update_many(
+                {"job": self.job, "owner": self.owner_id, "partition": {"$in": list(self.owned)}},
+                {"$set": {"expires_at": expires_at}}
+            )
+        held = await db.work_leases.find(
+            {"job": self.job, "owner": self.owner_id, "expires_at": {"$gt": now}}, {"_id": 0, "partition": 1}
+        ).to_list(None)
+        self.owned = {doc["partition"] for doc in held}
+        self.valid_until = expires_at
+        
+        share = math.ceil(partitions / max(members, 1))
+        if len(self.owned) > share:
+            surplus = sorted(self.owned)[share:]
+            self.owned -= set(surplus)
+            await db.work_leases.update_many(
+                {"job": self.job, "owner": self.owner_id, "partition": {"$in": surplus}},
+                {"$set": {"owner": None, "expires_at": now}}
+            )
+            return
+        
+        candidates = [p for p in range(partitions) if p not in self.owned]
+        random.shuffle(candidates)
+        for partition in candidates:
+            if len(self.owned) >= share:
+                break
+            try:
+                # Matches a free or expired lease, or inserts the partition's first one
+                await db.work_leases.update_one(
+                    {
+                        "_id": f"{self.job}:{partition}",
+                        "$or": [{"owner": None}, {"expires_at": {"$lte": now}}]
+                    },
+                    {"$set": {"job": self.job, "partition": partition, "owner": self.owner_id, "expires_at": expires_at}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # Held by a live replica
+                continue
+            self.owned.add(partition)
+    
+    async def release(self):
+        """Hand our partitions back immediately instead of letting the leases expire"""
+        self.owned = set()
+        self.valid_until = None
+        await db.work_leases.update_many(
+            {"job": self.job, "owner": self.owner_id},
+            {"$set": {"owner": None, "expires_at": datetime.now(timezone.utc)}}
+        )
+
+class WorkCoordinator:
+    """
+    Registers this replica in work_members and rebalances every job's partitions on each
+    heartbeat, so each live replica holds about partitions / replicas of every job.
+    """
+    
+    def __init__(self, owner_id: str = INSTANCE_ID):
+        self.owner_id = owner_id
+        self.jobs = {}
+        self.members = 1
+        self.last_heartbeat = None
+    
+    def job(self, name: str) -> PartitionLeases:
+        if name not in self.jobs:
+            self.jobs[name] = PartitionLeases(name, self.owner_id)
+        return self.jobs[name]
+    
+    async def heartbeat(self):
+        now = datetime.now(timezone.utc)
+        await db.work_members.update_one(
+            {"_id": self.owner_id},
+            {"$set": {"expires_at": now + timedelta(seconds=COORDINATION_CONFIG["lease_seconds"])}},
+            upsert=True
+        )
+        self.members = await db.work_members.count_documents({"expires_at": {"$gt": now}})
+        for leases in self.jobs.values():
+            await leases.rebalance(self.members)
+        self.last_heartbeat = now.isoformat()
+    
+    async def release(self):
+        """On shutdown: release every partition and leave, so the others rebalance at their next heartbeat"""
+        for leases in self.jobs.values():
+            await leases.release()
+        await db.work_members.delete_one({"_id": self.owner_id})
+    
+    def snapshot(self) -> dict:
+        return {
+            "instance_id": self.owner_id,
+            "members": self.members,
+            "last_heartbeat": self.last_heartbeat,
+            "partitions": COORDINATION_CONFIG["partitions"],
+            "held": {name: leases.held_partitions() for name, leases in self.jobs.items()}
+        }
+
+work_coordinator = WorkCoordinator()
+warmer_leases = work_coordinator.job("cache_warmer")
+alert_leases = work_coordinator.job("price_alerts")
+
+async def work_coordination_loop():
+    """Heartbeat loop; a replica that can't reach Mongo stops working once its leases lapse"""
+    while True:
+        try:
+            await work_coordinator.heartbeat()
+        except Exception as e:
+            logging.warning(f"Work coordination heartbeat failed: {e}")
+        await asyncio.sleep(COORDINATION_CONFIG["heartbeat_seconds"])
+
+# ==================== CACHE WARMER ====================
+
+# Monotonic timestamps of warmer LLM analyses in the last hour (per process)
+warmer_llm_calls = deque()
+
+async def rank_popular_products(since: datetime, limit: int) -> List[dict]:
+    """Rank products by request count since `since` across web analyses and extension usage"""
+    pipeline = [
+        {"$match": {"analyzed_at": {"$gte": since.isoformat()}, "source": {"$ne": "chrome_extension"}}},
+        {"$project": {"_id": 0, "amazon_url": 1}},
+        {"$unionWith": {
+            "coll": "extension_usage",
+            "pipeline": [
+                {"$match": {"timestamp": {"$gte": since.isoformat()}}},
+                {"$project": {"_id": 0, "amazon_url": 1}}
+            ]
+        }},
+        {"$match": {"amazon_url": {"$type": "string"}}},
+        {"$group": {"_id": "$amazon_url", "requests": {"$sum": 1}}},
+        {"$sort": {"requests": -1}},
+        # Several URLs can map to one product, so over-fetch before merging
+        {"$limit": limit * 3}
+    ]
+    
+    ranked = {}
+    async for row in db.product_analyses.aggregate(pipeline):
+        product_id = get_product_id(row["_id"])
+        entry = ranked.setdefault(product_id, {"product_id": product_id, "amazon_url": row["_id"], "requests": 0})
+        entry["requests"] += row["requests"]
+    
+    return sorted(ranked.values(), key=lambda p: p["requests"], reverse=True)[:limit]
+
+def warmer_budget_remaining() -> int:
+    """LLM analyses the warmer may still spend in the current hour"""
+    hour_ago = time.monotonic() - 3600
+    while warmer_llm_calls and warmer_llm_calls[0] < hour_ago:
+        warmer_llm_calls.popleft()
+    return WARMER_CONFIG["llm_budget_per_hour"] - len(warmer_llm_calls)
+
+async def record_warmer_stats(**increments):
+    """Add to today's cache warmer counters"""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    await db.cache_warmer_stats.update_one(
+        {"date": today},
+        {"$inc": increments, "$setOnInsert": {"date": today}},
+        upsert=True
+    )
+
+async def credit_prevented_miss(cache: dict):
+    """
+    Credit the warmer once for a warmed entry that is hit after the entry it replaced would
+    have passed its hard TTL: without the warmer that request would have paid the full miss
+    latency (hits before that would have been served stale, instantly).
+    """
+    if datetime.now(timezone.utc).isoformat() < cache["warm_credit_after"]:
+        return
+    claimed = await db.ai_cache.update_one(
+        {"product_id": cache["product_id"], "warm_credit_after": cache["warm_credit_after"]},
+        {"$unset": {"warm_credit_after": ""}}
+    )
+    if claimed.modified_count:
+        await record_warmer_stats(prevented_misses=1, prevented_latency_seconds=cache.get("compute_seconds") or 0)
+
+async def run_cache_warmer() -> dict:
+    """
+    Refresh ai_cache entries of the most requested products shortly before they expire.
+    Each replica only refreshes products in the cache_warmer partitions it holds.
+    """
+    if not warmer_leases.held_partitions():
+        return {"ranked": 0, "refreshed": 0}
+    now = datetime.now(timezone.utc)
+    ranked = await rank_popular_products(now - timedelta(hours=WARMER_CONFIG["lookback_hours"]), WARMER_CONFIG["top_products"])
+    popular = [p for p in ranked if warmer_leases.holds(p["product_id"])]
+    if not popular:
+        return {"ranked": len(ranked), "refreshed": 0}
+    
+    caches = {}
+    async for cache in db.ai_cache.find(
+        {"product_id": {"$in": [p["product_id"] for p in popular]}},
+        {"_id": 0, "product_id": 1, "cached_at": 1, "amazon_url": 1}
+    ):
+        caches[cache["product_id"]] = cache
+    
+    refresh_before = now + timedelta(minutes=WARMER_CONFIG["refresh_ahead_minutes"])
+    refreshed = 0
+    budget_exhausted = False
+    
+    # Most popular first, so the budget goes where it prevents the most misses
+    for product in popular:
+        cache = caches.get(product["product_id"])
+        if not cache:
+            continue
+        cached_at = datetime.fromisoformat(cache["cached_at"])
+        expires_at = cached_at + timedelta(hours=AI_CONFIG["cache_ttl_hours"])
+        if expires_at > refresh_before:
+            continue
+        if warmer_budget_remaining() <= 0:
+            budget_exhausted = True
+            break
+        if product["product_id"] in analysis_inflight or not warmer_leases.holds(product["product_id"]):
+            continue
+        
+        amazon_url = cache.get("amazon_url") or product["amazon_url"]
+        warmer_llm_calls.append(time.monotonic())
+        task = start_inflight_task(analysis_inflight, product["product_id"], refresh_cached_analysis(product["product_id"], amazon_url))
+        if await asyncio.shield(task) is None:
+            continue
+        
+        refreshed += 1
+        # Until the old entry's hard TTL it would have been served stale; hits after it would have been misses
+        await db.ai_cache.update_one(
+            {"product_id": product["product_id"]},
+            {"$set": {
+                "warmed_at": datetime.now(timezone.utc).isoformat(),
+                "warm_credit_after": max(cached_at + cache_hard_ttl(), now).isoformat()
+            }}
+        )
+    
+    if refreshed:
+        await record_warmer_stats(refreshes=refreshed)
+    if budget_exhausted:
+        logging.info("Cache warmer LLM budget exhausted for this hour")
+    
+    return {"ranked": len(ranked), "owned": len(popular), "refreshed": refreshed, "budget_exhausted": budget_exhausted}
+
+async def cache_warmer_loop():
+    """Background loop running the cache warmer every `interval_minutes`"""
+    while True:
+        await asyncio.sleep(WARMER_CONFIG["interval_minutes"] * 60)
+        if not WARMER_CONFIG["enabled"] or not AI_CONFIG["enabled"]:
+            continue
+        try:
+            result = await run_cache_warmer()
+            logging.info(f"Cache warmer run: {result}")
+        except Exception as e:
+            logging.error(f"Cache warmer error: {e}")
+
+@api_router.get("/admin/cache-warmer")
+async def get_cache_warmer_stats(admin: dict = Depends(get_admin_user), days: int = 7):
+    """Cache warmer configuration and daily stats, including the user-facing miss latency it prevented"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+    daily = await db.cache_warmer_stats.find({"date": {"$gte": since}}, {"_id": 0}).sort("date", -1).to_list(days + 1)
+    
+    return {
+        "config": WARMER_CONFIG,
+        "coordination": work_coordinator.snapshot(),
+        "llm_budget_remaining_this_hour": warmer_budget_remaining(),
+        "daily": daily,
+        "totals": {
+            "refreshes": sum(d.get("refreshes", 0) for d in daily),
+            "prevented_misses": sum(d.get("prevented_misses", 0) for d in daily),
+            "prevented_latency_seconds": round(sum(d.get("prevented_latency_seconds", 0) for d in daily), 1)
+        }
+    }
+
 # ==================== PUBLIC INSIGHTS ROUTES ====================
 
+PUBLIC_INSIGHTS_ADAPTER = TypeAdapter(List[ProductAnalysisResponse])
+
+# The latest public insight and its serialized responses, shared by every request on this worker
+public_insight_cache = {"expires_at": 0.0, "insight_id": None}
+public_insight_inflight = {}
+
+async def load_latest_public_insight() -> dict:
+    """Query the latest public insight and pre-serialize both public responses with their ETags"""
+    latest = await db.product_analyses.find_one(
+        {"is_public": {"$ne": False}},
+        {"_id": 0},
+        sort=[("analyzed_at", -1)]
+    )
+    insights = PUBLIC_INSIGHTS_ADAPTER.validate_python(await resolve_analyses([latest]) if latest else [])
+    list_body = PUBLIC_INSIGHTS_ADAPTER.dump_json(insights)
+    item_body = insights[0].model_dump_json().encode() if insights else None
+    public_insight_cache.update({
+        "expires_at": time.monotonic() + PUBLIC_INSIGHTS_CACHE_CONFIG["ttl_seconds"],
+        "insight_id": insights[0].id if insights else None,
+        "list_body": list_body,
+        "list_etag": strong_etag(list_body),
+        "item_body": item_body,
+        "item_etag": strong_etag(item_body) if item_body else None
+    })
+    return public_insight_cache
+
+async def get_latest_public_insight() -> dict:
+    """The micro-cached latest public insight; one query per worker per TTL, shared by concurrent misses"""
+    if time.monotonic() < public_insight_cache["expires_at"]:
+        return public_insight_cache
+    task = public_insight_inflight.get("latest")
+    if task is None:
+        task = start_inflight_task(public_insight_inflight, "latest", load_latest_public_insight(), context=detached_context())
+    return await asyncio.shield(task)
+
 @api_router.get("/insights", response_model=List[ProductAnalysisResponse])
-async def get_public_insights():
+async def get_public_insights(request: Request):
     """Get list of public product insights for SEO pages. Limited to 1 product for free access."""
     # Only return 1 product insight publicly to encourage sign-ups
-    analyses = await db.product_analyses.find(
-        {"is_public": {"$ne": False}},
-        {"_id": 0}
-    ).sort("analyzed_at", -1).limit(1).to_list(1)
-    
-    return analyses
+    cached = await get_latest_public_insight()
+    return cached_json_response(request, cached["list_body"], cached["list_etag"], PUBLIC_INSIGHTS_CACHE_CONFIG["cache_control"])
 
 @api_router.get("/insights/{product_id}", response_model=ProductAnalysisResponse)
-async def get_public_insight(product_id: str):
+async def get_public_insight(product_id: str, request: Request):
     """Get a single public product insight. No auth required."""
-    # First check if this is the most recent public insight (the only one allowed)
-    latest_insight = await db.product_analyses.find_one(
-        {"is_public": {"$ne": False}},
-        {"_id": 0},
-        sort=[("analyzed_at", -1)]
-    )
-    
-    if not latest_insight or latest_insight.get("id") != product_id:
+    # Only the most recent public insight is allowed
+    cached = await get_latest_public_insight()
+    if cached["insight_id"] is None or cached["insight_id"] != product_id:
         raise HTTPException(
             status_code=403, 
             detail="Sign up for free to view more product insights"
         )
     
-    return latest_insight
+    return cached_json_response(request, cached["item_body"], cached["item_etag"], PUBLIC_INSIGHTS_CACHE_CONFIG["cache_control"])
 
 # ==================== PAYMENT ROUTES ====================
 
@@ -1585,27 +3908,20 @@ async def stripe_webhook(request: Request):
 @api_router.post("/price-alerts", response_model=PriceAlertResponse)
 async def create_price_alert(data: PriceAlertRequest, user: dict = Depends(get_current_user)):
     """Create a price drop alert for a product"""
-    # Scrape product info
-    product_info = await scrape_amazon_product(data.product_url)
+    # Product info from the shared scrape cache (reuses a recent analysis fetch)
+    product_info = await get_product_info(data.product_url, fresh_price=True)
+    current_price = parse_price(product_info.get("price"))
     
-    # Parse current price if available
-    current_price = None
-    if product_info.get("price"):
-        try:
-            price_str = product_info["price"].replace("$", "").replace(",", "").strip()
-            current_price = float(price_str)
-        except:
-            pass
-    
-    alert_id = str(uuid4())
+    alert_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
     alert = {
         "id": alert_id,
         "user_id": user["id"],
+        "partition": work_partition(user["id"]),
         "product_url": data.product_url,
-        "product_name": product_info.get("title", "Unknown Product"),
-        "product_image": product_info.get("image"),
+        "product_name": product_info.get("product_name") or "Unknown Product",
+        "product_image": product_info.get("product_image"),
         "original_price": current_price,
         "current_price": current_price,
         "target_price": data.target_price or (current_price * 0.9 if current_price else None),  # Default 10% drop
@@ -1616,12 +3932,16 @@ async def create_price_alert(data: PriceAlertRequest, user: dict = Depends(get_c
     }
     
     await db.price_alerts.insert_one(alert)
+    await bump_user_data_version(user["id"], "price_alerts")
     
     return PriceAlertResponse(**{k: v for k, v in alert.items() if k != "_id"})
 
 @api_router.get("/price-alerts")
-async def get_price_alerts(user: dict = Depends(get_current_user)):
+async def get_price_alerts(request: Request, response: Response, user: dict = Depends(get_current_user)):
     """Get all price alerts for the current user"""
+    not_modified = not_modified_response(request, response, user_data_etag(user, "price_alerts"))
+    if not_modified:
+        return not_modified
     alerts = await db.price_alerts.find(
         {"user_id": user["id"]}, 
         {"_id": 0}
@@ -1638,6 +3958,7 @@ async def delete_price_alert(alert_id: str, user: dict = Depends(get_current_use
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Alert not found")
+    await bump_user_data_version(user["id"], "price_alerts")
     
     return {"message": "Alert deleted"}
 
@@ -1658,109 +3979,413 @@ async def toggle_price_alert(alert_id: str, user: dict = Depends(get_current_use
         {"id": alert_id},
         {"$set": {"is_active": new_status}}
     )
+    await bump_user_data_version(user["id"], "price_alerts")
     
     return {"message": f"Alert {'activated' if new_status else 'deactivated'}", "is_active": new_status}
 
-@api_router.post("/price-alerts/check")
-async def check_price_alerts(user: dict = Depends(get_current_user)):
-    """Manually check all active price alerts for price drops"""
-    alerts = await db.price_alerts.find({
-        "user_id": user["id"],
-        "is_active": True
-    }, {"_id": 0}).to_list(100)
+# Parsed once at import; rendering is a substitution per digest and per product
+PRICE_DROP_ITEM_TEMPLATE = Template("""
+    <div style="background: rgba(16, 185, 129, 0.1); border: 1px solid rgba(16, 185, 129, 0.3); border-radius: 12px; padding: 20px; margin: 20px 0;">
+        <h3 style="color: #fff; margin: 0 0 12px 0;">$product_name</h3>
+        <p style="color: #ef4444; font-size: 14px; margin: 0; text-decoration: line-through;">Original: $original_price</p>
+        <p style="color: #10b981; font-size: 24px; font-weight: bold; margin: 8px 0;">Now: $$$current_price</p>
+        <p style="color: #fbbf24; font-size: 14px; margin: 0 0 12px 0;">You save: $$$savings!</p>
+        <a href="$product_url" style="display: inline-block; background: linear-gradient(135deg, #3b82f6 0%, #10b981 100%); color: white; padding: 10px 24px; text-decoration: none; border-radius: 12px; font-weight: 600; font-size: 14px;">
+            View Product
+        </a>
+    </div>""")
+
+PRICE_DROP_DIGEST_TEMPLATE = Template("""
+<div style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; max-width: 600px; margin: 0 auto; background: linear-gradient(135deg, #0f172a 0%, #1e293b 100%); padding: 32px; border-radius: 16px;">
+    <h2 style="color: #10b981; font-size: 24px; margin: 0 0 16px 0;">🎉 Price Drop Alert!</h2>
+    <p style="color: #e2e8f0; font-size: 16px; line-height: 1.6;">
+        Great news! $intro
+    </p>
+    $items
+    <p style="color: #64748b; font-size: 12px; margin-top: 24px;">
+        These alerts were set up on Veriqo. You can manage your alerts in your dashboard.
+    </p>
+</div>
+""")
+
+def render_price_drop_digest(drops: List[dict]) -> dict:
+    """Subject and HTML of one digest email covering `drops` (alert and current price per product)"""
+    shown = drops[:PRICE_ALERT_NOTIFY_CONFIG["max_items_per_digest"]]
+    items = "".join(PRICE_DROP_ITEM_TEMPLATE.substitute(
+        product_name=html.escape(drop["alert"]["product_name"][:100]),
+        original_price=f"${drop['alert']['original_price']:.2f}" if drop["alert"].get("original_price") else "N/A",
+        current_price=f"{drop['current_price']:.2f}",
+        savings=f"{(drop['alert'].get('original_price') or drop['current_price']) - drop['current_price']:.2f}",
+        product_url=html.escape(drop["alert"]["product_url"], quote=True)
+    ) for drop in shown)
+    
+    if len(drops) == 1:
+        subject = f"🎉 Price Drop Alert: {drops[0]['alert']['product_name'][:50]}"
+        intro = "A product on your watchlist just dropped in price."
+    else:
+        subject = f"🎉 Price Drop Alert: {len(drops)} products on your watchlist"
+        intro = f"{len(drops)} products on your watchlist just dropped in price."
+    if len(drops) > len(shown):
+        intro += f" Showing the first {len(shown)}."
+    return {"subject": subject, "html": PRICE_DROP_DIGEST_TEMPLATE.substitute(intro=intro, items=items)}
+
+def send_price_drop_digest(user: dict, drops: List[dict]):
+    """Email a user one digest of the alerts that newly dropped below target"""
+    resend.Emails.send({"from": SENDER_EMAIL, "to": [user["email"]], **render_price_drop_digest(drops)})
+
+def is_new_price_drop(alert: dict, current_price: float) -> bool:
+    """A drop below target not yet notified, or a further drop well below the last notified price"""
+    notified_price = alert.get("notified_price")
+    if notified_price is None:
+        return True
+    return current_price <= notified_price * (1 - PRICE_ALERT_NOTIFY_CONFIG["renotify_drop_percent"] / 100)
+
+async def claim_price_drop_notifications(drops: List[dict], now: str) -> List[dict]:
+    """
+    Mark each drop's alert as notified at its current price in one conditional update per
+    alert, which only matches while the drop is still new (see is_new_price_drop). Overlapping
+    checks of the same alerts (a manual check racing the sweep) thus mail each drop once.
+    Returns the drops this check claimed.
+    """
+    renotify_ratio = 1 - PRICE_ALERT_NOTIFY_CONFIG["renotify_drop_percent"] / 100
+    
+    async def claim(drop: dict) -> bool:
+        result = await db.price_alerts.update_one(
+            {"id": drop["alert"]["id"], "$or": [
+                {"notified_price": None},
+                {"notified_price": {"$gte": drop["current_price"] / renotify_ratio}}
+            ]},
+            {"$set": {"notified_price": drop["current_price"], "notified_at": now}}
+        )
+        return result.modified_count == 1
     
+    claimed = await asyncio.gather(*(claim(drop) for drop in drops))
+    return [drop for drop, won in zip(drops, claimed) if won]
+
+async def release_price_drop_notifications(drops: List[dict], now: str):
+    """Undo claims whose digest failed to send, so the next check tries again"""
+    async def release(drop: dict):
+        alert = drop["alert"]
+        if alert.get("notified_price") is None:
+            update = {"$unset": {"notified_price": "", "notified_at": ""}}
+        else:
+            update = {"$set": {"notified_price": alert["notified_price"], "notified_at": alert.get("notified_at")}}
+        await db.price_alerts.update_one(
+            {"id": alert["id"], "notified_price": drop["current_price"], "notified_at": now}, update
+        )
+    
+    await asyncio.gather(*(release(drop) for drop in drops))
+
+async def check_alerts(alerts: List[dict], users: dict) -> dict:
+    """
+    Check alerts against current prices (one scrape_cache query plus fetches of stale products)
+    and store the checked prices in one bulk write. Owners in `users` (by id) get one digest
+    email per check covering their new drops; each alert's notification is claimed before the
+    mail is sent (and released if it fails), so a price that stays below target isn't mailed
+    about again, even by overlapping checks or replicas. Returns the dropped products and the
+    number of emails sent.
+    """
     dropped_alerts = []
+    new_drops = {}  # user_id -> [{"alert", "current_price"}]
+    alert_updates = {}  # alert id -> $set / $unset
+    
+    # Current prices through the shared scrape cache, in one query plus fetches of stale products
+    product_infos = await get_products_info([alert["product_url"] for alert in alerts], fresh_price=True)
+    now = datetime.now(timezone.utc).isoformat()
     
     for alert in alerts:
         try:
-            # Scrape current price
-            product_info = await scrape_amazon_product(alert["product_url"])
+            product_info = product_infos.get(alert["product_url"], {})
+            current_price = parse_price(product_info.get("price"))
+            if not current_price:
+                continue
             
-            current_price = None
-            if product_info.get("price"):
-                try:
-                    price_str = product_info["price"].replace("$", "").replace(",", "").strip()
-                    current_price = float(price_str)
-                except:
-                    pass
-            
-            if current_price:
-                now = datetime.now(timezone.utc).isoformat()
-                price_dropped = False
-                
-                # Check if price dropped below target
-                if alert.get("target_price") and current_price <= alert["target_price"]:
-                    price_dropped = True
-                    dropped_alerts.append({
-                        "product_name": alert["product_name"],
-                        "original_price": alert.get("original_price"),
-                        "current_price": current_price,
-                        "target_price": alert.get("target_price"),
-                        "product_url": alert["product_url"]
-                    })
-                    
-                    # Send email notification
-                    if resend.api_key:
-                        try:
-                            user_data = await db.users.find_one({"id": user["id"]}, {"_id": 0})
-                            if user_data and user_data.get("email"):
-                                savings = alert.get("original_price", current_price) - current_price
-                                params = {
-                                    "from": SENDER_EMAIL,
-                                    "to": [user_data["email"]],
-                                    "subject": f"🎉 Price Drop Alert: {alert['product_name'][:50]}",
-                                    "html": f"""
-                                    <div style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; max-width: 600px; margin: 0 auto; background: linear-gradient(135deg, #0f172a 0%, #1e293b 100%); padding: 32px; border-radius: 16px;">
-                                        <h2 style="color: #10b981; font-size: 24px; margin: 0 0 16px 0;">🎉 Price Drop Alert!</h2>
-                                        <p style="color: #e2e8f0; font-size: 16px; line-height: 1.6;">
-                                            Great news! A product on your watchlist just dropped in price.
-                                        </p>
-                                        <div style="background: rgba(16, 185, 129, 0.1); border: 1px solid rgba(16, 185, 129, 0.3); border-radius: 12px; padding: 20px; margin: 20px 0;">
-                                            <h3 style="color: #fff; margin: 0 0 12px 0;">{alert['product_name'][:100]}</h3>
-                                            <p style="color: #ef4444; font-size: 14px; margin: 0; text-decoration: line-through;">Original: ${alert.get('original_price', 'N/A')}</p>
-                                            <p style="color: #10b981; font-size: 24px; font-weight: bold; margin: 8px 0;">Now: ${current_price:.2f}</p>
-                                            <p style="color: #fbbf24; font-size: 14px; margin: 0;">You save: ${savings:.2f}!</p>
-                                        </div>
-                                        <a href="{alert['product_url']}" style="display: inline-block; background: linear-gradient(135deg, #3b82f6 0%, #10b981 100%); color: white; padding: 14px 32px; text-decoration: none; border-radius: 12px; font-weight: 600; font-size: 16px;">
-                                            View Product
-                                        </a>
-                                        <p style="color: #64748b; font-size: 12px; margin-top: 24px;">
-                                            This alert was set up on Veriqo. You can manage your alerts in your dashboard.
-                                        </p>
-                                    </div>
-                                    """
-                                }
-                                await asyncio.to_thread(resend.Emails.send, params)
-                                logging.info(f"Price drop email sent for {alert['product_name']}")
-                        except Exception as e:
-                            logging.error(f"Failed to send price drop email: {e}")
-                
-                # Update alert with current price
-                await db.price_alerts.update_one(
-                    {"id": alert["id"]},
-                    {"$set": {
-                        "current_price": current_price,
-                        "last_checked": now,
-                        "price_dropped": price_dropped
-                    }}
-                )
+            update = {"$set": {"current_price": current_price, "last_checked": now, "price_dropped": False}}
+            # Check if price dropped below target
+            if alert.get("target_price") and current_price <= alert["target_price"]:
+                update["$set"]["price_dropped"] = True
+                dropped_alerts.append({
+                    "product_name": alert["product_name"],
+                    "original_price": alert.get("original_price"),
+                    "current_price": current_price,
+                    "target_price": alert.get("target_price"),
+                    "product_url": alert["product_url"]
+                })
+                if is_new_price_drop(alert, current_price):
+                    new_drops.setdefault(alert["user_id"], []).append({"alert": alert, "current_price": current_price})
+            elif alert.get("notified_price") is not None:
+                # Back above target: the next drop below it is new again
+                update["$unset"] = {"notified_price": ""}
+            alert_updates[alert["id"]] = update
         except Exception as e:
             logging.error(f"Error checking price for alert {alert['id']}: {e}")
     
+    emails_sent = 0
+    for user_id, drops in new_drops.items():
+        user = users.get(user_id) or {}
+        if not resend.api_key or not user.get("email"):
+            continue
+        drops = await claim_price_drop_notifications(drops, now)
+        if not drops:
+            continue
+        try:
+            await asyncio.to_thread(send_price_drop_digest, user, drops)
+        except Exception as e:
+            # Released, so the next check tries again
+            PRICE_ALERT_EMAILS.inc("failed")
+            logging.error(f"Failed to send price drop digest to user {user_id}: {e}")
+            await release_price_drop_notifications(drops, now)
+            continue
+        PRICE_ALERT_EMAILS.inc("sent")
+        emails_sent += 1
+        logging.info(f"Price drop digest sent to user {user_id} for {len(drops)} products")
+    
+    if alert_updates:
+        await db.price_alerts.bulk_write(
+            [UpdateOne({"id": alert_id}, update) for alert_id, update in alert_updates.items()], ordered=False
+        )
+        await bump_user_data_version({alert["user_id"] for alert in alerts if alert["id"] in alert_updates}, "price_alerts")
+    return {"dropped": dropped_alerts, "emails_sent": emails_sent}
+
+@api_router.post("/price-alerts/check")
+async def check_price_alerts(user: dict = Depends(get_current_user)):
+    """Manually check all active price alerts for price drops"""
+    alerts = await db.price_alerts.find({
+        "user_id": user["id"],
+        "is_active": True
+    }, {"_id": 0}).to_list(100)
+    
+    # The requesting user owns every alert checked here
+    result = await check_alerts(alerts, {user["id"]: user})
+    
     return {
         "checked": len(alerts),
-        "price_drops": len(dropped_alerts),
-        "dropped_products": dropped_alerts
+        "price_drops": len(result["dropped"]),
+        "dropped_products": result["dropped"],
+        "notifications_sent": result["emails_sent"]
     }
 
+async def assign_alert_partitions():
+    """Give alerts created before work partitioning their owner's partition"""
+    legacy = await db.price_alerts.find(
+        {"partition": {"$exists": False}}, {"_id": 0, "id": 1, "user_id": 1}
+    ).to_list(1000)
+    if legacy:
+        await db.price_alerts.bulk_write([
+            UpdateOne({"id": alert["id"]}, {"$set": {"partition": work_partition(alert["user_id"])}})
+            for alert in legacy
+        ], ordered=False)
+        await bump_user_data_version({alert["user_id"] for alert in legacy}, "price_alerts")
+
+async def run_price_alert_sweep(leases: PartitionLeases = alert_leases) -> dict:
+    """
+    Check due alerts in the price_alerts partitions (by user) this replica holds, oldest first.
+    Alerts are checked in small chunks, each only while its partition is still held, so a
+    partition taken over mid-run isn't checked twice (check_alerts' notification claims keep
+    it from being emailed about twice).
+    """
+    partitions = leases.held_partitions()
+    if not partitions:
+        return {"checked": 0, "price_drops": 0, "emails_sent": 0}
+    await assign_alert_partitions()
+    
+    due_before = (datetime.now(timezone.utc) - timedelta(hours=ALERT_SWEEP_CONFIG["check_every_hours"])).isoformat()
+    alerts = await db.price_alerts.find(
+        {"partition": {"$in": partitions}, "is_active": True, "last_checked": {"$lt": due_before}},
+        {"_id": 0}
+    ).sort("last_checked", 1).to_list(ALERT_SWEEP_CONFIG["max_alerts_per_run"])
+    if not alerts:
+        return {"checked": 0, "price_drops": 0, "emails_sent": 0}
+    
+    users = {}
+    async for user in db.users.find(
+        {"id": {"$in": list({alert["user_id"] for alert in alerts})}}, {"_id": 0, "id": 1, "email": 1, "name": 1}
+    ):
+        users[user["id"]] = user
+    
+    # Chunks of whole users, so each user gets at most one digest per run
+    by_user = {}
+    for alert in alerts:
+        by_user.setdefault(alert["user_id"], []).append(alert)
+    chunks = [[]]
+    for user_alerts in by_user.values():
+        if len(chunks[-1]) >= 50:
+            chunks.append([])
+        chunks[-1].extend(user_alerts)
+    
+    totals = {"checked": 0, "price_drops": 0, "emails_sent": 0}
+    for chunk in chunks:
+        chunk = [alert for alert in chunk if leases.holds_partition(alert["partition"])]
+        if chunk:
+            result = await check_alerts(chunk, users)
+            totals["checked"] += len(chunk)
+            totals["price_drops"] += len(result["dropped"])
+            totals["emails_sent"] += result["emails_sent"]
+    return totals
+
+async def price_alert_sweep_loop():
+    """Background loop checking due price alerts every `interval_minutes`"""
+    while True:
+        await asyncio.sleep(ALERT_SWEEP_CONFIG["interval_minutes"] * 60)
+        if not ALERT_SWEEP_CONFIG["enabled"]:
+            continue
+        try:
+            result = await run_price_alert_sweep()
+            logging.info(f"Price alert sweep: {result}")
+        except Exception as e:
+            logging.error(f"Price alert sweep error: {e}")
+
 # Health check
 @api_router.get("/")
 async def root():
     return {"message": "Veriqo API v1.0", "status": "healthy"}
 
+# ==================== WARM-UP & READINESS ====================
+
+# Modules imported lazily on the request path, pre-imported during warm-up
+WARMUP_MODULES = ["emergentintegrations.llm.chat", "emergentintegrations.payments.stripe.checkout", "bs4", "lxml"]
+if LLM_PROVIDER == "openai":
+    WARMUP_MODULES.append("openai")
+
+# Outbound hosts whose connection pools (DNS, TCP, TLS) are primed during warm-up
+WARMUP_HOSTS = ["https://www.amazon.com/"]
+
+# Indexes for the hot query paths: (collection, keys, options)
+MONGO_INDEXES = [
+    ("users", [("id", 1)], {"unique": True}),
+    ("users", [("email", 1)], {}),
+    ("users", [("phone", 1)], {}),
+    ("product_analyses", [("user_id", 1), ("analyzed_at", -1)], {}),
+    ("product_analyses", [("analyzed_at", -1)], {}),
+    ("product_analyses", [("amazon_url", 1), ("user_id", 1)], {}),
+    ("canonical_analyses", [("id", 1)], {"unique": True}),
+    ("ai_cache", [("product_id", 1)], {}),
+    ("ai_usage", [("user_id", 1), ("timestamp", -1)], {}),
+    ("ai_usage", [("timestamp", -1)], {}),
+    ("ai_usage_daily", [("date", 1), ("user_id", 1)], {"unique": True}),
+    ("extension_usage", [("ip", 1), ("timestamp", -1)], {}),
+    ("extension_usage", [("timestamp", -1)], {}),
+    ("daily_limits", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("scrape_cache", [("product_id", 1)], {"unique": True}),
+    ("scrape_failures", [("product_id", 1)], {"unique": True}),
+    ("scrape_failures", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("wishlist", [("user_id", 1), ("added_at", -1)], {}),
+    ("price_alerts", [("user_id", 1), ("created_at", -1)], {}),
+    ("price_alerts", [("id", 1)], {}),
+    ("price_alerts", [("partition", 1), ("is_active", 1), ("last_checked", 1)], {}),
+    ("work_leases", [("job", 1), ("owner", 1)], {}),
+    ("work_members", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("password_resets", [("token", 1)], {}),
+    ("phone_otps", [("phone", 1)], {}),
+    ("cache_warmer_stats", [("date", 1)], {"unique": True}),
+    ("price_history_hourly", [("product_id", 1), ("bucket", 1)], {"unique": True}),
+    ("price_history_hourly", [("bucket", 1)], {"expireAfterSeconds": PRICE_HISTORY_CONFIG["hourly_retention_days"] * 86400}),
+    ("price_history_daily", [("product_id", 1), ("bucket", 1)], {"unique": True}),
+    ("price_history_daily", [("bucket", 1)], {"expireAfterSeconds": PRICE_HISTORY_CONFIG["daily_retention_days"] * 86400}),
+]
+
+READINESS = {"ready": False, "warmup": {}}
+
+async def timed_check(name: str, coro, timeout: float = 10.0) -> dict:
+    """Run one warm-up/readiness step with a timeout, recording status and latency"""
+    started = time.monotonic()
+    try:
+        detail = await asyncio.wait_for(coro, timeout)
+        status = "ok"
+    except Exception as e:
+        detail = str(e) or type(e).__name__
+        status = "error"
+        logging.warning(f"Warm-up step {name} failed: {detail}")
+    result = {"status": status, "latency_ms": round((time.monotonic() - started) * 1000, 1)}
+    if detail is not None:
+        result["detail"] = detail
+    return result
+
+async def import_heavy_modules():
+    import importlib
+    
+    failed = []
+    for module in WARMUP_MODULES:
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except ImportError:
+            failed.append(module)
+    if failed:
+        raise ImportError(f"Could not import: {', '.join(failed)}")
+
+async def ping_mongo():
+    await db.command("ping")
+
+async def apply_indexes():
+    failed = []
+    try:
+        await ensure_price_observations_collection()
+    except Exception as e:
+        failed.append(f"price_observations: {e}")
+    for collection, keys, options in MONGO_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            failed.append(f"{collection}: {e}")
+    if failed:
+        raise RuntimeError("; ".join(failed))
+    return f"{len(MONGO_INDEXES)} indexes"
+
+async def prime_http_pools():
+    for url in WARMUP_HOSTS:
+        await scrape_http_client.head(url)
+
+async def warm_up():
+    """Pre-import heavy modules, open the Mongo pool, apply indexes, prime outbound pools and load runtime config"""
+    steps = {
+        "imports": import_heavy_modules(),
+        "mongo": ping_mongo(),
+        "indexes": apply_indexes(),
+        "http_pools": prime_http_pools(),
+        "ai_config": load_ai_config(),
+    }
+    results = await asyncio.gather(*(timed_check(name, coro, timeout=30.0) for name, coro in steps.items()))
+    READINESS["warmup"] = dict(zip(steps, results))
+    # Only the database is required to serve traffic; the other steps only make the first requests faster
+    READINESS["ready"] = READINESS["warmup"]["mongo"]["status"] == "ok"
+    logging.info(f"Warm-up finished: {READINESS['warmup']}")
+
+@api_router.get("/health")
+async def health():
+    """Liveness: the process is up and serving"""
+    return {"status": "healthy"}
+
+@api_router.get("/health/ready")
+async def health_ready(response: Response):
+    """Readiness: warm-up results and a live Mongo ping, with per-dependency latency"""
+    mongo = await timed_check("mongo", ping_mongo(), timeout=2.0)
+    ready = READINESS["ready"] and mongo["status"] == "ok"
+    if not ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if ready else "not_ready",
+        "dependencies": {"mongo": mongo},
+        "warmup": READINESS["warmup"]
+    }
+
+# Prometheus scrape endpoint (outside /api), served only when METRICS_TOKEN is set and sent as a bearer token
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: str = Header(None)):
+    from fastapi.responses import PlainTextResponse
+    
+    metrics_token = os.environ.get("METRICS_TOKEN")
+    if not metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(authorization or "", f"Bearer {metrics_token}"):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(DbCommandBudgetMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1775,6 +4400,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long-running background jobs started with the app
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_jobs():
+    await warm_up()
+    background_tasks.append(asyncio.create_task(event_writer.run()))
+    background_tasks.append(asyncio.create_task(ai_config_sync_loop()))
+    background_tasks.append(asyncio.create_task(work_coordination_loop()))
+    background_tasks.append(asyncio.create_task(cache_warmer_loop()))
+    background_tasks.append(asyncio.create_task(price_alert_sweep_loop()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Let analyses finish storing their canonical copy and cache entry before the client goes away
+    if analysis_inflight:
+        await asyncio.wait(list(analysis_inflight.values()), timeout=10)
+    # Write out buffered telemetry
+    await event_writer.flush()
+    # Hand background work partitions to the other replicas right away
+    try:
+        await work_coordinator.release()
+    except Exception as e:
+        logging.warning(f"Releasing work partitions failed: {e}")
+    await scrape_http_client.aclose()
+    if openai_client is not None:
+        await openai_client.close()
     client.close()
@@ -0,0 +1,76 @@
+"""
+Benchmark: compiled safety filter vs the original sanitize_ai_output loop.
+
+Run from the repo root (no database connection is made):
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=veriqo_bench python tests/bench_sanitize.py
+"""
+
+import copy
+import os
+import sys
+import timeit
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "veriqo_bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from server import sanitize_ai_output, REQUIRED_DISCLAIMERS  # noqa: E402
+
+ITERATIONS = 20000
+
+SAMPLE_ANALYSIS = {
+    "product_name": "Wireless Earbuds Pro - Definitely The Best Sound",
+    "verdict": "good_match",
+    "confidence_score": 78,
+    "summary": "Most customers describe solid battery life. Some reviewers certainly mention the case feels light, "
+               "and a few say you should definitely check fit before long sessions. Not a scam, per feedback.",
+    "things_to_know": [
+        {"title": "Fit varies", "description": "Some customers reported the tips may not suit smaller ears", "frequency": "~12% of feedback"},
+        {"title": "Avoid water", "description": "Feedback indicates the case is not water resistant", "frequency": "~6% of feedback"},
+        {"title": "App pairing", "description": "A few users mention pairing took several attempts", "frequency": "~4% of feedback"},
+    ],
+    "best_suited_for": ["Commuters", "Users who certainly value battery life"],
+    "positive_highlights": ["Battery life appears strong", "Definitely comfortable for most users"],
+}
+
+
+def legacy_sanitize_ai_output(result: dict) -> dict:
+    """The sanitize_ai_output text filtering as it was before the compiled filter"""
+    forbidden_phrases = [
+        "fake review", "fraudulent", "scam", "dishonest", "lying",
+        "definitely", "certainly", "you must", "you should definitely",
+        "avoid", "don't buy", "do not buy"
+    ]
+    for field in ["summary", "product_name"]:
+        if field in result and isinstance(result[field], str):
+            text = result[field]
+            for phrase in forbidden_phrases:
+                text = text.replace(phrase, "")
+                text = text.replace(phrase.title(), "")
+            result[field] = text
+    if "things_to_know" in result:
+        for item in result["things_to_know"]:
+            if "description" in item:
+                text = item["description"]
+                for phrase in forbidden_phrases:
+                    text = text.replace(phrase, "")
+                item["description"] = text
+    result["disclaimers"] = REQUIRED_DISCLAIMERS
+    return result
+
+
+def bench(name, func, make_input):
+    seconds = min(timeit.repeat(lambda: func(make_input()), number=ITERATIONS, repeat=3))
+    print(f"{name:<40} {seconds / ITERATIONS * 1e6:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    fresh = lambda: copy.deepcopy(SAMPLE_ANALYSIS)
+    sanitized = sanitize_ai_output(copy.deepcopy(SAMPLE_ANALYSIS))
+    stamped = lambda: {**sanitized}
+
+    print(f"{ITERATIONS} iterations, best of 3 (input copy included)\n")
+    bench("copy only (baseline)", lambda r: r, fresh)
+    bench("legacy filter (fresh result)", legacy_sanitize_ai_output, fresh)
+    bench("compiled filter (fresh result)", sanitize_ai_output, fresh)
+    bench("compiled filter (cache hit, stamped)", sanitize_ai_output, stamped)
@@ -0,0 +1,147 @@
+"""
+Fixtures for the in-process tests, which run the backend through tests/load/harness.py.
+The remote integration tests (test_safe_core.py) don't use them.
+
+When LOAD_TEST_MONGO_URL is unset and a mongod binary is on PATH, a throwaway mongod is started
+for the session so the command budget tests run by default.
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+MONGOD_STARTUP_TIMEOUT = 30.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def pytest_configure(config):
+    """Start a throwaway mongod before collection, so the budget tests' skip conditions see it"""
+    mongod = shutil.which("mongod")
+    if os.environ.get("LOAD_TEST_MONGO_URL"):
+        return
+    if not mongod:
+        if os.environ.get("CI"):
+            # CI must run the budgets against a real mongod rather than skip the tests needing one
+            raise pytest.UsageError("CI needs a real mongod: set LOAD_TEST_MONGO_URL or put mongod on PATH")
+        return
+    dbpath = tempfile.mkdtemp(prefix="veriqo-mongod-")
+    port = free_port()
+    process = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    config._test_mongod = (process, dbpath)
+    if not wait_for_port(port, process, MONGOD_STARTUP_TIMEOUT):
+        pytest_unconfigure(config)
+        raise pytest.UsageError(f"mongod did not start on port {port} (dbpath {dbpath})")
+    os.environ["LOAD_TEST_MONGO_URL"] = f"mongodb://127.0.0.1:{port}"
+
+
+def pytest_unconfigure(config):
+    started = getattr(config, "_test_mongod", None)
+    if not started:
+        return
+    config._test_mongod = None
+    process, dbpath = started
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    os.environ.pop("LOAD_TEST_MONGO_URL", None)
+    shutil.rmtree(dbpath, ignore_errors=True)
+
+
+class InProcessApp:
+    """Synchronous wrapper around harness.running_app for plain pytest tests"""
+
+    def __init__(self, **options):
+        from tests.load.harness import running_app
+
+        self.loop = asyncio.new_event_loop()
+        self.context = running_app(**options)
+        self.app = self.loop.run_until_complete(self.context.__aenter__())
+        self.server = self.app.server
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def request(self, method: str, path: str, user: int = 0, headers: dict = None, **kwargs):
+        headers = {"Authorization": f"Bearer {self.app.tokens[user]}", **(headers or {})}
+        return self.run(self.app.http.request(method, path, headers=headers, **kwargs))
+
+    def settle(self):
+        """Wait for analyses to finish caching (after their responses) and flush buffered telemetry"""
+        if self.server.analysis_inflight:
+            self.run(asyncio.wait(list(self.server.analysis_inflight.values())))
+        self.run(self.server.event_writer.flush())
+
+    def close(self):
+        self.run(self.context.__aexit__(None, None, None))
+        self.loop.close()
+
+
+@pytest.fixture(scope="module")
+def inprocess_app():
+    """The backend with fast local Amazon/LLM stand-ins and 3 seeded premium users with 5 price alerts each"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from tests.load.fakes import FakeAmazon, FakeLlm
+
+    app = InProcessApp(
+        amazon=FakeAmazon(latency_ms=1, jitter_ms=0),
+        llm=FakeLlm(latency_ms=1, jitter_ms=0),
+        users=3,
+        products=20,
+        alerts_per_user=5,
+    )
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def db_commands(inprocess_app):
+    """
+    Returns a function reading a response's Mongo command counts: {"total", "budget", "breakdown"}.
+    Turns on the app's DEBUG_DB_COMMANDS headers for the duration of the test.
+    """
+    server = inprocess_app.server
+    previous = server.DEBUG_DB_COMMANDS
+    server.DEBUG_DB_COMMANDS = True
+
+    def read(response) -> dict:
+        breakdown = response.headers.get("X-DB-Command-Breakdown", "")
+        budget = response.headers.get("X-DB-Command-Budget")
+        return {
+            "total": int(response.headers["X-DB-Commands"]),
+            "budget": int(budget) if budget is not None else None,
+            "breakdown": {name: int(n) for name, _, n in (item.partition("=") for item in breakdown.split(",") if item)},
+        }
+
+    yield read
+    server.DEBUG_DB_COMMANDS = previous
@@ -0,0 +1,113 @@
+"""
+Local stand-ins for the services the backend calls out to:
+- FakeAmazon: an httpx transport serving the recorded product page for any /dp/<ASIN> URL
+- FakeLlm: an OpenAI-compatible client returning a valid analysis with token usage
+
+Both take a latency and an error rate so runs can model a slow or flaky upstream.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+from pathlib import Path
+from string import Template
+from types import SimpleNamespace
+
+import httpx
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+ASIN_PATTERN = re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})", re.IGNORECASE)
+
+
+def product_asins(count: int) -> list:
+    """Deterministic pool of fake ASINs"""
+    return [f"B0LOAD{i:04d}" for i in range(count)]
+
+
+def product_url(asin: str) -> str:
+    return f"https://www.amazon.com/dp/{asin}"
+
+
+def product_price(asin: str) -> float:
+    """Stable per-product price between $10 and $210"""
+    return 10 + int(hashlib.md5(asin.encode()).hexdigest()[:6], 16) % 20000 / 100
+
+
+class FakeAmazon:
+    """Serves the recorded product page for every /dp/<ASIN> request"""
+
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.template = Template((FIXTURES_DIR / "amazon_product.html").read_text())
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000)
+
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return httpx.Response(503, text="<html>Robot Check</html>")
+        if roll < self.throttle_rate + self.error_rate:
+            return httpx.Response(500, text="<html>Internal error</html>")
+
+        match = ASIN_PATTERN.search(request.url.path)
+        if request.method == "HEAD" or not match:
+            return httpx.Response(200, text="")
+        asin = match.group(1).upper()
+        page = self.template.substitute(
+            asin=asin,
+            title=f"Load Test Wireless Earbuds {asin}",
+            price=f"{product_price(asin):.2f}",
+            rating="4.4",
+            review_count=f"{1000 + int(asin[-4:]):,}",
+        )
+        return httpx.Response(200, text=page, headers={"Content-Type": "text/html; charset=utf-8"})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle), timeout=15.0, follow_redirects=True)
+
+
+class FakeLlm:
+    """Stand-in for openai.AsyncOpenAI: chat.completions.create returns a schema-valid analysis"""
+
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 200, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model: str, messages: list, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Fake LLM error")
+
+        prompt = messages[-1]["content"]
+        name = re.search(r"Product Name: (.+)", prompt)
+        content = json.dumps({
+            "product_name": name.group(1).strip() if name else "Load Test Product",
+            "verdict": "good_match",
+            "confidence_score": 78,
+            "summary": "Most customers describe solid battery life and clear sound; a few mention fit varies.",
+            "things_to_know": [
+                {"title": "Fit varies", "description": "Some customers found the tips large", "frequency": "~12% of feedback"},
+                {"title": "Pairing", "description": "A few users mention pairing took several attempts", "frequency": "~5% of feedback"},
+            ],
+            "best_suited_for": ["Commuters", "Users who value battery life"],
+            "positive_highlights": ["Battery life appears strong", "Clear sound for the price"],
+        })
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4),
+        )
+
+    async def close(self):
+        pass
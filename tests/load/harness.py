@@ -0,0 +1,260 @@
+"""
+Runs the backend in-process for load and budget tests.
+
+The app is served through httpx's ASGI transport with Amazon and the LLM replaced by the
+stand-ins in fakes.py. Mongo is a throwaway database on LOAD_TEST_MONGO_URL when set (needed for
+realistic latency), otherwise the in-memory mongomock-motor with its calls counted as the wire
+commands a real mongod would receive.
+"""
+
+import contextlib
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+
+from tests.load.fakes import FakeAmazon, FakeLlm, product_asins, product_price, product_url
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+
+
+def import_server():
+    """Import backend/server.py with the environment it needs; no connection is made on import"""
+    os.environ.setdefault("MONGO_URL", os.environ.get("LOAD_TEST_MONGO_URL", "mongodb://localhost:27017"))
+    os.environ.setdefault("DB_NAME", "veriqo_load")
+    # Route analyses through the OpenAI client, which the harness replaces with FakeLlm
+    os.environ["LLM_PROVIDER"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "load-test"
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    return server
+
+
+# Wire command sent by each collection method, for counting commands without a real mongod
+COLLECTION_METHOD_COMMANDS = {
+    "find": "find",
+    "find_one": "find",
+    "aggregate": "aggregate",
+    "count_documents": "aggregate",
+    "estimated_document_count": "count",
+    "distinct": "distinct",
+    "insert_one": "insert",
+    "insert_many": "insert",
+    "update_one": "update",
+    "update_many": "update",
+    "replace_one": "update",
+    "delete_one": "delete",
+    "delete_many": "delete",
+    "find_one_and_update": "findAndModify",
+    "find_one_and_replace": "findAndModify",
+    "find_one_and_delete": "findAndModify",
+    "create_index": "createIndexes",
+    "create_indexes": "createIndexes",
+}
+BULK_WRITE_COMMANDS = {
+    "InsertOne": "insert",
+    "UpdateOne": "update",
+    "UpdateMany": "update",
+    "ReplaceOne": "update",
+    "DeleteOne": "delete",
+    "DeleteMany": "delete",
+}
+
+
+def count_command(server, command_name: str, amount: int = 1):
+    """What MongoCommandMetrics.started does for a real command"""
+    counts = server.request_db_commands.get()
+    if counts is not None:
+        counts[command_name] = counts.get(command_name, 0) + amount
+
+
+def bulk_write_commands(requests: list, ordered: bool) -> list:
+    """Commands the driver splits a bulk write into: one per run of the same operation type
+    (ordered), or one per operation type (unordered)"""
+    kinds = [BULK_WRITE_COMMANDS[type(request).__name__] for request in requests]
+    if not ordered:
+        return sorted(set(kinds))
+    return [kind for i, kind in enumerate(kinds) if i == 0 or kinds[i - 1] != kind]
+
+
+class CommandCountingCollection:
+    """mongomock-motor collection counting the wire commands its calls would send"""
+
+    def __init__(self, server, collection):
+        self._server = server
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        command_name = COLLECTION_METHOD_COMMANDS.get(name)
+        if command_name is None:
+            return attribute
+
+        def counted(*args, **kwargs):
+            count_command(self._server, command_name)
+            return attribute(*args, **kwargs)
+        return counted
+
+    async def bulk_write(self, requests, ordered: bool = True, **kwargs):
+        requests = list(requests)
+        for command_name in bulk_write_commands(requests, ordered):
+            count_command(self._server, command_name)
+        return await self._collection.bulk_write(requests, ordered=ordered, **kwargs)
+
+
+class CommandCountingDatabase:
+    """mongomock-motor database whose collections count commands (see CommandCountingCollection)"""
+
+    def __init__(self, server, database):
+        self._server = server
+        self._database = database
+
+    def __getitem__(self, name):
+        return CommandCountingCollection(self._server, self._database[name])
+
+    def __getattr__(self, name):
+        if name in ("command", "create_collection", "drop_collection", "list_collection_names"):
+            return self._counted_database_method(name)
+        if name.startswith("_") or name in dir(self._database.delegate):
+            return getattr(self._database, name)
+        return self[name]
+
+    def _counted_database_method(self, name):
+        method = getattr(self._database, name)
+
+        async def counted(*args, **kwargs):
+            command_name = {"create_collection": "create", "drop_collection": "drop", "list_collection_names": "listCollections"}.get(name)
+            if command_name is None:
+                command = args[0] if args else ""
+                command_name = command if isinstance(command, str) else next(iter(command), "")
+            count_command(self._server, command_name)
+            return await method(*args, **kwargs)
+        return counted
+
+
+class CommandCountingMockClient:
+    """The in-memory client, counting per-request commands as the app's listener does on a real mongod"""
+
+    def __init__(self, server):
+        from mongomock_motor import AsyncMongoMockClient
+        self._server = server
+        self._client = AsyncMongoMockClient(tz_aware=True)
+
+    def __getitem__(self, name):
+        return CommandCountingDatabase(self._server, self._client[name])
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def mongo_client(server, mongo_url: str = None):
+    """
+    Motor client with the app's command metrics listener, or the in-memory substitute; mongomock
+    has no command monitoring, so its calls are counted by the wire command they stand for.
+    """
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[server.MongoCommandMetrics()])
+    return CommandCountingMockClient(server)
+
+
+async def seed(server, users: int, products: list, alerts_per_user: int) -> list:
+    """Premium users with price alerts (half of them below target). Returns a bearer token per user."""
+    now = datetime.now(timezone.utc).isoformat()
+    user_docs = []
+    alerts = []
+    tokens = []
+    for i in range(users):
+        user_id = f"load-user-{i}"
+        user_docs.append({
+            "id": user_id,
+            "email": f"load{i}@example.com",
+            "name": f"Load User {i}",
+            "subscription_type": "premium",
+            "checks_used_this_month": 0,
+            "month_reset_date": now,
+            "created_at": now,
+        })
+        for j in range(alerts_per_user):
+            asin = products[(i * alerts_per_user + j) % len(products)]
+            price = product_price(asin)
+            alerts.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "product_url": product_url(asin),
+                "product_name": f"Load Test Wireless Earbuds {asin}",
+                "product_image": None,
+                "original_price": round(price * 1.2, 2),
+                "current_price": round(price * 1.2, 2),
+                "target_price": round(price * (1.1 if j % 2 == 0 else 0.8), 2),
+                "is_active": True,
+                "created_at": now,
+                "last_checked": now,
+                "price_dropped": False,
+            })
+        tokens.append(server.create_token(user_id))
+
+    await server.db.users.insert_many(user_docs)
+    if alerts:
+        await server.db.price_alerts.insert_many(alerts)
+    return tokens
+
+
+@contextlib.asynccontextmanager
+async def running_app(
+    amazon: FakeAmazon = None,
+    llm: FakeLlm = None,
+    mongo_url: str = None,
+    users: int = 10,
+    products: int = 200,
+    alerts_per_user: int = 5,
+):
+    """
+    Start the app with its startup hooks against fresh data. Yields a namespace with the
+    `server` module, an `http` client bound to the app, user `tokens`, the product `asins`
+    and the fakes.
+    """
+    server = import_server()
+    mongo_url = mongo_url or os.environ.get("LOAD_TEST_MONGO_URL")
+    amazon = amazon or FakeAmazon()
+    llm = llm or FakeLlm()
+    asins = product_asins(products)
+
+    db_name = f"veriqo_load_{uuid.uuid4().hex[:8]}"
+    server.client = mongo_client(server, mongo_url)
+    server.db = server.client[db_name]
+    server.scrape_http_client = amazon.client()
+    server.openai_client = llm
+    # Per-process state holding tasks and asyncio primitives bound to an earlier run's event loop
+    server.host_breakers.clear()
+    server.background_tasks.clear()
+    server.analysis_inflight.clear()
+    server.scrape_inflight.clear()
+    server.public_insight_inflight.clear()
+    server.public_insight_cache["expires_at"] = 0.0
+    server.event_writer = server.BufferedEventWriter(**server.EVENT_WRITER_CONFIG)
+    server.resend.api_key = None
+    server.WARMER_CONFIG["enabled"] = False
+    server.AI_CONFIG["max_requests_per_user_per_day"] = 10 ** 9
+
+    tokens = await seed(server, users, asins, alerts_per_user)
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://veriqo.test", timeout=60.0
+        ) as http:
+            yield SimpleNamespace(server=server, http=http, tokens=tokens, asins=asins, amazon=amazon, llm=llm)
+    finally:
+        # Shutdown flushes buffered writes and closes the client (the in-memory one has no close)
+        with contextlib.suppress(AttributeError):
+            await server.app.router.shutdown()
+        if mongo_url:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            cleanup = AsyncIOMotorClient(mongo_url)
+            await cleanup.drop_database(db_name)
+            cleanup.close()
@@ -0,0 +1,205 @@
+"""
+Load test: drives the in-process app (see harness.py) with a weighted endpoint mix at a fixed
+concurrency and reports p50/p95/p99 latency and requests per second per endpoint.
+
+Run from the repo root:
+    python -m tests.load.run_load --concurrency 20 --duration 30
+    python -m tests.load.run_load --save-baseline main           # record tests/load/baselines/main.json
+    python -m tests.load.run_load --compare main --tolerance 0.2  # exit 1 on regressions
+
+Set LOAD_TEST_MONGO_URL to run against a local mongod (a throwaway database is created and
+dropped); without it the in-memory mongomock-motor is used, which understates Mongo latency.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from tests.load.fakes import FakeAmazon, FakeLlm, product_url
+from tests.load.harness import running_app
+
+BASELINES_DIR = Path(__file__).parent / "baselines"
+
+DEFAULTS = {
+    "concurrency": 20,
+    "duration": 30.0,
+    "warmup": 5.0,
+    "users": 20,
+    "products": 200,
+    "zipf": 1.1,
+    "alerts_per_user": 5,
+    "amazon_latency_ms": 250.0,
+    "amazon_error_rate": 0.01,
+    "amazon_throttle_rate": 0.01,
+    "llm_latency_ms": 900.0,
+    "llm_error_rate": 0.0,
+    "mix": "analyze=50,compare=10,history=25,export=5,alerts_check=10",
+    "seed": 42,
+}
+
+# Ignore p95 increases smaller than this; in-process runs are noisy at the low end
+NOISE_FLOOR_MS = 5.0
+
+
+def endpoint_request(name: str, rng: random.Random, asins: list, weights: list) -> tuple:
+    """(method, path, json body) for one request to the named endpoint"""
+    if name == "analyze":
+        asin = rng.choices(asins, weights)[0]
+        return "POST", "/api/analyze", {"amazon_url": product_url(asin)}
+    if name == "compare":
+        picked = set()
+        while len(picked) < 2:
+            picked.add(rng.choices(asins, weights)[0])
+        return "POST", "/api/compare", {"product_urls": [product_url(a) for a in picked]}
+    if name == "history":
+        return "GET", "/api/history", None
+    if name == "export":
+        return "GET", "/api/history/export", None
+    if name == "alerts_check":
+        return "POST", "/api/price-alerts/check", None
+    raise ValueError(f"Unknown endpoint {name}")
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: list, q: float):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    latencies = sorted(ms for ms, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "count": len(samples),
+        "rps": round(len(samples) / duration, 2) if duration else 0,
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None,
+        "errors": sum(1 for _, status in samples if status >= 400),
+        "server_errors": sum(1 for _, status in samples if status >= 500),
+        "statuses": statuses,
+    }
+
+
+async def run_load(**options) -> dict:
+    """Run one load test and return the report (see DEFAULTS for the options)"""
+    config = {**DEFAULTS, **options}
+    rng = random.Random(config["seed"])
+    mix = parse_mix(config["mix"])
+    amazon = FakeAmazon(
+        latency_ms=config["amazon_latency_ms"],
+        error_rate=config["amazon_error_rate"],
+        throttle_rate=config["amazon_throttle_rate"],
+    )
+    llm = FakeLlm(latency_ms=config["llm_latency_ms"], error_rate=config["llm_error_rate"])
+
+    async with running_app(
+        amazon=amazon, llm=llm, users=config["users"],
+        products=config["products"], alerts_per_user=config["alerts_per_user"]
+    ) as app:
+        # Zipf-like popularity so repeat products exercise the analysis cache
+        weights = [1 / (rank + 1) ** config["zipf"] for rank in range(len(app.asins))]
+        samples = {name: [] for name in mix}
+        started = time.perf_counter()
+        measure_from = started + config["warmup"]
+        deadline = measure_from + config["duration"]
+
+        async def worker(worker_id: int):
+            headers = {"Authorization": f"Bearer {app.tokens[worker_id % len(app.tokens)]}"}
+            while time.perf_counter() < deadline:
+                name = rng.choices(list(mix), list(mix.values()))[0]
+                method, path, body = endpoint_request(name, rng, app.asins, weights)
+                sent = time.perf_counter()
+                try:
+                    response = await app.http.request(method, path, json=body, headers=headers)
+                    status = response.status_code
+                except Exception:
+                    status = 599
+                if sent >= measure_from:
+                    samples[name].append(((time.perf_counter() - sent) * 1000, status))
+
+        await asyncio.gather(*(worker(i) for i in range(config["concurrency"])))
+        duration = time.perf_counter() - measure_from
+
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "config": config,
+            "duration_seconds": round(duration, 2),
+            "endpoints": {name: summarize(endpoint_samples, duration) for name, endpoint_samples in samples.items()},
+            "total": summarize([s for endpoint_samples in samples.values() for s in endpoint_samples], duration),
+            "upstream": {"amazon_requests": amazon.requests, "llm_requests": llm.requests},
+        }
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions against a saved baseline: p95 up or throughput down by more than `tolerance`"""
+    regressions = []
+    for name, current in report["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if not base or not current["count"] or not base["count"]:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance) and current["p95_ms"] - base["p95_ms"] > NOISE_FLOOR_MS:
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{'endpoint':<14}{'count':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    rows = list(report["endpoints"].items()) + [("TOTAL", report["total"])]
+    for name, s in rows:
+        print(f"{name:<14}{s['count']:>8}{s['rps']:>9}{str(s['p50_ms']):>10}{str(s['p95_ms']):>10}"
+              f"{str(s['p99_ms']):>10}{s['errors']:>8}")
+    print(f"\nupstream calls: {report['upstream']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for option, default in DEFAULTS.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save the report as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with baselines/NAME.json; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = vars(parser.parse_args())
+    save_as, compare_with, tolerance = args.pop("save_baseline"), args.pop("compare"), args.pop("tolerance")
+
+    report = asyncio.run(run_load(**args))
+    print_report(report)
+
+    if save_as:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        path = BASELINES_DIR / f"{save_as}.json"
+        path.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline {path}")
+
+    if compare_with:
+        baseline = json.loads((BASELINES_DIR / f"{compare_with}.json").read_text())
+        regressions = compare_to_baseline(report, baseline, tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {compare_with} (tolerance {tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
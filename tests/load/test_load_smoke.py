@@ -0,0 +1,28 @@
+"""
+Short in-process load run: every endpoint in the mix is exercised and none returns a 5xx.
+Needs the backend requirements plus either LOAD_TEST_MONGO_URL or mongomock-motor.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+from tests.load.run_load import run_load  # noqa: E402
+
+
+def test_short_mixed_run_has_no_server_errors():
+    report = asyncio.run(run_load(
+        concurrency=4, duration=3.0, warmup=0.0, users=4, products=20,
+        amazon_latency_ms=5.0, amazon_error_rate=0.0, amazon_throttle_rate=0.0, llm_latency_ms=5.0
+    ))
+    for name, stats in report["endpoints"].items():
+        assert stats["count"] > 0, f"{name} was never called"
+        assert stats["server_errors"] == 0, f"{name}: {stats['statuses']}"
+    # Repeat products are served from the analysis cache
+    assert report["upstream"]["llm_requests"] <= 20
@@ -0,0 +1,118 @@
+"""
+Streamed bulk analysis (POST /api/analyze/batch): cache hits first, quota refunds on failure
+and on client disconnect.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+USER = 2
+USER_ID = "load-user-2"
+
+
+@pytest.fixture(autouse=True)
+def business_user(inprocess_app):
+    server = inprocess_app.server
+    inprocess_app.run(server.db.users.update_one(
+        {"id": USER_ID}, {"$set": {"subscription_plan": "business_starter", "checks_used_this_month": 0}}
+    ))
+
+
+def product_urls(inprocess_app, *indexes):
+    from tests.load.fakes import product_url
+    return [product_url(inprocess_app.app.asins[i]) for i in indexes]
+
+
+def checks_used(inprocess_app) -> int:
+    server = inprocess_app.server
+    return inprocess_app.run(server.db.users.find_one({"id": USER_ID}))["checks_used_this_month"]
+
+
+async def post_and_disconnect(inprocess_app, body: dict) -> dict:
+    """POST a batch straight to the ASGI app and disconnect after the first streamed line"""
+    server = inprocess_app.server
+    first_line = asyncio.Event()
+    observed = {"chunks": [], "checks_used": None}
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+        await first_line.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            observed["chunks"].append(message["body"])
+            if not first_line.is_set():
+                user = await server.db.users.find_one({"id": USER_ID})
+                observed["checks_used"] = user["checks_used_this_month"]
+                first_line.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/analyze/batch",
+        "raw_path": b"/api/analyze/batch",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"veriqo.test"),
+            (b"content-type", b"application/json"),
+            (b"authorization", f"Bearer {inprocess_app.app.tokens[USER]}".encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("veriqo.test", 80),
+    }
+    await server.app(scope, receive, send)
+    return observed
+
+
+class TestBatchAnalysis:
+    def test_cache_hits_are_streamed_first_and_saved(self, inprocess_app):
+        server = inprocess_app.server
+        urls = product_urls(inprocess_app, 0, 1, 2)
+        for url in urls[:2]:
+            assert inprocess_app.request("POST", "/api/analyze", user=USER, json={"amazon_url": url}).status_code == 200
+        inprocess_app.settle()
+        history_before = inprocess_app.run(server.db.product_analyses.count_documents({"user_id": USER_ID}))
+        llm_requests = inprocess_app.app.llm.requests
+
+        response = inprocess_app.request("POST", "/api/analyze/batch", user=USER, json={"product_urls": urls})
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["type"] for line in lines] == ["started", "result", "result", "result", "summary"]
+        assert lines[0]["cached"] == 2
+        assert {line["product_id"] for line in lines[1:3]} == {inprocess_app.app.asins[i] for i in (0, 1)}
+        assert lines[3]["product_id"] == inprocess_app.app.asins[2]
+        assert all(line["analysis"]["amazon_url"] in urls for line in lines[1:4])
+        assert lines[-1] == {"type": "summary", "total": 3, "succeeded": 3, "failed": 0}
+
+        inprocess_app.settle()
+        history_after = inprocess_app.run(server.db.product_analyses.count_documents({"user_id": USER_ID}))
+        assert history_after == history_before + 3
+        assert inprocess_app.app.llm.requests == llm_requests + 1
+
+    def test_disconnect_refunds_unprocessed_checks(self, inprocess_app, monkeypatch):
+        # Misses are still running when the client goes away
+        monkeypatch.setattr(inprocess_app.app.llm, "latency_ms", 500)
+        urls = product_urls(inprocess_app, 3, 4, 5, 6)
+
+        observed = inprocess_app.run(post_and_disconnect(inprocess_app, {"product_urls": urls}))
+        inprocess_app.settle()
+
+        assert json.loads(observed["chunks"][0].splitlines()[0])["type"] == "started"
+        assert observed["checks_used"] == 4
+        assert checks_used(inprocess_app) == 0
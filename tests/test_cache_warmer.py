@@ -0,0 +1,65 @@
+"""
+Cache warmer credit: a warmed entry is credited as a prevented miss only for hits after the
+replaced entry's hard TTL, and only while no other refresh has replaced it.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+
+def cache(inprocess_app, product_id, **fields):
+    server = inprocess_app.server
+    result = {"amazon_url": f"https://www.amazon.com/dp/{product_id}", "product_name": "Warm", "verdict": "good_match", "confidence_score": 70}
+    inprocess_app.run(server.cache_analysis(product_id, result, compute_seconds=12.0))
+    if fields:
+        inprocess_app.run(server.db.ai_cache.update_one({"product_id": product_id}, {"$set": fields}))
+
+
+def prevented_misses(inprocess_app) -> int:
+    server = inprocess_app.server
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    stats = inprocess_app.run(server.db.cache_warmer_stats.find_one({"date": today})) or {}
+    return stats.get("prevented_misses", 0)
+
+
+class TestWarmerCredit:
+    def test_hit_before_hard_ttl_is_not_credited(self, inprocess_app):
+        server = inprocess_app.server
+        before = prevented_misses(inprocess_app)
+        # The replaced entry would still have been served stale for another hour
+        cache(inprocess_app, "B0WARMED01", warm_credit_after=(datetime.now(timezone.utc) + timedelta(hours=1)).isoformat())
+        assert inprocess_app.run(server.get_cached_analysis("B0WARMED01")) is not None
+        assert prevented_misses(inprocess_app) == before
+
+    def test_hit_after_hard_ttl_is_credited_once(self, inprocess_app):
+        server = inprocess_app.server
+        before = prevented_misses(inprocess_app)
+        cache(inprocess_app, "B0WARMED02", warm_credit_after=(datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat())
+        for _ in range(2):
+            assert inprocess_app.run(server.get_cached_analysis("B0WARMED02")) is not None
+        assert prevented_misses(inprocess_app) == before + 1
+
+    def test_other_refreshes_clear_the_credit(self, inprocess_app):
+        server = inprocess_app.server
+        before = prevented_misses(inprocess_app)
+        cache(inprocess_app, "B0WARMED03", warm_credit_after=(datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat())
+        # E.g. a refresh triggered by a user's stale hit
+        cache(inprocess_app, "B0WARMED03")
+        stored = inprocess_app.run(server.db.ai_cache.find_one({"product_id": "B0WARMED03"}))
+        assert "warm_credit_after" not in stored
+        inprocess_app.run(server.get_cached_analysis("B0WARMED03"))
+        assert prevented_misses(inprocess_app) == before
+
+    def test_hard_ttl_covers_the_stale_window(self, inprocess_app, monkeypatch):
+        server = inprocess_app.server
+        monkeypatch.setitem(server.AI_CONFIG, "cache_ttl_hours", 24)
+        monkeypatch.setitem(server.AI_CONFIG, "cache_stale_ttl_hours", 72)
+        assert server.cache_hard_ttl() == timedelta(hours=72)
+        monkeypatch.setitem(server.AI_CONFIG, "cache_stale_ttl_hours", 12)
+        assert server.cache_hard_ttl() == timedelta(hours=24)
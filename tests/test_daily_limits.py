@@ -0,0 +1,69 @@
+"""
+Per-day request limits (reserve_daily_limit): the extension's free analyses per IP and the
+per-user daily AI limit hold for back-to-back and concurrent requests, before any buffered
+usage logs are flushed.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+
+def product_urls(inprocess_app, *indexes):
+    from tests.load.fakes import product_url
+    return [product_url(inprocess_app.app.asins[i]) for i in indexes]
+
+
+class TestDailyLimits:
+    def test_concurrent_reservations_stop_at_the_limit(self, inprocess_app):
+        server = inprocess_app.server
+
+        async def reserve_many():
+            return await asyncio.gather(*(server.reserve_daily_limit("test", "concurrent", 3) for _ in range(8)))
+
+        assert sorted(inprocess_app.run(reserve_many())) == [False] * 5 + [True] * 3
+
+        inprocess_app.run(server.release_daily_limit("test", "concurrent"))
+        assert inprocess_app.run(server.reserve_daily_limit("test", "concurrent", 3))
+        assert not inprocess_app.run(server.reserve_daily_limit("test", "concurrent", 3))
+
+    def test_extension_limit_holds_for_back_to_back_requests(self, inprocess_app):
+        limit = inprocess_app.server.EXTENSION_DAILY_LIMIT
+        url = product_urls(inprocess_app, 0)[0]
+        statuses = [
+            inprocess_app.request("POST", "/api/extension/analyze", json={"amazon_url": url}).status_code
+            for _ in range(limit + 1)
+        ]
+        assert statuses == [200] * limit + [403]
+
+    def test_ai_limit_holds_for_back_to_back_requests(self, inprocess_app, monkeypatch):
+        server = inprocess_app.server
+        monkeypatch.setitem(server.AI_CONFIG, "max_requests_per_user_per_day", 2)
+        url = product_urls(inprocess_app, 1)[0]
+        statuses = [
+            inprocess_app.request("POST", "/api/analyze", user=1, json={"amazon_url": url}).status_code
+            for _ in range(3)
+        ]
+        assert statuses == [200, 200, 429]
+
+    def test_failed_analysis_is_not_counted(self, inprocess_app, monkeypatch):
+        server = inprocess_app.server
+        monkeypatch.setitem(server.AI_CONFIG, "max_requests_per_user_per_day", 1)
+
+        analyze_with_cache = server.analyze_with_cache
+
+        async def failing_analysis(amazon_url, user_id, timer):
+            raise RuntimeError("analysis failed")
+
+        monkeypatch.setattr(server, "analyze_with_cache", failing_analysis)
+        url = product_urls(inprocess_app, 2)[0]
+        with pytest.raises(RuntimeError):
+            inprocess_app.run(server.perform_ai_analysis(url, user_id="limit-user"))
+
+        monkeypatch.setattr(server, "analyze_with_cache", analyze_with_cache)
+        assert inprocess_app.run(server.perform_ai_analysis(url, user_id="limit-user"))["amazon_url"] == url
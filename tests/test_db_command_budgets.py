@@ -0,0 +1,190 @@
+"""
+Mongo command budgets per endpoint (DB_COMMAND_BUDGETS in server.py).
+Catches N+1 regressions: counts must stay within budget and must not grow with the number of
+products or alerts a request touches. Counted by the app's command listener on a real mongod
+(LOAD_TEST_MONGO_URL, or the one conftest.py starts when mongod is on PATH; CI runs them against
+a mongo service), otherwise by the harness from the calls made to mongomock-motor.
+"""
+
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+# The wishlist joins with $lookup pipelines (let), which mongomock doesn't implement
+requires_mongod = pytest.mark.skipif(
+    not os.environ.get("LOAD_TEST_MONGO_URL"),
+    reason="Needs a real mongod: put mongod on PATH or set LOAD_TEST_MONGO_URL"
+)
+
+
+def product_urls(inprocess_app, *indexes):
+    from tests.load.fakes import product_url
+    return [product_url(inprocess_app.app.asins[i]) for i in indexes]
+
+
+def assert_within_budget(counts):
+    assert counts["budget"] is not None, "endpoint has no declared budget"
+    assert counts["total"] <= counts["budget"], counts["breakdown"]
+
+
+def analyze(inprocess_app, url, user):
+    response = inprocess_app.request("POST", "/api/analyze", user=user, json={"amazon_url": url})
+    assert response.status_code == 200, response.text
+    return response
+
+
+class TestAnalysisBudgets:
+    """Analyze and the history reads"""
+
+    def test_analyze_miss_and_hit_within_budget(self, inprocess_app, db_commands):
+        url = product_urls(inprocess_app, 10)[0]
+        miss = db_commands(analyze(inprocess_app, url, user=1))
+        hit = db_commands(analyze(inprocess_app, url, user=1))
+        assert_within_budget(miss)
+        assert_within_budget(hit)
+        assert hit["total"] < miss["total"]
+
+    def test_history_and_export_within_budget(self, inprocess_app, db_commands):
+        for url in product_urls(inprocess_app, 11, 12, 13):
+            analyze(inprocess_app, url, user=1)
+        inprocess_app.settle()
+
+        history = inprocess_app.request("GET", "/api/history", user=1)
+        assert history.status_code == 200
+        assert len(history.json()) >= 3
+        assert_within_budget(db_commands(history))
+
+        export = inprocess_app.request("GET", "/api/history/export", user=1)
+        assert export.status_code == 200
+        assert_within_budget(db_commands(export))
+
+    def test_history_entry_written_before_response(self, inprocess_app):
+        # Another worker serving the next read has nothing to wait on: the entry must already be stored
+        response = analyze(inprocess_app, product_urls(inprocess_app, 7)[0], user=1)
+        server = inprocess_app.server
+        entry = inprocess_app.run(server.db.product_analyses.find_one({"id": response.json()["id"]}))
+        assert entry is not None
+        canonical = inprocess_app.run(server.db.canonical_analyses.find_one({"id": entry["analysis_ref"]}))
+        assert canonical is not None
+
+    def test_me_within_budget(self, inprocess_app, db_commands):
+        response = inprocess_app.request("GET", "/api/auth/me", user=1)
+        assert response.status_code == 200
+        assert_within_budget(db_commands(response))
+
+
+class TestNPlusOne:
+    """Handlers that used to issue one command per item"""
+
+    def test_compare_does_not_grow_with_product_count(self, inprocess_app, db_commands):
+        urls = product_urls(inprocess_app, 14, 15, 16)
+        for url in urls:
+            analyze(inprocess_app, url, user=2)
+        inprocess_app.settle()
+
+        two = inprocess_app.request("POST", "/api/compare", user=2, json={"product_urls": urls[:2]})
+        three = inprocess_app.request("POST", "/api/compare", user=2, json={"product_urls": urls})
+        assert two.status_code == three.status_code == 200
+        assert_within_budget(db_commands(three))
+        assert db_commands(two)["total"] == db_commands(three)["total"]
+
+    def test_price_alert_check_does_not_grow_with_alerts(self, inprocess_app, db_commands):
+        server = inprocess_app.server
+        # First check fetches the prices into scrape_cache
+        assert inprocess_app.request("POST", "/api/price-alerts/check", user=0).status_code == 200
+        five = inprocess_app.request("POST", "/api/price-alerts/check", user=0)
+        assert five.json()["checked"] == 5
+
+        alerts = inprocess_app.run(server.db.price_alerts.find({"user_id": "load-user-0"}, {"_id": 0}).to_list(None))
+        now = datetime.now(timezone.utc).isoformat()
+        inprocess_app.run(server.db.price_alerts.insert_many([
+            {**alert, "id": str(uuid.uuid4()), "created_at": now} for alert in alerts + alerts
+        ]))
+        fifteen = inprocess_app.request("POST", "/api/price-alerts/check", user=0)
+        assert fifteen.json()["checked"] == 15
+
+        assert_within_budget(db_commands(fifteen))
+        assert db_commands(five)["total"] == db_commands(fifteen)["total"]
+
+    def test_admin_stats_within_budget(self, inprocess_app, db_commands):
+        server = inprocess_app.server
+        inprocess_app.run(server.db.users.update_one({"id": "load-user-0"}, {"$set": {"is_admin": True}}))
+        response = inprocess_app.request("GET", "/api/admin/stats", user=0)
+        assert response.status_code == 200
+        assert response.json()["total_users"] == 3
+        assert_within_budget(db_commands(response))
+
+    @requires_mongod
+    def test_wishlist_does_not_grow_with_items(self, inprocess_app, db_commands):
+        urls = product_urls(inprocess_app, 17, 18, 19)
+        analyze(inprocess_app, urls[0], user=2)
+        inprocess_app.settle()
+        assert inprocess_app.request("POST", "/api/wishlist", user=2, json={"product_url": urls[0]}).status_code == 200
+        one = inprocess_app.request("GET", "/api/wishlist?refresh_stale=false", user=2)
+        for url in urls[1:]:
+            assert inprocess_app.request("POST", "/api/wishlist", user=2, json={"product_url": url}).status_code == 200
+        three = inprocess_app.request("GET", "/api/wishlist?refresh_stale=false", user=2)
+
+        assert three.status_code == 200
+        items = {item["product_id"]: item for item in three.json()}
+        assert items[inprocess_app.app.asins[17]]["verdict"] == "good_match"
+        assert items[inprocess_app.app.asins[18]]["verdict"] is None
+        assert_within_budget(db_commands(three))
+        assert db_commands(one)["total"] == db_commands(three)["total"]
+
+
+class TestHttpCaching:
+    """Conditional GETs and micro-cached public pages"""
+
+    def test_public_insights_served_from_micro_cache(self, inprocess_app, db_commands):
+        analyze(inprocess_app, product_urls(inprocess_app, 9)[0], user=0)
+        inprocess_app.settle()
+        inprocess_app.server.public_insight_cache["expires_at"] = 0.0
+
+        first = inprocess_app.request("GET", "/api/insights")
+        second = inprocess_app.request("GET", "/api/insights")
+        assert first.status_code == second.status_code == 200
+        assert_within_budget(db_commands(first))
+        assert db_commands(second)["total"] == 0
+        assert first.headers["ETag"] == second.headers["ETag"]
+        assert "max-age" in first.headers["Cache-Control"]
+
+        insight_id = first.json()[0]["id"]
+        item = inprocess_app.request("GET", f"/api/insights/{insight_id}")
+        assert item.status_code == 200
+        assert db_commands(item)["total"] == 0
+
+        not_modified = inprocess_app.request("GET", f"/api/insights/{insight_id}", headers={"If-None-Match": item.headers["ETag"]})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+    @pytest.mark.parametrize("path", [
+        "/api/auth/me",
+        "/api/history",
+        pytest.param("/api/wishlist", marks=requires_mongod),
+        "/api/price-alerts",
+    ])
+    def test_user_reads_revalidate_with_one_command(self, inprocess_app, db_commands, path):
+        inprocess_app.settle()
+        full = inprocess_app.request("GET", path, user=1)
+        assert full.status_code == 200
+        revalidated = inprocess_app.request("GET", path, user=1, headers={"If-None-Match": full.headers["ETag"]})
+        assert revalidated.status_code == 304
+        # Only the user lookup done by authentication
+        assert db_commands(revalidated)["total"] == 1
+
+    @requires_mongod
+    def test_writes_change_the_etag(self, inprocess_app):
+        before = inprocess_app.request("GET", "/api/wishlist", user=1)
+        url = product_urls(inprocess_app, 8)[0]
+        assert inprocess_app.request("POST", "/api/wishlist", user=1, json={"product_url": url}).status_code == 200
+
+        after = inprocess_app.request("GET", "/api/wishlist", user=1, headers={"If-None-Match": before.headers["ETag"]})
+        assert after.status_code == 200
+        assert any(item["product_url"] == url for item in after.json())
+        assert after.headers["ETag"] != before.headers["ETag"]
@@ -0,0 +1,130 @@
+"""
+Price drop digests sent by check_alerts, with resend.Emails.send stubbed out.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+from pymongo import ReplaceOne  # noqa: E402
+
+USER_ID = "load-user-0"
+
+
+@pytest.fixture
+def sent(inprocess_app, monkeypatch):
+    """Emails passed to resend, in order"""
+    server = inprocess_app.server
+    messages = []
+    monkeypatch.setattr(server.resend, "api_key", "re_test")
+    monkeypatch.setattr(server.resend.Emails, "send", lambda params: messages.append(params) or {"id": "email"})
+    return messages
+
+
+@pytest.fixture
+def alerts(inprocess_app):
+    """The user's alerts as seeded (half of them below target); restored after the test"""
+    server = inprocess_app.server
+    seeded = inprocess_app.run(server.db.price_alerts.find({"user_id": USER_ID}, {"_id": 0}).to_list(None))
+    yield seeded
+    inprocess_app.run(server.db.price_alerts.bulk_write([ReplaceOne({"id": alert["id"]}, alert) for alert in seeded]))
+
+
+def check(inprocess_app):
+    response = inprocess_app.request("POST", "/api/price-alerts/check", user=0)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def stored_alerts(inprocess_app):
+    server = inprocess_app.server
+    return {
+        alert["id"]: alert
+        for alert in inprocess_app.run(server.db.price_alerts.find({"user_id": USER_ID}, {"_id": 0}).to_list(None))
+    }
+
+
+def set_targets(inprocess_app, targets):
+    server = inprocess_app.server
+    for alert_id, target_price in targets.items():
+        inprocess_app.run(server.db.price_alerts.update_one({"id": alert_id}, {"$set": {"target_price": target_price}}))
+
+
+class TestPriceDropDigest:
+    def test_one_digest_covers_all_drops(self, inprocess_app, sent, alerts):
+        result = check(inprocess_app)
+        assert result["price_drops"] == 3
+        assert result["notifications_sent"] == 1
+        assert len(sent) == 1
+        assert sent[0]["to"] == ["load0@example.com"]
+        assert "3 products" in sent[0]["subject"]
+
+        for alert in stored_alerts(inprocess_app).values():
+            if alert["price_dropped"]:
+                assert alert["notified_price"] == alert["current_price"]
+                assert alert["notified_at"] == alert["last_checked"]
+            else:
+                assert "notified_price" not in alert
+
+    def test_price_staying_below_target_is_not_mailed_again(self, inprocess_app, sent, alerts):
+        assert check(inprocess_app)["notifications_sent"] == 1
+        again = check(inprocess_app)
+        assert again["price_drops"] == 3
+        assert again["notifications_sent"] == 0
+        assert len(sent) == 1
+
+    def test_drop_after_recovering_above_target_is_mailed(self, inprocess_app, sent, alerts):
+        check(inprocess_app)
+        dropped = {alert_id: alert for alert_id, alert in stored_alerts(inprocess_app).items() if alert["price_dropped"]}
+
+        # Price back above target: the notification is cleared without a mail
+        set_targets(inprocess_app, {alert_id: round(alert["current_price"] * 0.5, 2) for alert_id, alert in dropped.items()})
+        recovered = check(inprocess_app)
+        assert (recovered["price_drops"], recovered["notifications_sent"]) == (0, 0)
+        assert all("notified_price" not in stored_alerts(inprocess_app)[alert_id] for alert_id in dropped)
+
+        # Below target again
+        set_targets(inprocess_app, {alert_id: alert["target_price"] for alert_id, alert in dropped.items()})
+        assert check(inprocess_app)["notifications_sent"] == 1
+        assert len(sent) == 2
+
+    def test_failed_send_is_retried_at_next_check(self, inprocess_app, sent, alerts, monkeypatch):
+        server = inprocess_app.server
+
+        def fail(params):
+            raise RuntimeError("resend unavailable")
+
+        monkeypatch.setattr(server.resend.Emails, "send", fail)
+        result = check(inprocess_app)
+        assert (result["price_drops"], result["notifications_sent"]) == (3, 0)
+        assert all("notified_price" not in alert for alert in stored_alerts(inprocess_app).values())
+
+        monkeypatch.setattr(server.resend.Emails, "send", lambda params: sent.append(params) or {"id": "email"})
+        assert check(inprocess_app)["notifications_sent"] == 1
+        assert len(sent) == 1
+
+    def test_overlapping_checks_send_one_digest(self, inprocess_app, sent, alerts):
+        server = inprocess_app.server
+        user = inprocess_app.run(server.db.users.find_one({"id": USER_ID}, {"_id": 0}))
+
+        async def two_checks():
+            return await asyncio.gather(*(
+                server.check_alerts(alerts, {USER_ID: user}) for _ in range(2)
+            ))
+
+        results = inprocess_app.run(two_checks())
+        assert sorted(result["emails_sent"] for result in results) == [0, 1]
+        assert len(sent) == 1
+        assert "3 products" in sent[0]["subject"]
+
+    def test_further_drop_renotifies(self, inprocess_app):
+        server = inprocess_app.server
+        percent = server.PRICE_ALERT_NOTIFY_CONFIG["renotify_drop_percent"]
+        assert server.is_new_price_drop({}, 50.0)
+        assert not server.is_new_price_drop({"notified_price": 100.0}, 100.0 - percent / 2)
+        assert server.is_new_price_drop({"notified_price": 100.0}, 100.0 - percent)
@@ -0,0 +1,206 @@
+"""
+Price history: observations rolled up into hourly/daily buckets through the event writer,
+and the /products/{id}/price-history endpoint reading them.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+
+def record(inprocess_app, product_id, observations):
+    server = inprocess_app.server
+    for observed_at, price in observations:
+        server.record_price_observation(product_id, price, observed_at)
+    inprocess_app.run(server.event_writer.flush())
+
+
+def price_history(inprocess_app, product_id, **params):
+    return inprocess_app.request("GET", f"/api/products/{product_id}/price-history", params=params)
+
+
+def five_days_ago_at_ten():
+    day = (datetime.now(timezone.utc) - timedelta(days=5)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return day + timedelta(hours=10)
+
+
+class TestBucketRollup:
+    """Open/close/low/high/avg per bucket, across buffered and separately flushed observations"""
+
+    def test_observations_roll_up_per_hour_and_day(self, inprocess_app):
+        base = five_days_ago_at_ten()
+        # Buffered together: merged in the writer before the upsert
+        record(inprocess_app, "B0HISTORY1", [
+            (base + timedelta(minutes=5), 50.0),
+            (base + timedelta(minutes=20), 40.0),
+            (base + timedelta(minutes=40), 45.0),
+            (base + timedelta(hours=1, minutes=10), 60.0),
+            (base + timedelta(days=1), 30.0),
+        ])
+        # Flushed separately: applied to the existing bucket, which keeps its open
+        record(inprocess_app, "B0HISTORY1", [(base + timedelta(hours=1, minutes=20), 55.0)])
+
+        hourly = price_history(inprocess_app, "B0HISTORY1", days=7)
+        assert hourly.status_code == 200
+        body = hourly.json()
+        assert body["resolution"] == "hourly"
+        points = [{key: point[key] for key in ("open", "close", "low", "high", "avg", "count")} for point in body["points"]]
+        assert points == [
+            {"open": 50.0, "close": 45.0, "low": 40.0, "high": 50.0, "avg": 45.0, "count": 3},
+            {"open": 60.0, "close": 55.0, "low": 55.0, "high": 60.0, "avg": 57.5, "count": 2},
+            {"open": 30.0, "close": 30.0, "low": 30.0, "high": 30.0, "avg": 30.0, "count": 1},
+        ]
+        # Compared without the offset: bucket starts are UTC
+        assert [point["at"][:19] for point in body["points"]] == [
+            start.isoformat()[:19] for start in (base, base + timedelta(hours=1), base + timedelta(days=1))
+        ]
+
+        daily = price_history(inprocess_app, "B0HISTORY1", days=30)
+        assert daily.status_code == 200
+        body = daily.json()
+        assert body["resolution"] == "daily"
+        points = [{key: point[key] for key in ("open", "close", "low", "high", "avg", "count")} for point in body["points"]]
+        assert points == [
+            {"open": 50.0, "close": 55.0, "low": 40.0, "high": 60.0, "avg": 50.0, "count": 5},
+            {"open": 30.0, "close": 30.0, "low": 30.0, "high": 30.0, "avg": 30.0, "count": 1},
+        ]
+        assert (body["current_price"], body["lowest_price"], body["highest_price"]) == (30.0, 30.0, 60.0)
+
+    def test_raw_observations_are_kept(self, inprocess_app):
+        base = five_days_ago_at_ten()
+        record(inprocess_app, "B0HISTORY2", [(base, 20.0), (base + timedelta(minutes=1), 21.0)])
+        server = inprocess_app.server
+        raw = inprocess_app.run(server.db.price_observations.count_documents({"product_id": "B0HISTORY2"}))
+        assert raw == 2
+
+
+class TestPriceHistoryEndpoint:
+    """Resolution choice, range filtering and validation"""
+
+    def test_auto_resolution_follows_range(self, inprocess_app):
+        server = inprocess_app.server
+        hourly_max_days = server.PRICE_HISTORY_CONFIG["hourly_max_days"]
+        record(inprocess_app, "B0HISTORY3", [(five_days_ago_at_ten(), 10.0)])
+
+        short = price_history(inprocess_app, "B0HISTORY3", days=hourly_max_days).json()
+        long = price_history(inprocess_app, "B0HISTORY3", days=hourly_max_days + 1).json()
+        assert (short["resolution"], long["resolution"]) == ("hourly", "daily")
+        assert len(short["points"]) == len(long["points"]) == 1
+
+        explicit = price_history(inprocess_app, "B0HISTORY3", days=7, resolution="daily").json()
+        assert explicit["resolution"] == "daily"
+
+    def test_range_excludes_older_buckets(self, inprocess_app):
+        record(inprocess_app, "B0HISTORY4", [(five_days_ago_at_ten(), 10.0)])
+        body = price_history(inprocess_app, "B0HISTORY4", days=1).json()
+        assert body["points"] == []
+        assert body["current_price"] is None
+
+    def test_asin_is_matched_case_insensitively(self, inprocess_app):
+        record(inprocess_app, "B0HISTORY5", [(five_days_ago_at_ten(), 10.0)])
+        body = price_history(inprocess_app, "b0history5", days=7).json()
+        assert body["product_id"] == "B0HISTORY5"
+        assert len(body["points"]) == 1
+
+    @pytest.mark.parametrize("params", [
+        {"days": 0},
+        {"days": 5 * 365 + 1},
+        {"days": 7, "resolution": "weekly"},
+    ])
+    def test_invalid_parameters_are_rejected(self, inprocess_app, params):
+        assert price_history(inprocess_app, "B0HISTORY1", **params).status_code == 400
+
+
+class FailingCollection:
+    def __init__(self, error, during_write=None):
+        self.error = error
+        self.during_write = during_write
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.during_write:
+            self.during_write()
+        raise self.error
+
+
+class FailingDb:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+class TestBufferedUpdates:
+    """BufferedEventWriter.update merging, and re-queueing after a failed flush"""
+
+    KEY = {"product_id": "B0HISTORY9", "bucket": 1}
+
+    def writer(self, server, max_buffered=100):
+        return server.BufferedEventWriter(max_batch=100, flush_interval_seconds=60.0, max_buffered=max_buffered)
+
+    def pending(self, writer, collection="buckets"):
+        return writer.updates[(collection, tuple(sorted(self.KEY.items())))]
+
+    def test_updates_to_one_document_merge(self, inprocess_app):
+        writer = self.writer(inprocess_app.server)
+        writer.update("buckets", self.KEY, {"$setOnInsert": {"open": 5}, "$set": {"close": 5}, "$min": {"low": 5}, "$max": {"high": 5}, "$inc": {"count": 1}})
+        writer.update("buckets", self.KEY, {"$setOnInsert": {"open": 3}, "$set": {"close": 3}, "$min": {"low": 3}, "$max": {"high": 3}, "$inc": {"count": 1}})
+        writer.increment("buckets", self.KEY, {"count": 2})
+        writer.update("buckets", {**self.KEY, "bucket": 2}, {"$inc": {"count": 1}})
+
+        assert self.pending(writer) == {
+            "$setOnInsert": {"open": 5},
+            "$set": {"close": 3},
+            "$min": {"low": 3},
+            "$max": {"high": 5},
+            "$inc": {"count": 4},
+        }
+        assert writer.buffered == 2
+
+    def test_full_buffer_drops_new_documents_but_merges_pending_ones(self, inprocess_app):
+        writer = self.writer(inprocess_app.server, max_buffered=1)
+        writer.increment("buckets", self.KEY, {"count": 1})
+        writer.increment("buckets", {**self.KEY, "bucket": 2}, {"count": 1})
+        writer.increment("buckets", self.KEY, {"count": 1})
+
+        assert list(writer.updates) == [("buckets", tuple(sorted(self.KEY.items())))]
+        assert self.pending(writer) == {"$inc": {"count": 2}}
+        assert writer.stats["dropped"] == 1
+
+    def test_failed_flush_requeues_under_newer_updates(self, inprocess_app, monkeypatch):
+        server = inprocess_app.server
+        writer = self.writer(server)
+        writer.update("buckets", self.KEY, {"$setOnInsert": {"open": 5}, "$set": {"close": 5}, "$min": {"low": 5}, "$inc": {"count": 1}})
+
+        def queue_newer():
+            writer.update("buckets", self.KEY, {"$setOnInsert": {"open": 7}, "$set": {"close": 7}, "$min": {"low": 7}, "$inc": {"count": 1}})
+
+        monkeypatch.setattr(server, "db", FailingDb(FailingCollection(ConnectionError("mongo down"), queue_newer)))
+        inprocess_app.run(writer.flush())
+
+        assert self.pending(writer) == {
+            "$setOnInsert": {"open": 5},
+            "$set": {"close": 7},
+            "$min": {"low": 5},
+            "$inc": {"count": 2},
+        }
+        assert writer.buffered == 1
+        assert writer.stats["failed_flushes"] == 1
+
+    def test_partially_applied_bulk_write_is_not_retried(self, inprocess_app, monkeypatch):
+        from pymongo.errors import BulkWriteError
+
+        server = inprocess_app.server
+        writer = self.writer(server)
+        writer.increment("buckets", self.KEY, {"count": 1})
+
+        monkeypatch.setattr(server, "db", FailingDb(FailingCollection(BulkWriteError({"writeErrors": []}))))
+        inprocess_app.run(writer.flush())
+
+        assert writer.updates == {}
+        assert writer.buffered == 0
@@ -0,0 +1,165 @@
+"""
+Partition leases shared by replicas (WorkCoordinator / PartitionLeases in server.py), with two
+coordinators standing in for two replicas against the harness database.
+Runs on mongomock-motor, or on LOAD_TEST_MONGO_URL when set.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+if not os.environ.get("LOAD_TEST_MONGO_URL"):
+    pytest.importorskip("mongomock_motor")
+
+JOB = "price_alerts"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def app_coordinator_stopped(inprocess_app):
+    """The app's own heartbeat loop would register a third member"""
+    server = inprocess_app.server
+    for task in server.background_tasks:
+        if task.get_coro().__name__ == "work_coordination_loop":
+            task.cancel()
+    inprocess_app.run(asyncio.sleep(0))
+    inprocess_app.run(server.work_coordinator.release())
+
+
+@pytest.fixture
+def replicas(inprocess_app):
+    """Two coordinators with the price_alerts job, on empty work_leases/work_members"""
+    server = inprocess_app.server
+    inprocess_app.run(server.db.work_leases.delete_many({}))
+    inprocess_app.run(server.db.work_members.delete_many({}))
+    coordinators = [server.WorkCoordinator(owner_id) for owner_id in ("replica-a", "replica-b")]
+    for coordinator in coordinators:
+        coordinator.job(JOB)
+    return coordinators
+
+
+def heartbeat(inprocess_app, *coordinators):
+    for coordinator in coordinators:
+        inprocess_app.run(coordinator.heartbeat())
+
+
+def split(inprocess_app, a, b):
+    """Heartbeats until both hold a share: `a` claims everything first, then hands half to `b`"""
+    heartbeat(inprocess_app, a, b, a, b)
+    return set(a.job(JOB).held_partitions()), set(b.job(JOB).held_partitions())
+
+
+class TestLeases:
+    """Fair split, takeover and handoff"""
+
+    def test_partitions_split_fairly_without_overlap(self, inprocess_app, replicas):
+        partitions = inprocess_app.server.COORDINATION_CONFIG["partitions"]
+        held_a, held_b = split(inprocess_app, *replicas)
+        assert len(held_a) == len(held_b) == partitions // 2
+        assert held_a.isdisjoint(held_b)
+        assert held_a | held_b == set(range(partitions))
+
+        # Further heartbeats keep the split
+        heartbeat(inprocess_app, *replicas)
+        assert (set(replicas[0].job(JOB).held_partitions()), set(replicas[1].job(JOB).held_partitions())) == (held_a, held_b)
+
+    def test_partitions_taken_over_after_missed_heartbeats(self, inprocess_app, replicas, monkeypatch):
+        server = inprocess_app.server
+        monkeypatch.setitem(server.COORDINATION_CONFIG, "lease_seconds", 0.6)
+        monkeypatch.setitem(server.COORDINATION_CONFIG, "heartbeat_seconds", 0.1)
+        a, b = replicas
+        held_a, _ = split(inprocess_app, a, b)
+
+        # `a` stops heartbeating: its leases are still valid, so `b` can't claim them yet
+        heartbeat(inprocess_app, b)
+        assert set(b.job(JOB).held_partitions()).isdisjoint(held_a)
+
+        inprocess_app.run(asyncio.sleep(0.7))
+        assert a.job(JOB).held_partitions() == []
+        heartbeat(inprocess_app, b)
+        assert b.members == 1
+        assert b.job(JOB).held_partitions() == list(range(server.COORDINATION_CONFIG["partitions"]))
+
+    def test_release_hands_partitions_over_at_next_heartbeat(self, inprocess_app, replicas):
+        server = inprocess_app.server
+        a, b = replicas
+        split(inprocess_app, a, b)
+
+        inprocess_app.run(a.release())
+        assert a.job(JOB).held_partitions() == []
+        assert inprocess_app.run(server.db.work_members.find_one({"_id": "replica-a"})) is None
+
+        heartbeat(inprocess_app, b)
+        assert b.job(JOB).held_partitions() == list(range(server.COORDINATION_CONFIG["partitions"]))
+
+    def test_snapshot_reports_owner(self, inprocess_app, replicas):
+        heartbeat(inprocess_app, replicas[0])
+        snapshot = replicas[0].snapshot()
+        assert snapshot["instance_id"] == "replica-a"
+        assert snapshot["held"][JOB] == list(range(snapshot["partitions"]))
+
+
+class TestAlertSweep:
+    """Each due alert is checked by exactly one replica"""
+
+    def test_no_alert_checked_by_both_replicas(self, inprocess_app, replicas, monkeypatch):
+        server = inprocess_app.server
+        long_ago = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+        inprocess_app.run(server.db.price_alerts.insert_many([
+            {
+                "id": f"sweep-alert-{i}",
+                "user_id": f"sweep-user-{i}",
+                "product_url": "https://www.amazon.com/dp/B000000000",
+                "product_name": "Sweep",
+                "target_price": 1.0,
+                "is_active": True,
+                "last_checked": long_ago,
+            } for i in range(40)
+        ]))
+        inprocess_app.run(server.db.price_alerts.update_many({}, {"$set": {"last_checked": long_ago}}))
+        due = {alert["id"] for alert in inprocess_app.run(server.db.price_alerts.find({"is_active": True}).to_list(None))}
+
+        checked = {}
+        sweeping = None
+
+        async def record_check(alerts, users):
+            checked.setdefault(sweeping, []).extend(alert["id"] for alert in alerts)
+            return {"dropped": [], "emails_sent": 0}
+
+        monkeypatch.setattr(server, "check_alerts", record_check)
+        a, b = replicas
+        split(inprocess_app, a, b)
+        for coordinator in replicas:
+            sweeping = coordinator.owner_id
+            inprocess_app.run(server.run_price_alert_sweep(coordinator.job(JOB)))
+
+        checked_a, checked_b = set(checked.get("replica-a", [])), set(checked.get("replica-b", []))
+        assert checked_a and checked_b
+        assert len(checked_a) == len(checked["replica-a"])
+        assert checked_a.isdisjoint(checked_b)
+        assert checked_a | checked_b == due
+
+    def test_sweep_skips_partitions_lost_mid_run(self, inprocess_app, replicas, monkeypatch):
+        server = inprocess_app.server
+        long_ago = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+        # More than one chunk of 50
+        inprocess_app.run(server.db.price_alerts.insert_many([
+            {"id": f"lost-alert-{i}", "user_id": f"lost-user-{i}", "product_url": "https://www.amazon.com/dp/B000000000",
+             "product_name": "Lost", "target_price": 1.0, "is_active": True, "last_checked": long_ago}
+            for i in range(60)
+        ]))
+        a, _ = replicas
+        heartbeat(inprocess_app, a)
+        leases = a.job(JOB)
+        checked = []
+
+        async def lose_leases_after_first_chunk(alerts, users):
+            checked.append(len(alerts))
+            leases.owned = set()
+            return {"dropped": [], "emails_sent": 0}
+
+        monkeypatch.setitem(server.ALERT_SWEEP_CONFIG, "max_alerts_per_run", 10 ** 4)
+        monkeypatch.setattr(server, "check_alerts", lose_leases_after_first_chunk)
+        inprocess_app.run(server.run_price_alert_sweep(leases))
+        assert len(checked) == 1